@@ -0,0 +1,454 @@
+#!/usr/bin/env python3
+"""Benchmark comment thread reconstruction on synthetic changes.
+
+Reports wall time and, for fetch_threads(), peak traced memory.
+
+With --micro, times the pure functions on the bot's hot path at several
+input sizes instead. Times are reported in units of a fixed reference
+workload run on the same machine, so they can be compared against the
+baselines stored in bench_baseline.json: --check fails when a function
+got slower than its baseline by more than --threshold.
+
+Run with: python3 bench_comments.py [--comments 100000] [--depth 1000]
+          python3 bench_comments.py --check [--size 10000]
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from collections.abc import Callable
+from datetime import datetime, timedelta
+
+from get_comments import (
+    build_threads_by_reply_chain,
+    collect_threads,
+    fetch_comments,
+    fetch_threads,
+    json_default,
+    parse_gerrit_timestamp,
+    timestamp_key,
+)
+from gerrit_utils import parse_change_url
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             "bench_baseline.json")
+MICRO_SIZES = (1_000, 10_000, 100_000)
+# Allowed slowdown over the baseline before --check fails
+DEFAULT_THRESHOLD = 1.5
+
+BOTS = ["CI Bot", "Lint Bot", "Build Bot"]
+HUMANS = ["Alice", "Bob", "Carol", "Dave"]
+
+
+def make_comments(count: int, depth: int = 100, files: int = 50,
+                  seed: int = 0) -> dict[str, list[dict]]:
+    """Generate a synthetic Gerrit comments response.
+
+    Comments form threads of up to ``depth`` replies, the shape of a bot
+    answering itself on every CI run. Replies are spread over files in
+    random order, as Gerrit groups comments by file and not by thread.
+
+    Args:
+        count: Total number of comments.
+        depth: Maximum number of comments per thread.
+        files: Number of files the threads are spread over.
+        seed: Random seed, for reproducible inputs.
+
+    Returns:
+        Dict of {file_path: [comment, ...]} like the comments endpoint.
+    """
+    rng = random.Random(seed)
+    start = datetime(2026, 1, 1)
+    raw: dict[str, list[dict]] = {}
+    made = 0
+    thread = 0
+    while made < count:
+        path = f"src/module{thread % files}/file{thread % (files * 3)}.c"
+        length = min(count - made, rng.randint(1, depth))
+        line = rng.randint(1, 2000)
+        parent = None
+        for i in range(length):
+            cid = f"{thread:08x}_{i:06x}"
+            author = rng.choice(BOTS if i % 2 else HUMANS)
+            updated = start + timedelta(seconds=made * 7 + rng.randint(0, 6))
+            comment = {
+                "id": cid,
+                "patch_set": 1 + i // 10,
+                "line": line,
+                "author": {"_account_id": hash(author) & 0xFFFF, "name": author},
+                "message": f"Build {i} of thread {thread} failed: see log",
+                "updated": updated.strftime("%Y-%m-%d %H:%M:%S.%f000"),
+                "unresolved": rng.random() < 0.5,
+            }
+            if parent is not None:
+                comment["in_reply_to"] = parent
+            raw.setdefault(path, []).append(comment)
+            parent = cid
+            made += 1
+        thread += 1
+
+    for items in raw.values():
+        rng.shuffle(items)
+    return raw
+
+
+class StaticResponse:
+    """Streamed response stand-in serving pre-encoded bytes."""
+
+    status_code = 200
+    encoding = "utf-8"
+
+    def __init__(self, body: bytes):
+        self.body = body
+        self.headers: dict[str, str] = {}
+
+    def iter_content(self, chunk_size: int):
+        for i in range(0, len(self.body), chunk_size):
+            yield self.body[i:i + chunk_size]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class StaticClient:
+    """Client stand-in serving one change from pre-encoded JSON.
+
+    Responses are decoded on every call, as a real client would, so the
+    measurements include the cost of holding the decoded payload.
+    """
+
+    def __init__(self, raw: dict[str, list[dict]]):
+        self.comments = (")]}'\n" + json.dumps(raw)).encode("utf-8")
+        self.change = json.dumps(
+            {"current_revision": "abc", "revisions": {"abc": {"_number": 1}}}
+        )
+        self.requester = self
+
+    def get_endpoint_url(self, endpoint: str) -> str:
+        return endpoint
+
+    def get(self, endpoint: str, stream: bool = False, **kwargs):
+        if stream:
+            return StaticResponse(self.comments)
+        return json.loads(self.change)
+
+    @staticmethod
+    def confirm_status(response) -> None:
+        pass
+
+
+class NullWriter:
+    """Text sink counting the bytes written to it."""
+
+    def __init__(self):
+        self.size = 0
+
+    def write(self, text: str) -> int:
+        self.size += len(text)
+        return len(text)
+
+
+def peak_memory(func) -> int:
+    """Return the peak traced allocation size of one func() call, in bytes."""
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def bench(func, repeat: int) -> float:
+    """Return the best wall time of ``repeat`` runs of func, in seconds."""
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def bench_threads(count: int, depth: int, repeat: int) -> dict:
+    """Benchmark build_threads_by_reply_chain() on one synthetic change."""
+    raw = make_comments(count, depth)
+    by_id = {c["id"]: c for items in raw.values() for c in items}
+    seconds = bench(lambda: build_threads_by_reply_chain(raw, by_id), repeat)
+    return {
+        "name": "build_threads_by_reply_chain",
+        "comments": count,
+        "depth": depth,
+        "seconds": round(seconds, 6),
+    }
+
+
+def bench_fetch(count: int, depth: int, repeat: int) -> dict:
+    """Benchmark fetch_threads() plus JSON output on one synthetic change.
+
+    The client is served from memory, so only decoding, grouping, sorting
+    and serialization are measured, the way get_comments.py runs them.
+    """
+    client = StaticClient(make_comments(count, depth))
+
+    def run():
+        data = fetch_threads("https://gerrit.example.com", "1",
+                             unresolved_only=False, client=client)
+        json.dump(data, NullWriter(), ensure_ascii=False, indent=2,
+                  default=json_default)
+
+    seconds = bench(run, repeat)
+    return {
+        "name": "fetch_threads",
+        "comments": count,
+        "depth": depth,
+        "seconds": round(seconds, 6),
+        "peak_bytes": peak_memory(run),
+    }
+
+
+def make_timestamps(count: int, seed: int = 0) -> list[str]:
+    """Generate Gerrit timestamps, a tenth of them without nanoseconds."""
+    rng = random.Random(seed)
+    start = datetime(2026, 1, 1)
+    values = []
+    for i in range(count):
+        ts = start + timedelta(seconds=rng.randint(0, 10_000_000),
+                               microseconds=rng.randint(0, 999_999))
+        fmt = "%Y-%m-%d %H:%M:%S" if i % 10 == 0 else "%Y-%m-%d %H:%M:%S.%f000"
+        values.append(ts.strftime(fmt))
+    return values
+
+
+def make_change_urls(count: int, seed: int = 0) -> list[str]:
+    """Generate change URLs in the forms users paste them."""
+    rng = random.Random(seed)
+    forms = [
+        "https://gerrit.example.com/c/project/+/{n}",
+        "https://gerrit.example.com/c/group/sub/project/+/{n}/3",
+        "https://review.example.org/c/project/+/{n}/2/src/main.c",
+    ]
+    return [rng.choice(forms).format(n=rng.randint(1, 999_999)) for _ in range(count)]
+
+
+def _reference_work() -> None:
+    """Fixed workload the microbenchmark times are expressed in.
+
+    Dict building, string formatting and sorting, the same mix of
+    interpreter work as the measured functions.
+    """
+    keys = [f"{i * 7919 % 100_003:08x}" for i in range(20_000)]
+    table = {k: int(k, 16) for k in keys}
+    sorted(keys, key=table.__getitem__)
+
+
+def bench_call(func, repeat: int, min_time: float = 0.05) -> float:
+    """Return the best time of one func() call over ``repeat`` samples.
+
+    After a warm-up call, each sample loops func until it takes at least
+    ``min_time`` seconds, so fast calls are not lost in timer noise.
+    """
+    func()
+    loops = 1
+    while True:
+        t0 = time.perf_counter()
+        for _ in range(loops):
+            func()
+        elapsed = time.perf_counter() - t0
+        if elapsed >= min_time:
+            break
+        loops = max(loops * 2, int(loops * min_time / max(elapsed, 1e-9)))
+    best = elapsed / loops
+    for _ in range(repeat - 1):
+        t0 = time.perf_counter()
+        for _ in range(loops):
+            func()
+        best = min(best, (time.perf_counter() - t0) / loops)
+    return best
+
+
+def _micro_timestamps(size: int) -> Callable[[], object]:
+    values = make_timestamps(size)
+    return lambda: [parse_gerrit_timestamp(v) for v in values]
+
+
+def _micro_timestamp_keys(size: int) -> Callable[[], object]:
+    values = make_timestamps(size)
+    return lambda: [timestamp_key(v) for v in values]
+
+
+def _micro_change_urls(size: int) -> Callable[[], object]:
+    urls = make_change_urls(size)
+    return lambda: [parse_change_url(u) for u in urls]
+
+
+def _micro_reply_chains(size: int) -> Callable[[], object]:
+    raw = make_comments(size)
+    by_id = {c["id"]: c for items in raw.values() for c in items}
+    return lambda: build_threads_by_reply_chain(raw, by_id)
+
+
+def _micro_collect(size: int) -> Callable[[], object]:
+    # Pairs rather than the dict, which collect_threads() would consume
+    pairs = [(path, c) for path, items in make_comments(size).items() for c in items]
+    return lambda: collect_threads(pairs, unresolved_only=False)
+
+
+def _micro_fetch(size: int) -> Callable[[], object]:
+    client = StaticClient(make_comments(size))
+    return lambda: fetch_comments("https://gerrit.example.com", "1",
+                                  unresolved_only=False, client=client)
+
+
+# Name -> setup(size), which builds the input and returns the timed call
+MICRO_BENCHMARKS: dict[str, Callable[[int], Callable[[], object]]] = {
+    "parse_gerrit_timestamp": _micro_timestamps,
+    "timestamp_key": _micro_timestamp_keys,
+    "parse_change_url": _micro_change_urls,
+    "build_threads_by_reply_chain": _micro_reply_chains,
+    "collect_threads": _micro_collect,
+    "fetch_comments": _micro_fetch,
+}
+
+
+def run_micro(sizes: list[int], repeat: int = 5,
+              names: list[str] | None = None) -> list[dict]:
+    """Time each microbenchmark at each input size.
+
+    The reference workload is timed right before and after every
+    measurement and the faster run is the unit, so frequency scaling or
+    a busy machine affects both sides alike.
+
+    Returns:
+        List of {'name', 'size', 'seconds', 'units'} dicts, where 'units'
+        is the time in multiples of the reference workload.
+    """
+    results = []
+    for name in names or MICRO_BENCHMARKS:
+        for size in sizes:
+            run = MICRO_BENCHMARKS[name](size)
+            before = bench_call(_reference_work, repeat)
+            seconds = bench_call(run, repeat)
+            unit = min(before, bench_call(_reference_work, repeat))
+            results.append({"name": name, "size": size,
+                            "seconds": round(seconds, 6),
+                            "units": round(seconds / unit, 4)})
+    return results
+
+
+def load_baseline(path: str) -> dict:
+    """Load stored baselines; a missing file has none."""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"units": {}}
+
+
+def save_baseline(path: str, results: list[dict]) -> dict:
+    """Store results as baselines, keeping those of other sizes and names."""
+    units = load_baseline(path).get("units", {})
+    for result in results:
+        units.setdefault(result["name"], {})[str(result["size"])] = result["units"]
+    baseline = {
+        "python": platform.python_version(),
+        "units": {name: dict(sorted(units[name].items(), key=lambda kv: int(kv[0])))
+                  for name in sorted(units)},
+    }
+    with open(path, "w") as f:
+        json.dump(baseline, f, indent=2)
+        f.write("\n")
+    return baseline
+
+
+def check_baseline(results: list[dict], baseline: dict,
+                   threshold: float = DEFAULT_THRESHOLD) -> list[dict]:
+    """Compare results against baselines.
+
+    Each result gains 'baseline' (None without one) and 'ratio', its
+    slowdown over the baseline.
+
+    Returns:
+        The results whose ratio exceeds ``threshold``.
+    """
+    regressions = []
+    units = baseline.get("units", {})
+    for result in results:
+        expected = units.get(result["name"], {}).get(str(result["size"]))
+        result["baseline"] = expected
+        result["ratio"] = round(result["units"] / expected, 3) if expected else None
+        if result["ratio"] is not None and result["ratio"] > threshold:
+            regressions.append(result)
+    return regressions
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Benchmark comment thread reconstruction"
+    )
+    parser.add_argument("--comments", type=int, default=100_000,
+                        help="Comments per synthetic change (default: 100000)")
+    parser.add_argument("--depth", type=int, action="append",
+                        help="Maximum reply chain length; repeatable "
+                             "(default: 10, 1000 and 10000)")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Runs per measurement, best is reported (default: 3)")
+    parser.add_argument("--micro", action="store_true",
+                        help="Time the hot path pure functions instead")
+    parser.add_argument("--size", type=int, action="append",
+                        help="Input size for --micro; repeatable "
+                             "(default: 1000, 10000 and 100000)")
+    parser.add_argument("--only", action="append", choices=sorted(MICRO_BENCHMARKS),
+                        help="Run only this microbenchmark; repeatable")
+    parser.add_argument("--baseline", default=BASELINE_PATH,
+                        help="Baseline file (default: bench_baseline.json)")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--check", action="store_true",
+                      help="Run --micro and exit 1 if a function is slower "
+                           "than its baseline by more than --threshold")
+    mode.add_argument("--save-baseline", action="store_true",
+                      help="Run --micro and store the results as baselines")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="Allowed slowdown ratio for --check "
+                             f"(default: {DEFAULT_THRESHOLD})")
+    args = parser.parse_args(argv)
+
+    if args.micro or args.check or args.save_baseline:
+        return _run_micro(args)
+
+    for depth in args.depth or [10, 1000, 10_000]:
+        for func in (bench_threads, bench_fetch):
+            result = func(args.comments, depth, args.repeat)
+            print(json.dumps(result), flush=True)
+    return 0
+
+
+def _run_micro(args: argparse.Namespace) -> int:
+    # Single runs are too noisy to gate on
+    results = run_micro(args.size or list(MICRO_SIZES), max(args.repeat, 5), args.only)
+    if args.save_baseline:
+        save_baseline(args.baseline, results)
+    regressions = []
+    if args.check:
+        regressions = check_baseline(results, load_baseline(args.baseline),
+                                     args.threshold)
+    for result in results:
+        print(json.dumps(result), flush=True)
+    if args.check:
+        print(json.dumps({
+            "check": "fail" if regressions else "pass",
+            "threshold": args.threshold,
+            "regressions": [f"{r['name']}@{r['size']}" for r in regressions],
+        }))
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
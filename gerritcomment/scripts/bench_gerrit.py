@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""End-to-end benchmark of the scripts against fake_gerrit.py.
+
+Runs get_comments.py and post_comment.py as separate processes, the way
+they are used, against a local fake Gerrit serving synthetic changes of
+increasing size. For each operation it reports the HTTP requests made,
+the best wall time including interpreter startup, and the peak RSS.
+
+Run with: python3 bench_gerrit.py [--size 100 --size 10000] [--latency 0.02]
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from bench_comments import make_comments
+from fake_gerrit import FakeGerrit
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def run_script(args: list[str], env: dict[str, str]) -> tuple[float, int]:
+    """Run one script to completion.
+
+    Returns:
+        Tuple of (wall time in seconds, peak RSS in KiB).
+
+    Raises:
+        RuntimeError: When the script fails.
+    """
+    with tempfile.TemporaryFile() as output:
+        t0 = time.perf_counter()
+        proc = subprocess.Popen([sys.executable, *args], cwd=SCRIPTS_DIR, env=env,
+                                stdout=output, stderr=subprocess.STDOUT)
+        # wait4() reports the resource usage of this child alone
+        _, status, usage = os.wait4(proc.pid, 0)
+        seconds = time.perf_counter() - t0
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        if proc.returncode != 0:
+            output.seek(0)
+            raise RuntimeError(f"{args[0]} exited with {proc.returncode}: "
+                               f"{output.read().decode(errors='replace')}")
+    return seconds, usage.ru_maxrss
+
+
+class Bench:
+    """Fake server plus a clean environment for the scripts."""
+
+    def __init__(self, server: FakeGerrit, workdir: str, repeat: int):
+        self.server = server
+        self.workdir = workdir
+        self.repeat = repeat
+        self.env = {k: v for k, v in os.environ.items() if not k.startswith("GERRIT_")}
+        self.env.update({
+            "GERRIT_BASE_URL": server.url,
+            "GERRIT_USER": "bench",
+            "GERRIT_HTTP_PASSWORD": "secret",
+            "GERRIT_DAEMON": "0",
+        })
+        self._next_change = 1
+
+    def new_change(self, comments: int = 0,
+                   files: dict[str, str] | None = None) -> str:
+        """Add a synthetic change with ``comments`` comments; returns its number."""
+        number = self._next_change
+        self._next_change += 1
+        self.server.add_change(number, make_comments(comments, seed=number),
+                               patchsets=3, files=files)
+        return str(number)
+
+    def measure(self, name: str, size: int, args: list[str],
+                warm: bool = False, repeat: int | None = None) -> dict:
+        """Measure a script run; with ``warm``, after one unmeasured run.
+
+        Requests are counted for the first measured run. Runs are repeated
+        ``repeat`` times (default: the bench setting), so operations that
+        change the server should be measured once.
+        """
+        if warm:
+            run_script(args, self.env)
+        best, peak, requests = float("inf"), 0, None
+        for _ in range(repeat or self.repeat):
+            self.server.reset_requests()
+            seconds, rss = run_script(args, self.env)
+            if requests is None:
+                requests = self.server.request_count()
+            best, peak = min(best, seconds), max(peak, rss)
+        return {
+            "name": name,
+            "comments": size,
+            "requests": requests,
+            "seconds": round(best, 4),
+            "peak_rss_kb": peak,
+        }
+
+    def review_file(self, size: int) -> tuple[str, dict[str, str]]:
+        """Write a review with ``size`` inline comments.
+
+        Returns:
+            Tuple of ('@path' for --comments-json, {path: text} of files
+            the review's comments fit in).
+        """
+        comments = make_comments(size, depth=1, files=20, seed=size)
+        review = {
+            "message": "Benchmark review",
+            "tag": "autogenerated:bench",
+            "comments": {
+                path: [{"line": c["line"], "message": c["message"]} for c in items]
+                for path, items in comments.items()
+            },
+        }
+        path = os.path.join(self.workdir, f"review-{size}.json")
+        with open(path, "w") as f:
+            json.dump(review, f)
+        text = "".join(f"line {i}\n" for i in range(1, 2001))
+        return "@" + path, dict.fromkeys(comments, text)
+
+
+def bench_size(bench: Bench, size: int) -> list[dict]:
+    """Benchmark every operation on changes with ``size`` comments."""
+    results = []
+    change = bench.new_change(size)
+    fetch = ["get_comments.py", "--change", change, "--all"]
+    results.append(bench.measure("get_comments", size, fetch))
+
+    cache_dir = os.path.join(bench.workdir, f"cache-{size}")
+    results.append(bench.measure("get_comments --cache", size,
+                                 fetch + ["--cache-dir", cache_dir], warm=True))
+    # One file fetch per (patch set, file), however many threads
+    results.append(bench.measure(
+        "get_comments --context", size,
+        fetch + ["--context", "3",
+                 "--cache-dir", os.path.join(bench.workdir, f"context-{size}")],
+        repeat=1,
+    ))
+
+    # Posting changes the server, so each post goes to a fresh change
+    review, files = bench.review_file(size)
+    results.append(bench.measure(
+        "post_comment", size,
+        ["post_comment.py", "--change", bench.new_change(files=files),
+         "--comments-json", review],
+        repeat=1,
+    ))
+    results.append(bench.measure(
+        "post_comment --preflight", size,
+        ["post_comment.py", "--change", bench.new_change(files=files),
+         "--comments-json", review, "--preflight",
+         "--cache-dir", os.path.join(bench.workdir, "preflight-cache")],
+        repeat=1,
+    ))
+    return results
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Benchmark the scripts end to end against a fake Gerrit"
+    )
+    parser.add_argument("--size", type=int, action="append",
+                        help="Comments per change; repeatable "
+                             "(default: 100, 1000 and 10000)")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="Seconds the fake server adds per request (default: 0)")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Runs per read measurement, best is reported (default: 3)")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as workdir, \
+            FakeGerrit(latency=args.latency) as server:
+        bench = Bench(server, workdir, args.repeat)
+        for size in args.size or [100, 1000, 10_000]:
+            for result in bench_size(bench, size):
+                print(json.dumps(result), flush=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
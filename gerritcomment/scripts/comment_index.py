@@ -0,0 +1,374 @@
+#!/usr/bin/env python3
+"""On-disk SQLite index of review comment threads.
+
+get_comments.py --index syncs changes into the index incrementally: each
+change keeps the watermark of its newest indexed comment, and later syncs
+only fetch threads with newer activity, replacing their stored copies.
+search_comments.py queries it offline by file, author, text and
+resolution state. Comment text is indexed with FTS5 where SQLite has it,
+and matched with LIKE otherwise.
+"""
+from __future__ import annotations
+
+import json
+import os
+import sqlite3
+import time
+from typing import Iterable, Iterator
+
+from gerrit_cache import default_cache_dir
+from gerrit_utils import GerritError
+
+INDEX_ENV = "GERRIT_INDEX"
+
+DEFAULT_SEARCH_LIMIT = 50
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS changes (
+    id INTEGER PRIMARY KEY,
+    server TEXT NOT NULL,
+    change TEXT NOT NULL,
+    latest_patchset INTEGER,
+    watermark TEXT,
+    synced REAL,
+    UNIQUE (server, change)
+);
+CREATE INDEX IF NOT EXISTS changes_change ON changes (change);
+CREATE TABLE IF NOT EXISTS threads (
+    id INTEGER PRIMARY KEY,
+    change_id INTEGER NOT NULL REFERENCES changes (id),
+    root TEXT NOT NULL,
+    file TEXT,
+    line INTEGER,
+    range TEXT,
+    unresolved INTEGER NOT NULL,
+    updated TEXT,
+    UNIQUE (change_id, root)
+);
+CREATE INDEX IF NOT EXISTS threads_change ON threads (change_id, updated);
+CREATE INDEX IF NOT EXISTS threads_file ON threads (file);
+CREATE INDEX IF NOT EXISTS threads_updated ON threads (updated);
+CREATE TABLE IF NOT EXISTS comments (
+    id INTEGER PRIMARY KEY,
+    thread_id INTEGER NOT NULL REFERENCES threads (id),
+    comment_id TEXT,
+    in_reply_to TEXT,
+    patch_set INTEGER,
+    author TEXT,
+    message TEXT,
+    updated TEXT,
+    unresolved INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS comments_thread ON comments (thread_id);
+CREATE INDEX IF NOT EXISTS comments_author ON comments (author COLLATE NOCASE);
+"""
+
+# External-content FTS table kept in sync with comments by triggers
+_FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS comments_fts USING fts5 (
+    message, content='comments', content_rowid='id'
+);
+CREATE TRIGGER IF NOT EXISTS comments_ai AFTER INSERT ON comments BEGIN
+    INSERT INTO comments_fts (rowid, message) VALUES (new.id, new.message);
+END;
+CREATE TRIGGER IF NOT EXISTS comments_ad AFTER DELETE ON comments BEGIN
+    INSERT INTO comments_fts (comments_fts, rowid, message)
+    VALUES ('delete', old.id, old.message);
+END;
+"""
+
+
+def default_index_path() -> str:
+    """Return the index file: $GERRIT_INDEX or comments.sqlite in the cache dir."""
+    path = os.environ.get(INDEX_ENV, "").strip()
+    if path:
+        return path
+    return os.path.join(default_cache_dir(), "comments.sqlite")
+
+
+def _has_fts5(conn: sqlite3.Connection) -> bool:
+    try:
+        conn.execute("CREATE VIRTUAL TABLE temp.fts5_probe USING fts5 (x)")
+    except sqlite3.OperationalError:
+        return False
+    conn.execute("DROP TABLE temp.fts5_probe")
+    return True
+
+
+def _thread_dict(thread) -> dict:
+    """Return the dict form of a get_comments Thread or thread dict."""
+    return thread if isinstance(thread, dict) else thread.to_dict()
+
+
+class CommentIndex:
+    """SQLite store of comment threads, keyed by server and change.
+
+    Args:
+        path: Database file; defaults to default_index_path(). ':memory:'
+            gives a throwaway index.
+
+    Raises:
+        GerritError: When the database cannot be opened or created.
+    """
+
+    def __init__(self, path: str | None = None):
+        self.path = path or default_index_path()
+        try:
+            if self.path != ":memory:":
+                directory = os.path.dirname(os.path.abspath(self.path))
+                os.makedirs(directory, mode=0o700, exist_ok=True)
+            self._conn = sqlite3.connect(self.path)
+            # Syncs from several processes wait for each other's writes
+            self._conn.execute("PRAGMA busy_timeout = 5000")
+            self._conn.execute("PRAGMA journal_mode = WAL")
+            # Durable enough for a rebuildable index, without a sync per commit
+            self._conn.execute("PRAGMA synchronous = NORMAL")
+            self.fts = _has_fts5(self._conn)
+            with self._conn:
+                self._conn.executescript(_SCHEMA)
+                if self.fts:
+                    self._conn.executescript(_FTS_SCHEMA)
+        except (OSError, sqlite3.Error) as e:
+            raise GerritError(f"Cannot open comment index {self.path}: {e}")
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def __enter__(self) -> CommentIndex:
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def watermarks(self, server: str) -> dict[str, str]:
+        """Return {change number: watermark} of the changes indexed from server."""
+        rows = self._conn.execute(
+            "SELECT change, watermark FROM changes "
+            "WHERE server = ? AND watermark IS NOT NULL",
+            (server.rstrip("/"),),
+        )
+        return dict(rows)
+
+    def sync(self, server: str, result: dict) -> int:
+        """Store a get_comments change result.
+
+        The result must hold every thread with activity after the change's
+        stored watermark, resolved or not (a fetch with unresolved_only=False
+        and since=watermark); those threads replace their stored copies.
+
+        Args:
+            server: Gerrit base URL the change was fetched from.
+            result: Successful result of get_change_result().
+
+        Returns:
+            Number of threads written.
+
+        Raises:
+            GerritError: When the database cannot be written.
+        """
+        try:
+            with self._conn:
+                return self._sync(server.rstrip("/"), result)
+        except sqlite3.Error as e:
+            raise GerritError(f"Cannot write comment index {self.path}: {e}")
+
+    def _sync(self, server: str, result: dict) -> int:
+        conn = self._conn
+        # The same change given by number or Change-Id gets one row
+        change = str(result.get("number") or result["change"])
+        conn.execute(
+            "INSERT INTO changes (server, change) VALUES (?, ?) "
+            "ON CONFLICT (server, change) DO NOTHING",
+            (server, change),
+        )
+        change_id, watermark = conn.execute(
+            "SELECT id, watermark FROM changes WHERE server = ? AND change = ?",
+            (server, change),
+        ).fetchone()
+        new_watermark = result.get("watermark")
+        if watermark and (not new_watermark or watermark > new_watermark):
+            # Fixed-width Gerrit timestamps compare as strings
+            new_watermark = watermark
+        conn.execute(
+            "UPDATE changes SET latest_patchset = ?, watermark = ?, synced = ? "
+            "WHERE id = ?",
+            (result.get("latest_patchset"), new_watermark, time.time(), change_id),
+        )
+
+        written = 0
+        for thread in result.get("threads", []):
+            data = _thread_dict(thread)
+            comments = data["comments"]
+            if not comments:
+                continue
+            root = comments[0]["id"]
+            row = conn.execute(
+                "SELECT id FROM threads WHERE change_id = ? AND root = ?",
+                (change_id, root),
+            ).fetchone()
+            values = (data.get("file"), data.get("line"),
+                      json.dumps(data["range"]) if data.get("range") else None,
+                      int(bool(data.get("unresolved"))), data.get("updated"))
+            if row is None:
+                thread_id = conn.execute(
+                    "INSERT INTO threads (change_id, root, file, line, range, "
+                    "unresolved, updated) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (change_id, root, *values),
+                ).lastrowid
+            else:
+                thread_id = row[0]
+                conn.execute(
+                    "UPDATE threads SET file = ?, line = ?, range = ?, "
+                    "unresolved = ?, updated = ? WHERE id = ?",
+                    (*values, thread_id),
+                )
+                conn.execute("DELETE FROM comments WHERE thread_id = ?", (thread_id,))
+            conn.executemany(
+                "INSERT INTO comments (thread_id, comment_id, in_reply_to, "
+                "patch_set, author, message, updated, unresolved) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(thread_id, c.get("id"), c.get("in_reply_to"), c.get("patch_set"),
+                  c.get("author"), c.get("message"), c.get("updated"),
+                  int(bool(c.get("unresolved")))) for c in comments],
+            )
+            written += 1
+        return written
+
+    def search(self, text: str | None = None, file: str | None = None,
+               author: str | None = None, unresolved: bool | None = None,
+               change: str | None = None,
+               limit: int | None = DEFAULT_SEARCH_LIMIT) -> list[dict]:
+        """Find threads, newest activity first.
+
+        Args:
+            text: Words that one comment of the thread must contain, in FTS5
+                query syntax (e.g. 'null pointer', '"exact phrase"',
+                'leak OR overflow'); a plain substring without FTS5.
+            file: Glob matched against the thread's file, e.g. 'src/*.c'.
+            author: Name of a thread participant, case-insensitive.
+            unresolved: True or False to filter on resolution state.
+            change: Only threads of this change number.
+            limit: Maximum threads returned; None for all.
+
+        Returns:
+            Threads in the get_comments output shape, each with its 'change'.
+
+        Raises:
+            GerritError: On invalid search syntax.
+        """
+        where, params = [], []
+        if text:
+            if self.fts:
+                where.append("t.id IN (SELECT c.thread_id FROM comments_fts "
+                             "JOIN comments c ON c.id = comments_fts.rowid "
+                             "WHERE comments_fts MATCH ?)")
+                params.append(text)
+            else:
+                where.append("t.id IN (SELECT thread_id FROM comments "
+                             "WHERE message LIKE ? ESCAPE '\\')")
+                params.append("%" + _escape_like(text) + "%")
+        if file:
+            where.append("t.file GLOB ?")
+            params.append(file)
+        if author:
+            where.append("t.id IN (SELECT thread_id FROM comments "
+                         "WHERE author = ? COLLATE NOCASE)")
+            params.append(author)
+        if unresolved is not None:
+            where.append("t.unresolved = ?")
+            params.append(int(unresolved))
+        if change:
+            where.append("ch.change = ?")
+            params.append(str(change))
+
+        sql = ("SELECT t.id, ch.change, t.file, t.line, t.range, t.unresolved, "
+               "t.updated FROM threads t JOIN changes ch ON ch.id = t.change_id")
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY t.updated DESC, t.id DESC"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        try:
+            rows = self._conn.execute(sql, params).fetchall()
+            comments = self._comments([row[0] for row in rows])
+        except sqlite3.OperationalError as e:
+            raise GerritError(f"Invalid search: {e}")
+        return [
+            {
+                "change": change_ref,
+                "file": file_path,
+                "range": json.loads(range_) if range_ else None,
+                "line": line,
+                "unresolved": bool(is_unresolved),
+                "updated": updated,
+                "comments": comments.get(thread_id, []),
+            }
+            for thread_id, change_ref, file_path, line, range_, is_unresolved, updated
+            in rows
+        ]
+
+    def _comments(self, thread_ids: list[int]) -> dict[int, list[dict]]:
+        """Return {thread id: comments oldest first} for the given threads."""
+        found: dict[int, list[dict]] = {}
+        for chunk in _chunks(thread_ids, 500):
+            rows = self._conn.execute(
+                "SELECT thread_id, comment_id, in_reply_to, patch_set, author, "
+                "message, updated, unresolved FROM comments "
+                f"WHERE thread_id IN ({','.join('?' * len(chunk))}) ORDER BY id",
+                chunk,
+            )
+            for thread_id, cid, parent, patch_set, author, message, updated, flag \
+                    in rows:
+                found.setdefault(thread_id, []).append({
+                    "id": cid,
+                    "in_reply_to": parent,
+                    "patch_set": patch_set,
+                    "author": author,
+                    "message": message,
+                    "updated": updated,
+                    "unresolved": bool(flag),
+                })
+        return found
+
+    def stats(self) -> dict[str, int]:
+        """Return the number of indexed changes, threads and comments."""
+        return {
+            table: self._conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            for table in ("changes", "threads", "comments")
+        }
+
+
+def _escape_like(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _chunks(items: list, size: int) -> Iterator[list]:
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def sync_results(index: CommentIndex,
+                 results: Iterable[tuple[str, dict, bool]]) -> Iterator[dict]:
+    """Store fetched change results, yielding one summary record per change.
+
+    Args:
+        index: Index to write to.
+        results: Tuples of (server, result, success flag).
+
+    Yields:
+        {'change', 'threads', 'watermark'} per stored change, or the failed
+        result (with its 'error').
+    """
+    for server, result, ok in results:
+        if not ok:
+            yield result
+            continue
+        try:
+            written = index.sync(server, result)
+        except GerritError as e:
+            yield {"change": result["change"],
+                   "error": {"type": type(e).__name__, "message": str(e)}}
+            continue
+        yield {"change": result["change"], "threads": written,
+               "watermark": result.get("watermark")}
@@ -0,0 +1,90 @@
+"""Shared pytest fixtures for the Gerrit scripts."""
+from __future__ import annotations
+
+import hashlib
+import io
+import json
+
+import pytest
+from requests import Response
+from requests.adapters import BaseAdapter
+
+import gerrit_utils
+
+BASE_URL = "https://gerrit.example.com"
+
+
+class StubAdapter(BaseAdapter):
+    """Serve canned Gerrit JSON responses keyed by request path.
+
+    Responses carry an ETag derived from the body and honour If-None-Match,
+    so cache revalidation can be exercised without a server.
+    """
+
+    def __init__(self, routes: dict[str, object]):
+        super().__init__()
+        self.routes = routes
+        self.paths: list[str] = []
+        self.not_modified = 0
+
+    def send(self, request, **kwargs):
+        path = request.path_url.split("?", 1)[0]
+        self.paths.append(path)
+        response = Response()
+        response.request = request
+        response.url = request.url
+        if path not in self.routes:
+            response.status_code = 404
+            response.raw = io.BytesIO(b"Not found")
+            return response
+
+        payload = self.routes[path]
+        if callable(payload):
+            # Dynamic routes return (status, payload) or raise network errors
+            status, payload = payload(request)
+            if status != 200:
+                response.status_code = status
+                response.raw = io.BytesIO(json.dumps(payload).encode("utf-8"))
+                return response
+        if isinstance(payload, bytes):
+            # Raw bodies, e.g. base64 file content, are served as text
+            body = payload
+        else:
+            body = (")]}'\n" + json.dumps(payload)).encode("utf-8")
+        etag = '"%s"' % hashlib.sha1(body).hexdigest()
+        response.headers["ETag"] = etag
+        if request.headers.get("If-None-Match") == etag:
+            self.not_modified += 1
+            response.status_code = 304
+            response.raw = io.BytesIO(b"")
+            return response
+        response.status_code = 200
+        response.headers["Content-Type"] = "application/json; charset=UTF-8"
+        # Served from a raw stream so streamed reads behave like the network
+        response.raw = io.BytesIO(body)
+        return response
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def gerrit_env(monkeypatch):
+    """Set Gerrit credentials and drop shared clients afterwards."""
+    monkeypatch.setenv("GERRIT_BASE_URL", BASE_URL)
+    monkeypatch.setenv("GERRIT_USER", "user")
+    monkeypatch.setenv("GERRIT_HTTP_PASSWORD", "secret")
+    yield
+    gerrit_utils.close_clients()
+
+
+@pytest.fixture
+def stub_client(gerrit_env):
+    """Return a factory for shared clients served by a StubAdapter."""
+    def make(routes: dict[str, object]):
+        client = gerrit_utils.get_client(BASE_URL)
+        client.adapter = StubAdapter(routes)
+        client.session.mount("https://", client.adapter)
+        client.request_counter.reset()
+        return client
+    return make
@@ -0,0 +1,659 @@
+#!/usr/bin/env python3
+"""Local stand-in for the Gerrit REST API, for end-to-end tests and benchmarks.
+
+Serves the endpoints the scripts use from in-memory changes over real
+HTTP/1.1 keep-alive connections, with ETags, so clients, caches and
+retries run exactly as against a server. It can add latency, inject
+failures, and record or replay traffic: recordings can be taken from a
+real server by proxying to it, and replayed offline later.
+
+Run with: python3 fake_gerrit.py [--port 8080] [--changes 1] [--comments 1000]
+
+Only the standard library is used, so it runs wherever the scripts do.
+"""
+from __future__ import annotations
+
+import argparse
+import base64
+import difflib
+import hashlib
+import itertools
+import json
+import re
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict, deque
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from json_stream import MAGIC_JSON_PREFIX
+
+MAGIC_PATHS = ("/COMMIT_MSG", "/MERGE_LIST", "/PATCHSET_LEVEL")
+
+# Author of everything posted through the fake server
+ACCOUNT = {"_account_id": 1000000, "name": "Fake User", "username": "fake"}
+
+_EPOCH = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+def gerrit_time(when: datetime) -> str:
+    """Format a datetime as a Gerrit timestamp."""
+    return when.astimezone(timezone.utc).strftime("%Y-%m-%d %H:%M:%S.%f000")
+
+
+class Fault:
+    """A failure injected for requests matching a path pattern.
+
+    Args:
+        pattern: Regular expression searched in the request path.
+        status: HTTP status to answer with; 0 to drop the connection.
+        count: Number of matching requests to fail; None for all.
+        method: Only fail requests with this method, e.g. 'POST'.
+        retry_after: Optional Retry-After header value, in seconds.
+        apply: Handle the request before failing it, like a response lost
+            after the server made the change.
+    """
+
+    def __init__(self, pattern: str, status: int = 503, count: int | None = 1,
+                 method: str | None = None, retry_after: float | None = None,
+                 apply: bool = False):
+        self.pattern = re.compile(pattern)
+        self.status = status
+        self.count = count
+        self.method = method
+        self.retry_after = retry_after
+        self.apply = apply
+
+    def matches(self, method: str, path: str) -> bool:
+        if self.count == 0:
+            return False
+        if self.method and self.method != method:
+            return False
+        return bool(self.pattern.search(path))
+
+
+class _Dropped(Exception):
+    """Close the connection without answering."""
+
+
+class FakeGerrit:
+    """In-memory Gerrit REST server on a local port.
+
+    Args:
+        port: Port to listen on; 0 picks a free one.
+        latency: Seconds added before every response.
+        record: Optional JSONL file every exchange is appended to.
+        replay: Optional JSONL recording to answer from instead of the
+            in-memory changes; repeated requests get successive responses.
+        upstream: Optional real Gerrit base URL to proxy to instead of
+            the in-memory changes (usually combined with ``record``).
+    """
+
+    def __init__(self, port: int = 0, latency: float = 0.0,
+                 record: str | None = None, replay: str | None = None,
+                 upstream: str | None = None):
+        self.latency = latency
+        self.upstream = upstream.rstrip("/") if upstream else None
+        self.faults: list[Fault] = []
+        self.requests: list[tuple[str, str]] = []
+        self.changes: dict[int, dict] = {}
+        self._lock = threading.RLock()
+        self._ids = itertools.count(1)
+        self._record = open(record, "a", encoding="utf-8") if record else None
+        self._replay = _load_recording(replay) if replay else None
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), _Handler)
+        self._server.daemon_threads = True
+        self._server.fake = self
+        self._thread: threading.Thread | None = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    # -------------------------------------------------------------------------
+    # Lifecycle
+    # -------------------------------------------------------------------------
+
+    def start(self) -> FakeGerrit:
+        """Serve from a background thread."""
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        kwargs={"poll_interval": 0.1}, daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self) -> None:
+        self._server.serve_forever()
+
+    def stop(self) -> None:
+        if self._thread is not None:
+            self._server.shutdown()
+            self._thread.join()
+            self._thread = None
+        self._server.server_close()
+        if self._record is not None:
+            self._record.close()
+            self._record = None
+
+    def __enter__(self) -> FakeGerrit:
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    # -------------------------------------------------------------------------
+    # Test setup
+    # -------------------------------------------------------------------------
+
+    def add_change(self, number: int, comments: dict[str, list[dict]] | None = None,
+                   patchsets: int = 1, files: dict[str, str] | None = None,
+                   project: str = "project") -> dict:
+        """Add a change and return its record.
+
+        Args:
+            number: Change number.
+            comments: Published comments as {path: [CommentInfo]}, like the
+                comments endpoint; 'patch_set' defaults to the latest.
+            patchsets: Number of patch sets.
+            files: File content as {path: text}, the same in every patch
+                set; by default every commented path, long enough for its
+                comments.
+            project: Project name.
+
+        Returns:
+            The change record, which may be modified directly.
+        """
+        comments = {path: [dict(c) for c in items]
+                    for path, items in (comments or {}).items()}
+        for items in comments.values():
+            for c in items:
+                c.setdefault("patch_set", patchsets)
+                c.setdefault("author", ACCOUNT)
+        if files is None:
+            files = {}
+            for path, items in comments.items():
+                if path not in MAGIC_PATHS:
+                    lines = max((c.get("line") or 0 for c in items), default=0) + 10
+                    files[path] = "".join(f"line {i}\n" for i in range(1, lines + 1))
+
+        revisions = {}
+        for ps in range(1, patchsets + 1):
+            sha = hashlib.sha1(f"{number}/{ps}".encode()).hexdigest()
+            revisions[sha] = {
+                "_number": ps,
+                "created": gerrit_time(_EPOCH + timedelta(hours=ps)),
+            }
+        updated = max([rev["created"] for rev in revisions.values()]
+                      + [c["updated"] for items in comments.values()
+                         for c in items if c.get("updated")])
+        change = {
+            "id": f"{project}~{number}",
+            "project": project,
+            "branch": "master",
+            "change_id": "I" + hashlib.sha1(f"change {number}".encode()).hexdigest(),
+            "_number": number,
+            "subject": f"Change {number}",
+            "status": "NEW",
+            "updated": updated,
+            "revisions": revisions,
+            "comments": comments,
+            "messages": [],
+            "files": files,
+            # {patch set: ({path: text}, {new path: old path})}, see set_files()
+            "patchset_files": {},
+        }
+        with self._lock:
+            self.changes[number] = change
+        return change
+
+    def set_files(self, number: int, patchset: int, files: dict[str, str],
+                  renamed: dict[str, str] | None = None) -> None:
+        """Give one patch set of a change its own file content.
+
+        Args:
+            number: Change number.
+            patchset: Patch set number.
+            files: File content as {path: text}.
+            renamed: Files renamed since the previous patch sets, as
+                {new path: old path}.
+        """
+        with self._lock:
+            self.changes[number]["patchset_files"][patchset] = (files, renamed or {})
+
+    def fail(self, pattern: str, status: int = 503, count: int | None = 1,
+             **kwargs) -> Fault:
+        """Inject a failure; see Fault for the arguments."""
+        fault = Fault(pattern, status, count, **kwargs)
+        with self._lock:
+            self.faults.append(fault)
+        return fault
+
+    def request_count(self, method: str | None = None) -> int:
+        """Return the number of requests received, optionally by method."""
+        with self._lock:
+            return sum(1 for m, _ in self.requests if method in (None, m))
+
+    def reset_requests(self) -> None:
+        with self._lock:
+            self.requests.clear()
+
+    # -------------------------------------------------------------------------
+    # Request handling
+    # -------------------------------------------------------------------------
+
+    def handle(self, method: str, target: str, headers: dict[str, str],
+               body: bytes) -> tuple[int, dict[str, str], bytes]:
+        """Answer one request; returns (status, headers, body).
+
+        Raises:
+            _Dropped: When the connection should be closed unanswered.
+        """
+        path = urlsplit(target).path
+        with self._lock:
+            self.requests.append((method, target))
+            fault = next((f for f in self.faults if f.matches(method, path)), None)
+            if fault is not None and fault.count is not None:
+                fault.count -= 1
+        if self.latency:
+            time.sleep(self.latency)
+
+        if fault is not None:
+            if fault.apply:
+                self._answer(method, target, headers, body)
+            if fault.status == 0:
+                raise _Dropped()
+            extra = {}
+            if fault.retry_after is not None:
+                extra["Retry-After"] = f"{fault.retry_after:g}"
+            return fault.status, extra, b"Injected failure"
+        return self._answer(method, target, headers, body)
+
+    def _answer(self, method: str, target: str, headers: dict[str, str],
+                body: bytes) -> tuple[int, dict[str, str], bytes]:
+        if self._replay is not None:
+            return self._replayed(method, target)
+        if self.upstream:
+            status, out_headers, out = self._proxy(method, target, headers, body)
+        else:
+            status, payload = self._route(method, target, body)
+            if isinstance(payload, bytes):
+                out = payload
+            elif status < 400:
+                out = (MAGIC_JSON_PREFIX + "\n" + json.dumps(payload)).encode("utf-8")
+            else:
+                out = str(payload).encode("utf-8")
+            out_headers = {"Content-Type": "application/json; charset=UTF-8"}
+            if method == "GET" and status == 200:
+                out_headers["ETag"] = '"%s"' % hashlib.sha1(out).hexdigest()
+        if self._record is not None:
+            self._write_record(method, target, status, out_headers, out)
+        if (method == "GET" and out_headers.get("ETag")
+                and headers.get("If-None-Match") == out_headers["ETag"]):
+            return 304, {"ETag": out_headers["ETag"]}, b""
+        return status, out_headers, out
+
+    def _write_record(self, method: str, target: str, status: int,
+                      headers: dict[str, str], body: bytes) -> None:
+        record = {
+            "method": method,
+            "path": target,
+            "status": status,
+            "headers": headers,
+            "body": body.decode("utf-8", errors="replace"),
+        }
+        with self._lock:
+            self._record.write(json.dumps(record) + "\n")
+            self._record.flush()
+
+    def _replayed(self, method: str, target: str) -> tuple[int, dict[str, str], bytes]:
+        with self._lock:
+            responses = self._replay.get((method, target))
+            if not responses:
+                return 404, {}, b"Not found (not recorded)"
+            record = responses.popleft() if len(responses) > 1 else responses[0]
+        return record["status"], record["headers"], record["body"].encode("utf-8")
+
+    def _proxy(self, method: str, target: str, headers: dict[str, str],
+               body: bytes) -> tuple[int, dict[str, str], bytes]:
+        forwarded = {k: v for k, v in headers.items()
+                     if k.lower() in ("authorization", "content-type", "accept")}
+        request = urllib.request.Request(self.upstream + target, data=body or None,
+                                         headers=forwarded, method=method)
+        try:
+            with urllib.request.urlopen(request, timeout=60) as response:
+                status, raw, out_headers = response.status, response.read(), response.headers
+        except urllib.error.HTTPError as e:
+            status, raw, out_headers = e.code, e.read(), e.headers
+        kept = {k: out_headers[k] for k in ("Content-Type", "ETag", "Retry-After")
+                if out_headers.get(k)}
+        return status, kept, raw
+
+    # -------------------------------------------------------------------------
+    # In-memory Gerrit
+    # -------------------------------------------------------------------------
+
+    def _route(self, method: str, target: str, body: bytes) -> tuple[int, object]:
+        parts = urlsplit(target)
+        query = parse_qs(parts.query)
+        segments = [unquote(s) for s in parts.path.strip("/").split("/")]
+        if segments and segments[0] == "a":
+            segments = segments[1:]
+        if method == "GET" and segments == ["changes"]:
+            return self._search(query)
+        if len(segments) < 2 or segments[0] != "changes":
+            return 404, "Not found"
+        change = self._find_change(segments[1])
+        if change is None:
+            return 404, f"Not found: {segments[1]}"
+        rest = segments[2:]
+
+        with self._lock:
+            if method == "GET" and not rest:
+                return 200, self._change_info(change, query.get("o", []))
+            if method == "GET" and rest == ["comments"]:
+                return 200, change["comments"]
+            if method == "GET" and rest == ["messages"]:
+                return 200, change["messages"]
+            if len(rest) < 3 or rest[0] != "revisions":
+                return 404, "Not found"
+            sha = self._find_revision(change, rest[1])
+            if sha is None:
+                return 404, f"Not found: {rest[1]}"
+            number = change["revisions"][sha]["_number"]
+            rest = rest[2:]
+            if method == "GET" and rest == ["comments"]:
+                return 200, {
+                    path: kept for path, items in change["comments"].items()
+                    if (kept := [c for c in items if c.get("patch_set") == number])
+                }
+            files, renamed = self._revision_files(change, number)
+            base = query.get("base", [None])[0]
+            if base is not None and not (base.isdigit()
+                                         and 0 < int(base) < number):
+                return 400, f"Invalid base: {base}"
+            if method == "GET" and rest == ["files"]:
+                if base is None:
+                    return 200, self._files(files)
+                return 200, self._files_since(change, int(base), files, renamed)
+            if method == "GET" and len(rest) == 3 and rest[0] == "files" \
+                    and rest[2] == "content":
+                text = files.get(rest[1])
+                if text is None:
+                    return 404, f"Not found: {rest[1]}"
+                return 200, base64.b64encode(text.encode("utf-8"))
+            if method == "GET" and len(rest) == 3 and rest[0] == "files" \
+                    and rest[2] == "diff" and base is not None:
+                if rest[1] not in files:
+                    return 404, f"Not found: {rest[1]}"
+                old_files, _ = self._revision_files(change, int(base))
+                old = old_files.get(renamed.get(rest[1], rest[1]), "")
+                return 200, _diff(old, files[rest[1]], query.get("context", ["ALL"])[0])
+            if method == "POST" and rest == ["review"]:
+                return self._post_review(change, number, body)
+        return 404, "Not found"
+
+    def _search(self, query: dict[str, list[str]]) -> tuple[int, object]:
+        """Answer a change search, newest change first.
+
+        Supports the operators the tests need: project:, status:, is:open
+        and is:closed, has:unresolved and bare change numbers.
+        """
+        try:
+            terms = query["q"][0].split()
+            limit = int(query.get("n", ["500"])[0])
+            start = int(query.get("start", ["0"])[0])
+        except (KeyError, ValueError):
+            return 400, "Bad request"
+        tests = []
+        for term in terms:
+            op, _, value = term.partition(":")
+            if term.isdigit():
+                tests.append(lambda c, n=int(term): c["_number"] == n)
+            elif op == "project":
+                tests.append(lambda c, v=value: c["project"] == v)
+            elif op == "status":
+                tests.append(lambda c, v=value.upper(): c["status"] == v)
+            elif term in ("is:open", "is:closed"):
+                tests.append(lambda c, o=term == "is:open": (c["status"] == "NEW") == o)
+            elif term == "has:unresolved":
+                tests.append(lambda c: _unresolved_count(c) > 0)
+            else:
+                return 400, f"Unsupported operator: {term}"
+        with self._lock:
+            found = sorted((c for c in self.changes.values()
+                            if all(test(c) for test in tests)),
+                           key=lambda c: -c["_number"])
+            page = []
+            for change in found[start:start + limit]:
+                info = self._change_info(change, [])
+                info["unresolved_comment_count"] = _unresolved_count(change)
+                info["total_comment_count"] = sum(map(len, change["comments"].values()))
+                page.append(info)
+        if page and start + limit < len(found):
+            page[-1]["_more_changes"] = True
+        return 200, page
+
+    def _find_change(self, ref: str) -> dict | None:
+        number = ref.rsplit("~", 1)[-1]
+        with self._lock:
+            if number.isdigit():
+                return self.changes.get(int(number))
+            return next((c for c in self.changes.values() if c["change_id"] == ref), None)
+
+    @staticmethod
+    def _current(change: dict) -> str:
+        return max(change["revisions"], key=lambda s: change["revisions"][s]["_number"])
+
+    def _find_revision(self, change: dict, ref: str) -> str | None:
+        if ref == "current":
+            return self._current(change)
+        if ref.isdigit():
+            return next((sha for sha, rev in change["revisions"].items()
+                         if rev["_number"] == int(ref)), None)
+        matches = [sha for sha in change["revisions"] if sha.startswith(ref)]
+        return matches[0] if len(matches) == 1 else None
+
+    def _change_info(self, change: dict, options: list[str]) -> dict:
+        info = {k: change[k] for k in ("id", "project", "branch", "change_id",
+                                       "_number", "subject", "status", "updated")}
+        current = self._current(change)
+        if "ALL_REVISIONS" in options:
+            info["current_revision"] = current
+            info["revisions"] = change["revisions"]
+        elif "CURRENT_REVISION" in options:
+            info["current_revision"] = current
+            info["revisions"] = {current: change["revisions"][current]}
+        return info
+
+    @staticmethod
+    def _revision_files(change: dict, number: int) -> tuple[dict[str, str], dict[str, str]]:
+        """Return ({path: text}, {new path: old path}) of a patch set."""
+        return change["patchset_files"].get(number, (change["files"], {}))
+
+    @staticmethod
+    def _files(files: dict[str, str]) -> dict:
+        infos = {"/COMMIT_MSG": {"status": "A", "lines_inserted": 6}}
+        for path, text in sorted(files.items()):
+            infos[path] = {"lines_inserted": text.count("\n"), "size": len(text)}
+        return infos
+
+    def _files_since(self, change: dict, base: int, files: dict[str, str],
+                     renamed: dict[str, str]) -> dict:
+        """Return the FileInfos of files modified since patch set base."""
+        old_files, _ = self._revision_files(change, base)
+        infos = {}
+        for path, text in sorted(files.items()):
+            old_path = renamed.get(path)
+            if old_path in old_files:
+                infos[path] = {"status": "R", "old_path": old_path, "size": len(text)}
+            elif path not in old_files:
+                infos[path] = {"status": "A", "size": len(text)}
+            elif old_files[path] != text:
+                infos[path] = {"size": len(text)}
+        for path in old_files:
+            if path not in files and path not in renamed.values():
+                infos[path] = {"status": "D", "size": 0}
+        return infos
+
+    def _post_review(self, change: dict, number: int, body: bytes) -> tuple[int, object]:
+        try:
+            review = json.loads(body or b"{}")
+        except ValueError:
+            return 400, "Invalid JSON"
+        comments = review.get("comments") or {}
+        for path in comments:
+            if path not in self._revision_files(change, number)[0] \
+                    and path not in MAGIC_PATHS:
+                return 400, f"file {path} not found in revision {change['_number']},{number}"
+
+        now = gerrit_time(datetime.now(timezone.utc))
+        tag = review.get("tag")
+        for path, items in comments.items():
+            published = change["comments"].setdefault(path, [])
+            for item in items:
+                comment = {
+                    "id": f"fake{next(self._ids):08x}",
+                    "patch_set": number,
+                    "author": ACCOUNT,
+                    "message": item.get("message", ""),
+                    "updated": now,
+                    "unresolved": bool(item.get("unresolved", False)),
+                }
+                for key in ("line", "range", "in_reply_to", "side"):
+                    if item.get(key) is not None:
+                        comment[key] = item[key]
+                if tag:
+                    comment["tag"] = tag
+                published.append(comment)
+
+        count = sum(len(items) for items in comments.values())
+        text = f"Patch Set {number}:"
+        if count:
+            text += f"\n\n({count} comment{'s' if count != 1 else ''})"
+        if review.get("message"):
+            text += f"\n\n{review['message']}"
+        message = {
+            "id": f"msg{next(self._ids):08x}",
+            "author": ACCOUNT,
+            "date": now,
+            "message": text,
+            "_revision_number": number,
+        }
+        if tag:
+            message["tag"] = tag
+        change["messages"].append(message)
+        change["updated"] = now
+        return 200, {"labels": review["labels"]} if review.get("labels") else {}
+
+
+def _diff(old: str, new: str, context: str) -> dict:
+    """Return a DiffInfo between two texts; common lines are skipped with context=0."""
+    a, b = old.splitlines(), new.splitlines()
+    content = []
+    matcher = difflib.SequenceMatcher(None, a, b, autojunk=False)
+    for tag, a1, a2, b1, b2 in matcher.get_opcodes():
+        if tag == "equal":
+            content.append({"skip": a2 - a1} if context == "0" else {"ab": a[a1:a2]})
+            continue
+        chunk = {}
+        if a2 > a1:
+            chunk["a"] = a[a1:a2]
+        if b2 > b1:
+            chunk["b"] = b[b1:b2]
+        content.append(chunk)
+    return {"change_type": "MODIFIED", "content": content}
+
+
+def _unresolved_count(change: dict) -> int:
+    """Count the threads whose last comment is unresolved, like Gerrit."""
+    comments = {c["id"]: c for items in change["comments"].values() for c in items}
+    last: dict[str, dict] = {}
+    for cid, c in comments.items():
+        root, seen = cid, set()
+        while comments.get(root, {}).get("in_reply_to") in comments and root not in seen:
+            seen.add(root)
+            root = comments[root]["in_reply_to"]
+        if root not in last or c.get("updated", "") >= last[root].get("updated", ""):
+            last[root] = c
+    return sum(1 for c in last.values() if c.get("unresolved"))
+
+
+def _load_recording(path: str) -> dict[tuple[str, str], deque]:
+    responses: dict[tuple[str, str], deque] = defaultdict(deque)
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                responses[(record["method"], record["path"])].append(record)
+    return responses
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _serve(self) -> None:
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        try:
+            status, headers, out = self.server.fake.handle(
+                self.command, self.path, dict(self.headers.items()), body
+            )
+        except _Dropped:
+            self.close_connection = True
+            return
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(out)))
+        self.end_headers()
+        self.wfile.write(out)
+
+    do_GET = do_POST = do_PUT = do_DELETE = _serve
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Serve a fake Gerrit REST API")
+    parser.add_argument("--port", type=int, default=8080,
+                        help="Port to listen on (default: 8080)")
+    parser.add_argument("--changes", type=int, default=1,
+                        help="Synthetic changes, numbered from 1 (default: 1)")
+    parser.add_argument("--comments", type=int, default=1000,
+                        help="Comments per synthetic change (default: 1000)")
+    parser.add_argument("--patchsets", type=int, default=3,
+                        help="Patch sets per synthetic change (default: 3)")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="Seconds added before every response (default: 0)")
+    parser.add_argument("--record", help="Append every exchange to this JSONL file")
+    parser.add_argument("--replay", help="Answer from this JSONL recording")
+    parser.add_argument("--upstream",
+                        help="Proxy to this Gerrit base URL instead of serving "
+                             "synthetic changes")
+    args = parser.parse_args(argv)
+
+    from bench_comments import make_comments
+
+    server = FakeGerrit(args.port, latency=args.latency, record=args.record,
+                        replay=args.replay, upstream=args.upstream)
+    if not (args.replay or args.upstream):
+        for number in range(1, args.changes + 1):
+            server.add_change(number, make_comments(args.comments, seed=number),
+                              patchsets=args.patchsets)
+    print(f"Fake Gerrit listening on {server.url}", file=sys.stderr, flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
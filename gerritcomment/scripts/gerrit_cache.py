@@ -0,0 +1,413 @@
+#!/usr/bin/env python3
+"""On-disk cache of Gerrit REST responses.
+
+Entries are revalidated with ETags (If-None-Match / 304 Not Modified), so a
+repeated read of an unchanged resource costs a round trip but no payload.
+Entries marked immutable are served without contacting the server.
+"""
+from __future__ import annotations
+
+import codecs
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import TYPE_CHECKING, Iterable, Iterator, TextIO
+
+from gerrit_utils import GerritError
+from json_stream import MAGIC_JSON_PREFIX
+
+if TYPE_CHECKING:
+    from gerrit import GerritClient
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+DEFAULT_MAX_AGE = 14 * 24 * 3600
+
+# Evict after this many stores in long-running processes
+EVICT_EVERY = 200
+
+# Bytes read per chunk when streaming a response body
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def default_cache_dir() -> str:
+    """Return the cache directory: $GERRIT_CACHE_DIR or the XDG cache dir."""
+    path = os.environ.get("GERRIT_CACHE_DIR", "").strip()
+    if path:
+        return path
+    base = os.environ.get("XDG_CACHE_HOME", "").strip() or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.path.join(base, "gerritcomment")
+
+
+def strip_json_prefix(text: str) -> str:
+    """Strip Gerrit's XSSI protection prefix from a JSON response body."""
+    text = text.lstrip()
+    if text.startswith(MAGIC_JSON_PREFIX):
+        text = text[len(MAGIC_JSON_PREFIX):]
+    return text
+
+
+class CacheEntry:
+    """A cached response body with its validator."""
+
+    __slots__ = ("etag", "body", "immutable", "stored")
+
+    def __init__(self, etag: str | None, body: str, immutable: bool, stored: float):
+        self.etag = etag
+        self.body = body
+        self.immutable = immutable
+        self.stored = stored
+
+
+class ResponseCache:
+    """Size- and age-bounded on-disk response cache.
+
+    Each entry is one file: a JSON metadata line followed by the response
+    body. Files are written atomically, so concurrent readers and writers in
+    other threads or processes never see partial entries. Least recently
+    used entries are evicted once the total size exceeds ``max_bytes``;
+    entries older than ``max_age`` seconds are dropped.
+    """
+
+    def __init__(self, directory: str | None = None,
+                 max_bytes: int = DEFAULT_MAX_BYTES,
+                 max_age: float = DEFAULT_MAX_AGE):
+        self.directory = directory or default_cache_dir()
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._stores = 0
+        try:
+            os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        except OSError as e:
+            raise GerritError(f"Cannot create cache directory: {e}")
+        self.evict()
+
+    @staticmethod
+    def key(base_url: str, endpoint: str) -> str:
+        """Return the cache key for an endpoint on a server.
+
+        Endpoints embed the change and revision, so the key is unique per
+        (base URL, change, revision, resource).
+        """
+        raw = f"{base_url.rstrip('/')}\n{endpoint}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key)
+
+    def open_entry(self, key: str) -> tuple[CacheEntry, TextIO] | None:
+        """Return the entry for key and a file positioned at its body.
+
+        The entry's body is left empty; read it from the file, which the
+        caller must close. Returns None if the entry is missing or expired.
+        """
+        path = self._path(key)
+        try:
+            f = open(path, "r", encoding="utf-8")
+        except OSError:
+            return None
+        try:
+            meta = json.loads(f.readline())
+        except (OSError, ValueError):
+            f.close()
+            return None
+        stored = meta.get("stored", 0)
+        if time.time() - stored > self.max_age:
+            f.close()
+            self._remove(path)
+            return None
+        return CacheEntry(meta.get("etag"), "", bool(meta.get("immutable")), stored), f
+
+    def load(self, key: str) -> CacheEntry | None:
+        """Return the entry for key, or None if missing or expired."""
+        opened = self.open_entry(key)
+        if opened is None:
+            return None
+        entry, f = opened
+        with f:
+            try:
+                entry.body = f.read()
+            except (OSError, ValueError):
+                return None
+        return entry
+
+    def writer(self, key: str, etag: str | None = None,
+               immutable: bool = False) -> CacheWriter:
+        """Return a writer that stores an entry from body chunks."""
+        return CacheWriter(self, key, etag, immutable)
+
+    def store(self, key: str, body: str, etag: str | None = None,
+              immutable: bool = False) -> None:
+        """Atomically write an entry, evicting old entries now and then."""
+        writer = self.writer(key, etag, immutable)
+        writer.write(body)
+        writer.commit()
+
+    def _stored(self) -> None:
+        with self._lock:
+            self._stores += 1
+            evict = self._stores % EVICT_EVERY == 0
+        if evict:
+            self.evict()
+
+    def touch(self, key: str) -> None:
+        """Mark an entry as recently used."""
+        try:
+            os.utime(self._path(key))
+        except OSError:
+            pass
+
+    @staticmethod
+    def _remove(path: str) -> None:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def evict(self) -> None:
+        """Drop expired entries, then least recently used ones over max_bytes."""
+        now = time.time()
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                # Stale temp files come from interrupted writers
+                if name.startswith(".tmp-") and now - st.st_mtime < 3600:
+                    continue
+                if name.startswith(".tmp-") or now - st.st_mtime > self.max_age:
+                    self._remove(path)
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        if total <= self.max_bytes:
+            return
+        entries.sort()
+        for _, size, path in entries:
+            self._remove(path)
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+
+class CacheWriter:
+    """Incremental, atomic writer of one cache entry.
+
+    The body goes to a temp file that replaces the entry on commit(), so an
+    interrupted download never leaves a partial entry behind. Write errors
+    silently discard the entry: a cache that cannot be written is only a
+    missed optimization.
+    """
+
+    def __init__(self, cache: ResponseCache, key: str, etag: str | None,
+                 immutable: bool):
+        self._cache = cache
+        self._path = cache._path(key)
+        self._file: TextIO | None = None
+        self._tmp: str | None = None
+        meta = {"etag": etag, "immutable": immutable, "stored": time.time()}
+        try:
+            os.makedirs(os.path.dirname(self._path), mode=0o700, exist_ok=True)
+            fd, self._tmp = tempfile.mkstemp(dir=os.path.dirname(self._path),
+                                             prefix=".tmp-")
+            self._file = os.fdopen(fd, "w", encoding="utf-8")
+            self._file.write(json.dumps(meta))
+            self._file.write("\n")
+        except OSError:
+            self.discard()
+
+    def write(self, text: str) -> None:
+        """Append text to the entry body."""
+        if self._file is None:
+            return
+        try:
+            self._file.write(text)
+        except OSError:
+            self.discard()
+
+    def commit(self) -> None:
+        """Publish the entry."""
+        if self._file is None:
+            return
+        try:
+            self._file.close()
+            os.replace(self._tmp, self._path)
+        except OSError:
+            self.discard()
+            return
+        self._file = None
+        self._tmp = None
+        self._cache._stored()
+
+    def discard(self) -> None:
+        """Drop the partially written entry."""
+        if self._file is not None:
+            try:
+                self._file.close()
+            except OSError:
+                pass
+            self._file = None
+        if self._tmp is not None:
+            ResponseCache._remove(self._tmp)
+            self._tmp = None
+
+
+def _read_chunks(f: TextIO, chunk_size: int) -> Iterator[str]:
+    while True:
+        text = f.read(chunk_size)
+        if not text:
+            return
+        yield text
+
+
+def _strip_prefix_chunks(chunks: Iterable[str]) -> Iterator[str]:
+    """Yield chunks with leading whitespace and the XSSI prefix removed."""
+    head = ""
+    chunks = iter(chunks)
+    for chunk in chunks:
+        head += chunk
+        stripped = head.lstrip()
+        if len(stripped) >= len(MAGIC_JSON_PREFIX) or (
+            stripped and not MAGIC_JSON_PREFIX.startswith(stripped)
+        ):
+            break
+    else:
+        stripped = head.lstrip()
+    if stripped.startswith(MAGIC_JSON_PREFIX):
+        stripped = stripped[len(MAGIC_JSON_PREFIX):]
+    if stripped:
+        yield stripped
+    yield from chunks
+
+
+def cached_stream(client: GerritClient, endpoint: str,
+                  cache: ResponseCache | None = None,
+                  immutable: bool = False,
+                  chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[str]:
+    """GET a JSON endpoint like cached_get(), yielding the body in chunks.
+
+    The XSSI prefix is stripped. Nothing is buffered beyond one chunk: a
+    fresh body is written to the cache as it is read and committed once
+    complete, and a cached body is read back from disk the same way. The
+    request is sent on first iteration.
+
+    Args:
+        client: Gerrit client used for the request.
+        endpoint: REST endpoint, e.g. '/changes/123/comments'.
+        cache: Response cache; without one the body is only streamed.
+        immutable: The resource never changes; see cached_get().
+        chunk_size: Bytes read per network or disk read.
+
+    Yields:
+        Decoded text chunks of the JSON body.
+    """
+    key = None
+    opened = None
+    if cache is not None:
+        key = cache.key(client.get_endpoint_url(""), endpoint)
+        opened = cache.open_entry(key)
+    entry, cached = opened if opened is not None else (None, None)
+    try:
+        if entry is not None and entry.immutable:
+            cache.touch(key)
+            yield from _read_chunks(cached, chunk_size)
+            return
+
+        headers = {"If-None-Match": entry.etag} if entry is not None and entry.etag else None
+        response = client.requester.get(client.get_endpoint_url(endpoint),
+                                        headers=headers, stream=True,
+                                        raise_for_status=False)
+        with response:
+            client.requester.confirm_status(response)
+            if response.status_code == 304 and cached is not None:
+                cache.touch(key)
+                yield from _read_chunks(cached, chunk_size)
+                return
+
+            etag = response.headers.get("ETag")
+            writer = None
+            if cache is not None and (etag or immutable):
+                writer = cache.writer(key, etag=etag, immutable=immutable)
+            decoder = codecs.getincrementaldecoder(response.encoding or "utf-8")()
+            raw = response.iter_content(chunk_size)
+            text_chunks = (decoder.decode(data) for data in raw)
+            try:
+                for text in _strip_prefix_chunks(text_chunks):
+                    if writer is not None:
+                        writer.write(text)
+                    yield text
+                tail = decoder.decode(b"", final=True)
+                if tail:
+                    if writer is not None:
+                        writer.write(tail)
+                    yield tail
+            except BaseException:
+                # Also reached when the consumer stops early (GeneratorExit)
+                if writer is not None:
+                    writer.discard()
+                raise
+            if writer is not None:
+                writer.commit()
+    finally:
+        if cached is not None:
+            cached.close()
+
+
+def cached_get_text(client: GerritClient, endpoint: str,
+                    cache: ResponseCache | None = None,
+                    immutable: bool = False) -> str:
+    """GET an endpoint like cached_get(), returning the raw body text.
+
+    For endpoints that do not answer JSON, e.g. base64 file content. The
+    XSSI prefix, if any, is stripped.
+    """
+    if cache is None:
+        response = client.requester.get(client.get_endpoint_url(endpoint))
+        return strip_json_prefix(response.content.decode(response.encoding or "utf-8"))
+
+    key = cache.key(client.get_endpoint_url(""), endpoint)
+    entry = cache.load(key)
+    if entry is not None and entry.immutable:
+        cache.touch(key)
+        return entry.body
+
+    headers = {"If-None-Match": entry.etag} if entry is not None and entry.etag else None
+    response = client.requester.get(client.get_endpoint_url(endpoint), headers=headers)
+    if response.status_code == 304 and entry is not None:
+        cache.touch(key)
+        return entry.body
+
+    body = strip_json_prefix(response.content.decode(response.encoding or "utf-8"))
+    etag = response.headers.get("ETag")
+    if etag or immutable:
+        cache.store(key, body, etag=etag, immutable=immutable)
+    return body
+
+
+def cached_get(client: GerritClient, endpoint: str,
+               cache: ResponseCache | None = None,
+               immutable: bool = False):
+    """GET a JSON endpoint, revalidating a cached copy with its ETag.
+
+    Args:
+        client: Gerrit client used for the request.
+        endpoint: REST endpoint, e.g. '/changes/123/comments'.
+        cache: Response cache; without one this is a plain client.get().
+        immutable: The resource never changes (e.g. content of a revision
+            pinned by SHA); a cached copy is returned without a request.
+
+    Returns:
+        Decoded JSON response.
+    """
+    if cache is None:
+        return client.get(endpoint)
+    return json.loads(cached_get_text(client, endpoint, cache, immutable))
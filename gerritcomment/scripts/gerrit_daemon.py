@@ -0,0 +1,511 @@
+#!/usr/bin/env python3
+"""Resident helper daemon for the Gerrit scripts.
+
+Start it once per session:
+
+    python3 gerrit_daemon.py &
+
+get_comments.py, post_comment.py and search_comments.py then hand their
+arguments to it over a Unix socket and print what it sends back, instead
+of importing the Gerrit client and opening new connections on every call.
+The daemon runs the same main() functions in-process, keeping pooled
+clients and caches warm.
+
+Without a daemon, or for calls the daemon cannot serve (input on stdin,
+--watch, a different environment), the scripts run in-process as usual. Only the
+standard library is imported here, so forwarding stays cheap.
+"""
+from __future__ import annotations
+
+import argparse
+import hashlib
+import importlib
+import json
+import os
+import signal
+import socket
+import socketserver
+import stat
+import sys
+import threading
+import time
+from typing import Callable, TextIO
+
+# Scripts the daemon may run, by module name
+SCRIPTS = ("get_comments", "post_comment", "search_comments")
+
+DEFAULT_IDLE_TIMEOUT = 1800.0
+
+# Options of calls that run until interrupted; they would hold the daemon
+# (and its working directory) for good, so they always run in-process
+LONG_RUNNING_OPTIONS = ("--watch",)
+
+# Output is sent in frames of at most this many characters, or on flush()
+_FRAME_SIZE = 64 * 1024
+
+
+def default_socket_path() -> str:
+    """Return the socket path: $GERRIT_DAEMON_SOCKET, else a per-user path.
+
+    Without $XDG_RUNTIME_DIR, the socket lives in a private (0700)
+    directory under /tmp, which the daemon creates.
+    """
+    path = os.environ.get("GERRIT_DAEMON_SOCKET", "").strip()
+    if path:
+        return path
+    runtime = os.environ.get("XDG_RUNTIME_DIR", "").strip()
+    if runtime:
+        return os.path.join(runtime, "gerritcomment.sock")
+    return os.path.join("/tmp", f"gerritcomment-{os.getuid()}", "daemon.sock")
+
+
+def _trusted_socket(path: str) -> bool:
+    """Return True if path is a socket that only this user can have made.
+
+    The socket must be owned by this user, in a directory owned by this
+    user or root; otherwise another local user could impersonate the
+    daemon and read the calls sent to it.
+    """
+    try:
+        info = os.lstat(path)
+        parent = os.stat(os.path.dirname(os.path.abspath(path)))
+    except OSError:
+        return False
+    uid = os.getuid()
+    return (stat.S_ISSOCK(info.st_mode) and info.st_uid == uid
+            and parent.st_uid in (uid, 0))
+
+
+def env_fingerprint(environ: dict[str, str] | None = None) -> str:
+    """Hash the environment the scripts read, to match clients to the daemon.
+
+    Credentials and settings are read from the environment, so a client is
+    only served if its environment is the daemon's.
+    """
+    environ = os.environ if environ is None else environ
+    items = sorted(
+        (k, v) for k, v in environ.items()
+        if k.startswith("GERRIT_") and k != "GERRIT_DAEMON_SOCKET"
+        or k in ("XDG_CACHE_HOME", "HOME")
+    )
+    return hashlib.sha256(json.dumps(items).encode("utf-8")).hexdigest()
+
+
+# =============================================================================
+# Client
+# =============================================================================
+
+def _reads_stdin(argv: list[str]) -> bool:
+    """Return True if an argument names stdin ('-' or '--option=-')."""
+    return any(arg == "-" or (arg.startswith("--") and arg.endswith("=-"))
+               for arg in argv)
+
+
+def _long_running(argv: list[str]) -> bool:
+    """Return True if argv selects a mode in LONG_RUNNING_OPTIONS.
+
+    argparse accepts unique prefixes of long options, so those count too.
+    """
+    for arg in argv:
+        name = arg.partition("=")[0]
+        if len(name) > 2 and name.startswith("--") and any(
+                option.startswith(name) for option in LONG_RUNNING_OPTIONS):
+            return True
+    return False
+
+
+def call_daemon(script: str, argv: list[str], path: str | None = None,
+                stdout: TextIO | None = None,
+                stderr: TextIO | None = None) -> int | None:
+    """Run a script call on the daemon, copying its output.
+
+    Args:
+        script: Script module name, e.g. 'get_comments'.
+        argv: Command line arguments.
+        path: Socket path; defaults to default_socket_path().
+        stdout: Stream for the call's standard output (default sys.stdout).
+        stderr: Stream for the call's standard error (default sys.stderr).
+
+    Returns:
+        The call's exit code, or None if the daemon did not run it (not
+        running, or unable to serve this call); run it in-process then.
+    """
+    if os.environ.get("GERRIT_DAEMON", "").strip().lower() in ("0", "off", "no"):
+        return None
+    # stdin belongs to this process and cannot be forwarded; --watch would
+    # hold the daemon for good; tracing is process-wide, so traced calls
+    # would mix with others in the daemon
+    if _reads_stdin(argv) or _long_running(argv) or os.environ.get("GERRIT_TRACE") \
+            or any(arg == "--trace" or arg.startswith("--trace=") for arg in argv):
+        return None
+    path = path or default_socket_path()
+    if not _trusted_socket(path):
+        return None
+
+    request = {
+        "script": script,
+        "argv": argv,
+        "cwd": os.getcwd(),
+        "env": env_fingerprint(),
+    }
+    stdout = stdout or sys.stdout
+    stderr = stderr or sys.stderr
+    try:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(path)
+    except OSError:
+        return None
+
+    started = False
+    with sock, sock.makefile("rwb") as stream:
+        try:
+            stream.write(json.dumps(request).encode("utf-8") + b"\n")
+            stream.flush()
+            for raw in stream:
+                frame = json.loads(raw)
+                if "fallback" in frame:
+                    return None
+                started = True
+                if "out" in frame:
+                    stdout.write(frame["out"])
+                    stdout.flush()
+                elif "err" in frame:
+                    stderr.write(frame["err"])
+                    stderr.flush()
+                elif "exit" in frame:
+                    return frame["exit"]
+        except (OSError, ValueError):
+            pass
+    if not started:
+        return None
+    print("error: connection to gerrit_daemon lost", file=stderr)
+    return 1
+
+
+def forward_to_daemon(script: str) -> None:
+    """Exit with the daemon's result if a running daemon serves this call.
+
+    Called by the scripts before their heavy imports; returns without
+    doing anything if the call has to run in-process.
+    """
+    try:
+        code = call_daemon(script, sys.argv[1:])
+    except KeyboardInterrupt:
+        sys.exit(130)
+    if code is not None:
+        sys.exit(code)
+
+
+# =============================================================================
+# Server
+# =============================================================================
+
+class _Output:
+    """Per-call output buffer sending 'out' or 'err' frames to the client.
+
+    Once ``closed`` is set (the client went away), writes raise
+    BrokenPipeError, which ends the call at its next output.
+    """
+
+    def __init__(self, send: Callable[[dict], None], kind: str,
+                 closed: threading.Event | None = None):
+        self._send = send
+        self._kind = kind
+        self._closed = closed
+        self._parts: list[str] = []
+        self._size = 0
+
+    def _check(self) -> None:
+        if self._closed is not None and self._closed.is_set():
+            raise BrokenPipeError("gerrit_daemon client disconnected")
+
+    def write(self, text: str) -> int:
+        self._check()
+        self._parts.append(text)
+        self._size += len(text)
+        if self._size >= _FRAME_SIZE:
+            self.flush()
+        return len(text)
+
+    def flush(self) -> None:
+        self._check()
+        if self._parts:
+            text = "".join(self._parts)
+            self._parts, self._size = [], 0
+            self._send({self._kind: text})
+
+
+class _ThreadLocalStream:
+    """sys.stdout/sys.stderr stand-in writing to the current call's output.
+
+    Threads not serving a call write to the original stream.
+    """
+
+    def __init__(self, original: TextIO, local: threading.local, kind: str):
+        self._original = original
+        self._local = local
+        self._kind = kind
+
+    def _target(self):
+        return getattr(self._local, self._kind, None) or self._original
+
+    def write(self, text: str) -> int:
+        return self._target().write(text)
+
+    def flush(self) -> None:
+        self._target().flush()
+
+    def isatty(self) -> bool:
+        return False
+
+    def __getattr__(self, name: str):
+        return getattr(self._original, name)
+
+
+class _CwdGate:
+    """Run concurrent calls only while they share a working directory.
+
+    The working directory is process-wide, but relative paths in a call
+    (e.g. --changes-file) must resolve against the client's. Calls from
+    another directory wait until the running ones finish.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._active = 0
+
+    def enter(self, cwd: str) -> None:
+        with self._cond:
+            while self._active and os.getcwd() != cwd:
+                self._cond.wait()
+            if os.getcwd() != cwd:
+                os.chdir(cwd)
+            self._active += 1
+
+    def exit(self) -> None:
+        with self._cond:
+            self._active -= 1
+            self._cond.notify_all()
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    server: GerritDaemon
+
+    def handle(self) -> None:
+        lock = threading.Lock()
+
+        def send(frame: dict) -> None:
+            with lock:
+                self.wfile.write(json.dumps(frame).encode("utf-8") + b"\n")
+                self.wfile.flush()
+
+        line = self.rfile.readline()
+        if not line:
+            # A connect-only probe, e.g. by _remove_stale_socket()
+            return
+        try:
+            request = json.loads(line)
+            main = self.server.scripts[request["script"]]
+            argv = [str(arg) for arg in request["argv"]]
+            cwd = request["cwd"]
+        except (ValueError, KeyError, TypeError):
+            send({"fallback": "invalid request"})
+            return
+        if request.get("env") != self.server.env:
+            send({"fallback": "environment differs from the daemon's"})
+            return
+        if _reads_stdin(argv) or _long_running(argv):
+            send({"fallback": "call cannot be served by the daemon"})
+            return
+
+        closed = threading.Event()
+        threading.Thread(target=self._watch_client, args=(closed,),
+                         daemon=True).start()
+        self.server.begin_call()
+        out, err = _Output(send, "out", closed), _Output(send, "err", closed)
+        local = self.server.local
+        local.out, local.err = out, err
+        self.server.cwd_gate.enter(cwd)
+        try:
+            code = main(argv)
+        except SystemExit as e:
+            code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+            if e.code is not None and not isinstance(e.code, int):
+                err.write(f"{e.code}\n")
+        except BrokenPipeError:
+            return
+        except Exception as e:
+            err.write(f"error: {type(e).__name__}: {e}\n")
+            code = 1
+        finally:
+            self.server.cwd_gate.exit()
+            local.out = local.err = None
+            self.server.end_call()
+        try:
+            out.flush()
+            err.flush()
+            send({"exit": code or 0})
+        except OSError:
+            pass
+
+    def _watch_client(self, closed: threading.Event) -> None:
+        """Set ``closed`` once the client hangs up.
+
+        Clients send nothing after the request, so any read returning
+        means the connection is gone.
+        """
+        try:
+            while self.connection.recv(4096):
+                pass
+        except OSError:
+            pass
+        closed.set()
+
+
+class GerritDaemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Unix socket server running script main() functions for clients.
+
+    Args:
+        path: Socket path; created with mode 0600.
+        scripts: {name: main(argv) -> int}; defaults to the SCRIPTS modules.
+        idle_timeout: Seconds without calls after which serve_forever()
+            returns; 0 to run until stopped.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, path: str,
+                 scripts: dict[str, Callable[[list[str]], int]] | None = None,
+                 idle_timeout: float = DEFAULT_IDLE_TIMEOUT):
+        if scripts is None:
+            scripts = {name: importlib.import_module(name).main for name in SCRIPTS}
+        self.scripts = scripts
+        self.idle_timeout = idle_timeout
+        self.env = env_fingerprint()
+        self.local = threading.local()
+        self.cwd_gate = _CwdGate()
+        self._last_call = time.monotonic()
+        self._active_calls = 0
+        self._calls_lock = threading.Lock()
+
+        _prepare_socket_dir(path)
+        _remove_stale_socket(path)
+        old_umask = os.umask(0o177)
+        try:
+            super().__init__(path, _Handler)
+        finally:
+            os.umask(old_umask)
+        os.chmod(path, 0o600)
+
+        if not isinstance(sys.stdout, _ThreadLocalStream):
+            sys.stdout = _ThreadLocalStream(sys.stdout, self.local, "out")
+            sys.stderr = _ThreadLocalStream(sys.stderr, self.local, "err")
+
+    def begin_call(self) -> None:
+        with self._calls_lock:
+            self._active_calls += 1
+
+    def end_call(self) -> None:
+        with self._calls_lock:
+            self._active_calls -= 1
+            self._last_call = time.monotonic()
+
+    def idle(self) -> bool:
+        """Return True once no call has run for idle_timeout seconds."""
+        with self._calls_lock:
+            return (bool(self.idle_timeout) and not self._active_calls
+                    and time.monotonic() - self._last_call > self.idle_timeout)
+
+    def service_actions(self) -> None:
+        if self.idle():
+            # Leave serve_forever() from its own thread
+            threading.Thread(target=self.shutdown, daemon=True).start()
+
+    def server_close(self) -> None:
+        super().server_close()
+        try:
+            os.remove(self.server_address)
+        except OSError:
+            pass
+
+
+def _prepare_socket_dir(path: str) -> None:
+    """Create the socket's directory owner-only, and check who owns it.
+
+    Raises:
+        RuntimeError: When the directory belongs to another user.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    info = os.stat(directory)
+    if info.st_uid not in (os.getuid(), 0):
+        raise RuntimeError(f"{directory} is owned by another user")
+
+
+def _remove_stale_socket(path: str) -> None:
+    """Remove a socket left behind by a daemon that is gone.
+
+    Raises:
+        RuntimeError: When another daemon is listening on the path, or the
+            path belongs to another user or is not a socket.
+    """
+    try:
+        info = os.lstat(path)
+    except FileNotFoundError:
+        return
+    if info.st_uid != os.getuid():
+        raise RuntimeError(f"{path} is owned by another user")
+    if not stat.S_ISSOCK(info.st_mode):
+        raise RuntimeError(f"{path} exists and is not a socket")
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except OSError:
+        os.remove(path)
+        return
+    finally:
+        probe.close()
+    raise RuntimeError(f"A daemon is already listening on {path}")
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Serve get_comments.py, post_comment.py and "
+                    "search_comments.py calls from a resident process"
+    )
+    parser.add_argument(
+        "--socket",
+        help="Unix socket path (default: $GERRIT_DAEMON_SOCKET, "
+             "$XDG_RUNTIME_DIR/gerritcomment.sock or "
+             "/tmp/gerritcomment-$UID/daemon.sock)",
+    )
+    parser.add_argument(
+        "--idle-timeout",
+        dest="idle_timeout",
+        type=float,
+        default=DEFAULT_IDLE_TIMEOUT,
+        help=f"Exit after this many seconds without calls; 0 to never exit "
+             f"(default: {DEFAULT_IDLE_TIMEOUT:g})",
+    )
+    args = parser.parse_args(argv)
+
+    path = args.socket or default_socket_path()
+    try:
+        server = GerritDaemon(path, idle_timeout=args.idle_timeout)
+    except (OSError, RuntimeError) as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 1
+    print(f"gerrit_daemon listening on {path}", file=sys.stderr, flush=True)
+    # Remove the socket on kill as well as on Ctrl-C
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        server.serve_forever(poll_interval=1.0)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""Read-only access to the files of a change revision.
+
+Revisions are pinned by commit SHA, so file lists and file content never
+change and are cached as immutable entries: once fetched, they cost no
+round trip at all.
+"""
+from __future__ import annotations
+
+import base64
+import bisect
+from typing import TYPE_CHECKING, NamedTuple
+from urllib.parse import quote
+
+from gerrit_cache import ResponseCache, cached_get, cached_get_text
+from gerrit_utils import GerritError
+
+if TYPE_CHECKING:
+    from gerrit import GerritClient
+
+# Gerrit's magic file paths, which are not files of the commit
+PATCHSET_LEVEL = "/PATCHSET_LEVEL"
+MAGIC_PATHS = frozenset({"/COMMIT_MSG", "/MERGE_LIST", PATCHSET_LEVEL})
+
+
+def _change_endpoint(change_ref: str) -> str:
+    return f"/changes/{quote(change_ref, safe='~')}"
+
+
+def _revision_endpoint(change_ref: str, sha: str) -> str:
+    return f"{_change_endpoint(change_ref)}/revisions/{quote(sha, safe='')}"
+
+
+def _request_errors() -> tuple[type[Exception], ...]:
+    """Return the exceptions of a failed request.
+
+    python-gerrit-api raises requests' HTTPError only for a 404, and its own
+    GerritAPIException subclasses (ServerError, UnauthorizedError, ...) for
+    every other error status.
+    """
+    from gerrit.utils.exceptions import GerritAPIException
+    from requests import RequestException
+
+    return GerritAPIException, RequestException
+
+
+def _http_error(e: Exception, what: str, endpoint: str) -> GerritError:
+    response = getattr(e, "response", None)
+    if response is not None and response.status_code == 404:
+        return GerritError(f"{what} not found (404)")
+    return GerritError(f"HTTP error on {endpoint}: {e}")
+
+
+def resolve_revision(client: GerritClient, change_ref: str,
+                     revision: str | None = None,
+                     cache: ResponseCache | None = None) -> tuple[str, int]:
+    """Resolve a revision argument to its commit SHA and patch set number.
+
+    Args:
+        client: Gerrit client.
+        change_ref: Change number or Change-Id.
+        revision: SHA (or unique prefix), patch set number, 'current' or None.
+        cache: Optional response cache; the change is revalidated by ETag.
+
+    Returns:
+        Tuple of (commit SHA, patch set number).
+
+    Raises:
+        GerritError: When the change or revision does not exist, or the
+            request fails.
+    """
+    endpoint = f"{_change_endpoint(change_ref)}?o=ALL_REVISIONS"
+    try:
+        change = cached_get(client, endpoint, cache)
+    except _request_errors() as e:
+        raise _http_error(e, "Change", endpoint)
+
+    revisions = change.get("revisions") or {}
+    if not revision or revision == "current":
+        matches = [change.get("current_revision")]
+    elif revision.isdigit():
+        matches = [sha for sha, rev in revisions.items()
+                   if rev.get("_number") == int(revision)]
+    else:
+        matches = [sha for sha in revisions if sha.startswith(revision.lower())]
+
+    if len(matches) != 1 or matches[0] not in revisions:
+        raise GerritError(f"Revision not found: {revision or 'current'}")
+    sha = matches[0]
+    return sha, revisions[sha]["_number"]
+
+
+def get_revision_files(client: GerritClient, change_ref: str, sha: str,
+                       cache: ResponseCache | None = None,
+                       base: int | None = None) -> dict[str, dict]:
+    """Return the files modified in a revision, as {path: FileInfo}.
+
+    The list includes Gerrit's magic '/COMMIT_MSG' (and '/MERGE_LIST' for
+    merges), like the files endpoint. With ``base``, the files modified
+    since that patch set of the change; renamed files carry 'old_path'.
+
+    Raises:
+        GerritError: When the revision does not exist, or the request fails.
+    """
+    endpoint = f"{_revision_endpoint(change_ref, sha)}/files"
+    if base is not None:
+        endpoint += f"?base={base}"
+    try:
+        return cached_get(client, endpoint, cache, immutable=True)
+    except _request_errors() as e:
+        raise _http_error(e, "Revision", endpoint)
+
+
+def get_file_content(client: GerritClient, change_ref: str, sha: str, path: str,
+                     cache: ResponseCache | None = None) -> str:
+    """Return the content of a file in a revision.
+
+    Bytes that are not valid UTF-8 are replaced, which keeps line counts
+    and text intact for the common case.
+
+    Raises:
+        GerritError: When the file does not exist in the revision, or the
+            request fails.
+    """
+    endpoint = f"{_revision_endpoint(change_ref, sha)}/files/{quote(path, safe='')}/content"
+    try:
+        text = cached_get_text(client, endpoint, cache, immutable=True)
+    except _request_errors() as e:
+        raise _http_error(e, f"File {path}", endpoint)
+    return base64.b64decode(text).decode("utf-8", errors="replace")
+
+
+def get_file_diff(client: GerritClient, change_ref: str, sha: str, path: str,
+                  base: int, cache: ResponseCache | None = None) -> dict:
+    """Return the DiffInfo of a file between patch set ``base`` and a revision.
+
+    Common lines are requested as 'skip' counts rather than text, as only
+    the line structure is needed.
+
+    Args:
+        client: Gerrit client.
+        change_ref: Change number or Change-Id.
+        sha: Commit SHA of the newer revision.
+        path: File path in the newer revision.
+        base: Patch set number of the older revision.
+        cache: Optional response cache; diffs are immutable entries.
+
+    Raises:
+        GerritError: When the file or revision does not exist, or the
+            request fails.
+    """
+    endpoint = (f"{_revision_endpoint(change_ref, sha)}/files/{quote(path, safe='')}"
+                f"/diff?base={base}&context=0&intraline=false")
+    try:
+        return cached_get(client, endpoint, cache, immutable=True)
+    except _request_errors() as e:
+        raise _http_error(e, f"File {path}", endpoint)
+
+
+class LineMap(NamedTuple):
+    """Maps line numbers of a diff's old side ('a') to its new side ('b').
+
+    Built once per diff with line_map(), then queried with map_line().
+    """
+
+    # Start lines on side a of the hunks that have lines there
+    starts: list[int]
+    # (a_start, a_count, b_start, b_count, unchanged) per hunk in starts
+    hunks: list[tuple[int, int, int, int, bool]]
+    # Number of lines on side b
+    b_lines: int
+
+
+def line_map(diff: dict) -> LineMap:
+    """Build a LineMap from a DiffInfo."""
+    hunks = []
+    a = b = 1
+    for chunk in diff.get("content") or []:
+        if "skip" in chunk or "ab" in chunk:
+            count = chunk["skip"] if "skip" in chunk else len(chunk["ab"])
+            hunks.append((a, count, b, count, True))
+            a, b = a + count, b + count
+            continue
+        a_count, b_count = len(chunk.get("a") or ()), len(chunk.get("b") or ())
+        # Whitespace-only changes keep the lines in place
+        unchanged = bool(chunk.get("common")) and a_count == b_count
+        if a_count:
+            hunks.append((a, a_count, b, b_count, unchanged))
+        a, b = a + a_count, b + b_count
+    hunks = [h for h in hunks if h[1]]
+    return LineMap([h[0] for h in hunks], hunks, b - 1)
+
+
+def map_line(lines: LineMap, line: int) -> tuple[int, bool]:
+    """Map a line of a diff's old side to the new side.
+
+    Returns:
+        Tuple of (new line, exact). Lines in changed hunks map to the
+        corresponding line of the replacement, or to where deleted lines
+        were, and are not exact.
+    """
+    i = bisect.bisect_right(lines.starts, line) - 1
+    if i < 0:
+        # Hunks cover every line of side a, so only for empty diffs
+        return line, True
+    a_start, a_count, b_start, b_count, unchanged = lines.hunks[i]
+    if line >= a_start + a_count:
+        # Past the end of side a: keep the distance from its end
+        return line + (b_start + b_count) - (a_start + a_count), True
+    if unchanged:
+        return b_start + line - a_start, True
+    new = b_start + min(line - a_start, max(b_count - 1, 0))
+    return max(1, min(new, lines.b_lines)), False
+
+
+def count_lines(text: str) -> int:
+    """Return the number of lines in text, counting a last unterminated one."""
+    return text.count("\n") + (1 if text and not text.endswith("\n") else 0)
@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+"""Opt-in tracing of HTTP calls and processing stages.
+
+Spans are written as JSON lines, one per finished span, to stderr or a
+file:
+
+    {"trace": "9f2c...", "span": "http", "ts": 1767261600.123, "ms": 84.2,
+     "method": "GET", "path": "/a/changes/1/comments", "status": 200,
+     "bytes": 18211, "ttfb_ms": 61.0, "connect_ms": 3.1, "tls_ms": 12.4}
+
+Every line carries the invocation's trace id, so lines appended by many
+processes to one file can be told apart. When tracing is off, span() and
+event() only check a global, so instrumented code pays next to nothing.
+"""
+from __future__ import annotations
+
+import contextlib
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from typing import Any, Iterator, TextIO
+
+# Default trace target, e.g. for bots that cannot change their command line
+TRACE_ENV = "GERRIT_TRACE"
+
+_tracer: Tracer | None = None
+
+# Connection setup timings of the HTTP call running on this thread
+_timings = threading.local()
+
+
+class Tracer:
+    """Writes finished spans as JSON lines to a stream.
+
+    Args:
+        stream: Text stream the lines are written to.
+        close: Close the stream in close().
+    """
+
+    def __init__(self, stream: TextIO, close: bool = False):
+        self.trace_id = os.urandom(8).hex()
+        self._stream = stream
+        self._close = close
+        self._lock = threading.Lock()
+
+    def emit(self, name: str, start: float, seconds: float | None,
+             attrs: dict[str, Any]) -> None:
+        """Write one span record.
+
+        Args:
+            name: Span name, e.g. 'http'.
+            start: Wall clock start time (Unix seconds).
+            seconds: Duration; None for point events.
+            attrs: Extra fields.
+        """
+        record = {"trace": self.trace_id, "span": name, "ts": round(start, 6)}
+        if seconds is not None:
+            record["ms"] = round(seconds * 1000, 3)
+        record.update(attrs)
+        line = json.dumps(record, default=str) + "\n"
+        with self._lock:
+            self._stream.write(line)
+
+    @contextlib.contextmanager
+    def span(self, name: str, **attrs) -> Iterator[dict[str, Any]]:
+        """Time the enclosed block; fields set on the yielded dict are kept."""
+        start, t0 = time.time(), time.perf_counter()
+        try:
+            yield attrs
+        except BaseException as e:
+            attrs["error"] = type(e).__name__
+            raise
+        finally:
+            self.emit(name, start, time.perf_counter() - t0, attrs)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._close:
+                self._stream.close()
+            else:
+                self._stream.flush()
+
+
+def span(name: str, **attrs) -> contextlib.AbstractContextManager[dict[str, Any]]:
+    """Return a span context manager; a no-op one when tracing is off."""
+    tracer = _tracer
+    if tracer is None:
+        return contextlib.nullcontext(attrs)
+    return tracer.span(name, **attrs)
+
+
+def event(name: str, **attrs) -> None:
+    """Record a point event, e.g. a retry, when tracing is on."""
+    tracer = _tracer
+    if tracer is not None:
+        tracer.emit(name, time.time(), None, attrs)
+
+
+def open_tracer(target: str | None) -> Tracer | None:
+    """Return a Tracer for a --trace target.
+
+    Args:
+        target: '-' for stderr, a file path to append to, or None/'' for
+            no tracing.
+
+    Raises:
+        OSError: When the trace file cannot be opened.
+    """
+    if not target:
+        return None
+    if target == "-":
+        return Tracer(sys.stderr)
+    return Tracer(open(target, "a", encoding="utf-8"), close=True)
+
+
+@contextlib.contextmanager
+def tracing(tracer: Tracer | None, script: str) -> Iterator[Tracer | None]:
+    """Make tracer current for the enclosed block, recorded as a 'run' span.
+
+    The tracer is closed afterwards. Tracing is process-wide: spans from
+    every thread go to the current tracer.
+    """
+    global _tracer
+    if tracer is None:
+        yield None
+        return
+    _tracer = tracer
+    try:
+        with tracer.span("run", script=script, pid=os.getpid()):
+            yield tracer
+    finally:
+        _tracer = None
+        tracer.close()
+
+
+# =============================================================================
+# HTTP instrumentation
+# =============================================================================
+
+def _add_timing(key: str, t0: float) -> None:
+    timings = getattr(_timings, "current", None)
+    if timings is not None:
+        timings[key] = timings.get(key, 0.0) + (time.perf_counter() - t0) * 1000
+
+
+@functools.lru_cache(maxsize=None)
+def _pool_classes() -> dict[str, type]:
+    """Return urllib3 pool classes whose connections time their setup."""
+    from urllib3.connection import HTTPConnection, HTTPSConnection
+    from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+    def timed(base: type, tls: bool) -> type:
+        class TimedConnection(base):
+            def _new_conn(self):
+                # Name resolution plus TCP connect
+                t0 = time.perf_counter()
+                try:
+                    return super()._new_conn()
+                finally:
+                    _add_timing("connect_ms", t0)
+
+            def connect(self):
+                # _new_conn() plus, for HTTPS, the TLS handshake
+                t0 = time.perf_counter()
+                try:
+                    super().connect()
+                finally:
+                    if tls:
+                        _add_timing("setup_ms", t0)
+
+        return TimedConnection
+
+    class TimedHTTPConnectionPool(HTTPConnectionPool):
+        ConnectionCls = timed(HTTPConnection, tls=False)
+
+    class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+        ConnectionCls = timed(HTTPSConnection, tls=True)
+
+    return {"http": TimedHTTPConnectionPool, "https": TimedHTTPSConnectionPool}
+
+
+def _wire_bytes(response) -> int | None:
+    """Return the body bytes read from the connection so far."""
+    try:
+        return response.raw.tell()
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
+def instrument_session(session) -> None:
+    """Record an 'http' span for every request sent through session.
+
+    Spans carry method, path (with query), status, body bytes, total time,
+    time to the response headers (ttfb_ms) and, for new connections, the
+    DNS + TCP connect time (connect_ms) and TLS handshake time (tls_ms).
+    Streamed responses are recorded when closed, so their time includes
+    reading and processing the body; read_ms is the part spent waiting for
+    body chunks. Adapters mounted later are not instrumented.
+    """
+    if getattr(session, "_gerrit_traced", False):
+        return
+    session._gerrit_traced = True
+    for adapter in session.adapters.values():
+        poolmanager = getattr(adapter, "poolmanager", None)
+        if poolmanager is not None:
+            poolmanager.pool_classes_by_scheme = _pool_classes()
+
+    send = session.send
+
+    @functools.wraps(send)
+    def traced_send(request, **kwargs):
+        tracer = _tracer
+        if tracer is None:
+            return send(request, **kwargs)
+        return _traced_send(tracer, send, request, kwargs)
+
+    session.send = traced_send
+
+
+def _traced_send(tracer: Tracer, send, request, kwargs: dict):
+    attrs: dict[str, Any] = {"method": request.method, "path": request.path_url}
+    _timings.current = timings = {}
+    start, t0 = time.time(), time.perf_counter()
+    try:
+        response = send(request, **kwargs)
+    except BaseException as e:
+        attrs["error"] = type(e).__name__
+        attrs.update(_setup_fields(timings))
+        tracer.emit("http", start, time.perf_counter() - t0, attrs)
+        raise
+    finally:
+        _timings.current = None
+
+    attrs["status"] = response.status_code
+    attrs["ttfb_ms"] = round(response.elapsed.total_seconds() * 1000, 3)
+    attrs.update(_setup_fields(timings))
+
+    def finish() -> None:
+        attrs["bytes"] = _wire_bytes(response)
+        tracer.emit("http", start, time.perf_counter() - t0, attrs)
+
+    if not kwargs.get("stream"):
+        finish()
+        return response
+
+    # Time spent waiting for body chunks, apart from the consumer's work
+    read_seconds = 0.0
+    iter_content = response.iter_content
+
+    def timed_iter_content(*args, **kw):
+        nonlocal read_seconds
+        chunks = iter_content(*args, **kw)
+        while True:
+            t = time.perf_counter()
+            try:
+                chunk = next(chunks)
+            except StopIteration:
+                return
+            finally:
+                read_seconds += time.perf_counter() - t
+            yield chunk
+
+    close = response.close
+
+    def traced_close() -> None:
+        response.close = close
+        attrs["read_ms"] = round(read_seconds * 1000, 3)
+        finish()
+        close()
+
+    response.iter_content = timed_iter_content
+    response.close = traced_close
+    return response
+
+
+def _setup_fields(timings: dict[str, float]) -> dict[str, float]:
+    if "connect_ms" not in timings:
+        return {}
+    fields = {"connect_ms": round(timings["connect_ms"], 3)}
+    if "setup_ms" in timings:
+        fields["tls_ms"] = round(timings["setup_ms"] - timings["connect_ms"], 3)
+    return fields
@@ -2,14 +2,67 @@
 """Shared utilities for Gerrit scripts."""
 from __future__ import annotations
 
+import functools
 import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, Callable
 from urllib.parse import urlparse
 
+import gerrit_trace
+
+if TYPE_CHECKING:
+    from gerrit import GerritClient
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_TIMEOUT = 30.0
+DEFAULT_CONNECT_TIMEOUT = 10.0
+DEFAULT_RETRIES = 4
+DEFAULT_BACKOFF = 0.5
+DEFAULT_MAX_BACKOFF = 30.0
+
+# Statuses worth retrying: throttling, overload and gateway failures
+RETRY_STATUSES = frozenset({429, 502, 503, 504})
+
 
 class GerritError(Exception):
     """Base error for Gerrit operations."""
 
 
+class TransientError(GerritError):
+    """A request failed in a way that may succeed when retried.
+
+    Attributes:
+        status: HTTP status, or None for network errors.
+        ambiguous: The server may have applied the request anyway (e.g. a
+            read timeout or gateway timeout), so a write must be checked
+            before it is retried.
+        retry_after: Delay in seconds requested by the server, if any.
+    """
+
+    def __init__(self, message: str, status: int | None = None,
+                 ambiguous: bool = False, retry_after: float | None = None):
+        super().__init__(message)
+        self.status = status
+        self.ambiguous = ambiguous
+        self.retry_after = retry_after
+
+
+class ValidationError(GerritError):
+    """Input was rejected before it was sent.
+
+    Attributes:
+        problems: One record per problem found, so all of them can be fixed
+            in one go.
+    """
+
+    def __init__(self, message: str, problems: list[dict]):
+        super().__init__(message)
+        self.problems = problems
+
+
 def parse_change_url(url: str) -> tuple[str, str]:
     """Parse Gerrit change URL, return (base_url, change_ref)."""
     parsed = urlparse(url)
@@ -27,22 +80,431 @@ def parse_change_url(url: str) -> tuple[str, str]:
     raise GerritError("URL must contain '+/<change_ref>'")
 
 
-def get_config() -> tuple[str, str, str]:
-    """Load config from environment, return (base_url, username, password)."""
-    base_url = os.environ.get("GERRIT_BASE_URL", "").strip()
-    username = os.environ.get("GERRIT_USER", "").strip()
-    password = os.environ.get("GERRIT_HTTP_PASSWORD", "").strip()
-
-    missing = []
-    if not base_url:
-        missing.append("GERRIT_BASE_URL")
-    if not username:
-        missing.append("GERRIT_USER")
-    if not password:
-        missing.append("GERRIT_HTTP_PASSWORD")
+# Environment variables holding the HTTP credentials
+CREDENTIAL_ENV = ("GERRIT_USER", "GERRIT_HTTP_PASSWORD")
+
 
+def _require_env(*names: str) -> list[str]:
+    """Return the values of environment variables, raising if any is unset."""
+    values = [os.environ.get(name, "").strip() for name in names]
+    missing = [name for name, value in zip(names, values) if not value]
     if missing:
         missing_str = ", ".join(missing)
         raise GerritError(f"Missing environment variables: {missing_str}")
+    return values
+
 
+def get_credentials() -> tuple[str, str]:
+    """Load credentials from environment, return (username, password)."""
+    username, password = _require_env(*CREDENTIAL_ENV)
+    return username, password
+
+
+def get_config() -> tuple[str, str, str]:
+    """Load config from environment, return (base_url, username, password)."""
+    base_url, username, password = _require_env("GERRIT_BASE_URL", *CREDENTIAL_ENV)
     return base_url, username, password
+
+
+def resolve_change(change: str) -> tuple[str, str]:
+    """Resolve a change argument to (base_url, change_ref).
+
+    Args:
+        change: Change URL, number, or Change-Id.
+
+    Returns:
+        Tuple of Gerrit base URL and change reference.
+    """
+    if change.startswith(("http://", "https://")):
+        return parse_change_url(change)
+    base_url, _, _ = get_config()
+    return base_url, change
+
+
+def _env_number(name: str, default: float) -> float:
+    """Read a positive number from the environment, falling back to default."""
+    value = os.environ.get(name, "").strip()
+    if not value:
+        return default
+    try:
+        number = float(value)
+    except ValueError:
+        raise GerritError(f"Invalid {name}: {value}")
+    if number <= 0:
+        raise GerritError(f"Invalid {name}: {value}")
+    return number
+
+
+def get_client_options(pool_size: int | None = None,
+                       timeout: float | None = None,
+                       connect_timeout: float | None = None,
+                       ) -> tuple[int, tuple[float, float]]:
+    """Resolve pool size and (connect, read) timeouts.
+
+    Explicit arguments win over GERRIT_POOL_SIZE, GERRIT_TIMEOUT and
+    GERRIT_CONNECT_TIMEOUT, which win over the built-in defaults.
+    """
+    if pool_size is None:
+        pool_size = int(_env_number("GERRIT_POOL_SIZE", DEFAULT_POOL_SIZE))
+    if timeout is None:
+        timeout = _env_number("GERRIT_TIMEOUT", DEFAULT_TIMEOUT)
+    if connect_timeout is None:
+        connect_timeout = _env_number("GERRIT_CONNECT_TIMEOUT", DEFAULT_CONNECT_TIMEOUT)
+    return max(1, pool_size), (connect_timeout, timeout)
+
+
+class RequestCounter:
+    """Thread-safe count of HTTP requests sent through a session.
+
+    Installed as a requests response hook, so it sees every request made by
+    the client, including those issued by python-gerrit-api wrappers.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def __call__(self, response, *args, **kwargs):
+        with self._lock:
+            self.count += 1
+        return response
+
+    def reset(self) -> int:
+        """Reset the counter, return the count before the reset."""
+        with self._lock:
+            count, self.count = self.count, 0
+        return count
+
+
+def install_request_counter(client: GerritClient) -> RequestCounter:
+    """Attach a RequestCounter to the client's session, return it."""
+    counter = getattr(client, "request_counter", None)
+    if counter is None:
+        counter = RequestCounter()
+        client.session.hooks["response"].append(counter)
+        client.request_counter = counter
+    return counter
+
+
+def get_request_count(client: GerritClient) -> int:
+    """Return the number of HTTP requests the client has sent."""
+    return install_request_counter(client).count
+
+
+def get_batch_pool_size(jobs: int) -> int | None:
+    """Return the client pool size for ``jobs`` concurrent calls.
+
+    At least the configured pool size, so --jobs never lowers it. Returns
+    None when the configuration is invalid, for get_client() to report.
+    """
+    try:
+        return max(jobs, get_client_options()[0])
+    except GerritError:
+        return None
+
+
+def get_pool_size(client: GerritClient) -> int:
+    """Return the client's connection pool size, for run_parallel().
+
+    Clients not made by get_client() count as the configured pool size.
+    """
+    return getattr(client, "pool_size", None) or get_client_options()[0]
+
+
+class TokenBucket:
+    """Thread-safe token bucket rate limiter.
+
+    Allows ``rate`` operations per second on average, with bursts of up to
+    ``burst`` operations after a quiet period.
+    """
+
+    def __init__(self, rate: float, burst: int | None = None,
+                 clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], None] = time.sleep):
+        if rate <= 0:
+            raise GerritError(f"Invalid rate: {rate}")
+        self.rate = rate
+        self.burst = max(1, int(burst if burst is not None else rate))
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._tokens = float(self.burst)
+        self._updated = clock()
+
+    def acquire(self) -> None:
+        """Take one token, waiting for it if the bucket is empty."""
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(self.burst,
+                               self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # Reserve the token now, so concurrent callers queue up behind it
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait > 0:
+            self._sleep(wait)
+
+
+_limiters: dict[tuple[float, int | None], TokenBucket] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_write_limiter(rate: float | None = None,
+                      burst: int | None = None) -> TokenBucket | None:
+    """Return the shared write rate limiter, or None when unlimited.
+
+    Explicit arguments win over GERRIT_WRITE_RATE (writes per second) and
+    GERRIT_WRITE_BURST. Writes are unlimited unless a rate is set.
+    """
+    if rate is None:
+        rate = _env_number("GERRIT_WRITE_RATE", 0) or None
+    if not rate:
+        return None
+    if burst is None and os.environ.get("GERRIT_WRITE_BURST", "").strip():
+        burst = int(_env_number("GERRIT_WRITE_BURST", 1))
+    with _limiters_lock:
+        limiter = _limiters.get((rate, burst))
+        if limiter is None:
+            limiter = _limiters[(rate, burst)] = TokenBucket(rate, burst)
+    return limiter
+
+
+class RetryPolicy:
+    """Retry transient failures with jittered exponential backoff.
+
+    Delays use "full jitter": a random delay of up to
+    ``base_delay * 2 ** attempt``, capped at ``max_delay``, so clients
+    throttled at the same moment do not retry in lockstep. A server
+    Retry-After takes precedence.
+    """
+
+    def __init__(self, retries: int = DEFAULT_RETRIES,
+                 base_delay: float = DEFAULT_BACKOFF,
+                 max_delay: float = DEFAULT_MAX_BACKOFF,
+                 sleep: Callable[[float], None] = time.sleep,
+                 rng: random.Random | None = None):
+        self.retries = max(0, retries)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.sleep = sleep
+        self.rng = rng or random.Random()
+
+    def delay(self, attempt: int, retry_after: float | None = None) -> float:
+        """Return the delay before retry number ``attempt`` (0-based)."""
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        return self.rng.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def call(self, func: Callable[[], Any],
+             limiter: TokenBucket | None = None,
+             on_ambiguous: Callable[[], Any] | None = None) -> Any:
+        """Call func(), retrying it on TransientError.
+
+        Args:
+            func: The operation; raises TransientError when it may be retried.
+            limiter: Optional rate limiter, acquired before every attempt.
+            on_ambiguous: Called after an ambiguous failure, before the retry.
+                A non-None result means the operation did take effect; it is
+                returned instead of retrying. Without it, ambiguous failures
+                are not retried.
+
+        Returns:
+            The result of func() (or of on_ambiguous()).
+
+        Raises:
+            GerritError: When retries are exhausted or a failure is final.
+        """
+        attempt = 0
+        while True:
+            if limiter is not None:
+                limiter.acquire()
+            try:
+                return func()
+            except TransientError as e:
+                if attempt >= self.retries or (e.ambiguous and on_ambiguous is None):
+                    raise
+                delay = self.delay(attempt, e.retry_after)
+                gerrit_trace.event("retry", attempt=attempt + 1, status=e.status,
+                                   ambiguous=e.ambiguous,
+                                   delay_ms=round(delay * 1000, 3))
+                self.sleep(delay)
+                attempt += 1
+                if e.ambiguous:
+                    found = on_ambiguous()
+                    if found is not None:
+                        return found
+
+
+_parallel_pool: ThreadPoolExecutor | None = None
+_parallel_size = 0
+_parallel_lock = threading.Lock()
+
+
+def run_parallel(calls: list[Callable[[], Any]],
+                 max_workers: int | None = None) -> list[Any]:
+    """Run independent calls concurrently, return results in order.
+
+    The first call runs on the current thread, the others on a shared
+    worker pool. The first exception raised by any call is re-raised after
+    all calls have finished.
+
+    Args:
+        calls: Functions to call without arguments.
+        max_workers: Worker threads the shared pool should have, usually the
+            client's connection pool size (see get_pool_size()); defaults to
+            the configured pool size. The pool grows to the largest size
+            asked for and never shrinks.
+    """
+    global _parallel_pool, _parallel_size
+    if len(calls) <= 1:
+        return [call() for call in calls]
+
+    size = max_workers or get_client_options()[0]
+    with _parallel_lock:
+        if _parallel_pool is None or size > _parallel_size:
+            old = _parallel_pool
+            _parallel_pool = ThreadPoolExecutor(
+                max_workers=size, thread_name_prefix="gerrit-io"
+            )
+            _parallel_size = size
+            if old is not None:
+                # Calls already submitted still run to completion; submitting
+                # under the lock keeps other callers off the old pool
+                old.shutdown(wait=False)
+        futures = [_parallel_pool.submit(call) for call in calls[1:]]
+
+    results: list[Any] = []
+    error: BaseException | None = None
+    try:
+        results.append(calls[0]())
+    except BaseException as e:
+        error = e
+    for future in futures:
+        try:
+            results.append(future.result())
+        except BaseException as e:
+            if error is None:
+                error = e
+    if error is not None:
+        raise error
+    return results
+
+
+_clients: dict[tuple, GerritClient] = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(base_url: str, pool_size: int | None = None,
+               timeout: float | None = None,
+               connect_timeout: float | None = None) -> GerritClient:
+    """Return a shared GerritClient for base_url.
+
+    Clients are cached per base URL, credentials and options, so every call
+    in the process reuses one requests session and its keep-alive connection
+    pool. The client is safe to share between threads; the pool holds up to
+    ``pool_size`` idle connections per host.
+
+    Args:
+        base_url: Gerrit server base URL.
+        pool_size: Keep-alive connections kept per host.
+        timeout: Read timeout in seconds.
+        connect_timeout: Connect timeout in seconds.
+
+    Returns:
+        Shared GerritClient instance.
+
+    Raises:
+        GerritError: When credentials or options are missing or invalid.
+    """
+    username, password = get_credentials()
+    pool_size, timeouts = get_client_options(pool_size, timeout, connect_timeout)
+    key = (base_url.rstrip("/"), username, password, pool_size, timeouts)
+
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            # Deferred until the first request, so --help and bad arguments
+            # fail fast without loading the HTTP stack
+            from gerrit import GerritClient
+            from requests import Session
+            from requests.adapters import HTTPAdapter
+
+            session = Session()
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            gerrit_trace.instrument_session(session)
+            client = GerritClient(
+                base_url=base_url,
+                username=username,
+                password=password,
+                session=session,
+                timeout=timeouts,
+            )
+            client.pool_size = pool_size
+            install_request_counter(client)
+            _clients[key] = client
+    return client
+
+
+def close_clients() -> None:
+    """Close all shared clients and their connection pools."""
+    with _clients_lock:
+        clients = list(_clients.values())
+        _clients.clear()
+    for client in clients:
+        client.session.close()
+
+
+class AsyncGerritClient:
+    """Asyncio front end for a shared GerritClient.
+
+    Requests run on a worker pool sized like the connection pool, so many
+    awaiting coroutines share the same keep-alive connections.
+    """
+
+    def __init__(self, client: GerritClient, max_workers: int | None = None):
+        self.client = client
+        workers = max_workers or get_client_options()[0]
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="gerrit-async"
+        )
+
+    async def _run(self, func, *args, **kwargs):
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, functools.partial(func, *args, **kwargs)
+        )
+
+    async def get(self, endpoint: str, **kwargs):
+        """Send HTTP GET to the endpoint."""
+        return await self._run(self.client.get, endpoint, **kwargs)
+
+    async def post(self, endpoint: str, **kwargs):
+        """Send HTTP POST to the endpoint."""
+        return await self._run(self.client.post, endpoint, **kwargs)
+
+    async def put(self, endpoint: str, **kwargs):
+        """Send HTTP PUT to the endpoint."""
+        return await self._run(self.client.put, endpoint, **kwargs)
+
+    def close(self) -> None:
+        """Shut down the worker pool; the shared client stays open."""
+        self._executor.shutdown(wait=False)
+
+    async def __aenter__(self) -> AsyncGerritClient:
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        self.close()
+
+
+def get_async_client(base_url: str, pool_size: int | None = None,
+                     timeout: float | None = None,
+                     connect_timeout: float | None = None) -> AsyncGerritClient:
+    """Return an AsyncGerritClient over the shared client for base_url."""
+    pool_size, _ = get_client_options(pool_size, timeout, connect_timeout)
+    client = get_client(base_url, pool_size, timeout, connect_timeout)
+    return AsyncGerritClient(client, max_workers=pool_size)
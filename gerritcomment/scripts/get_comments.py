@@ -5,16 +5,65 @@ Self-contained, no external dependencies except python-gerrit-api.
 """
 from __future__ import annotations
 
+import sys
+
+if __name__ == "__main__":
+    # Hand the call to a running gerrit_daemon.py before the heavy imports
+    from gerrit_daemon import forward_to_daemon
+    forward_to_daemon("get_comments")
+
 import argparse
+import bisect
+import functools
 import json
-import sys
+import os
+import re
+import tempfile
+import time
 from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
 from datetime import datetime
+from typing import TYPE_CHECKING, Callable, Container, Iterable, Iterator, TextIO
+from urllib.parse import quote
+
+import gerrit_trace
+from comment_index import INDEX_ENV, CommentIndex, sync_results
+from gerrit_cache import ResponseCache, cached_get, cached_stream
+from gerrit_files import (
+    PATCHSET_LEVEL,
+    LineMap,
+    get_file_content,
+    get_file_diff,
+    get_revision_files,
+    line_map,
+    map_line,
+)
+from gerrit_utils import (
+    GerritError,
+    get_batch_pool_size,
+    get_client,
+    get_config,
+    get_pool_size,
+    resolve_change,
+    run_parallel,
+)
+from json_stream import iter_keyed_items
 
-from gerrit import GerritClient
-from requests import HTTPError
+if TYPE_CHECKING:
+    from gerrit import GerritClient
 
-from gerrit_utils import GerritError, parse_change_url, get_config
+DEFAULT_JOBS = 8
+DEFAULT_PAGE_SIZE = 100
+DEFAULT_WATCH_INTERVAL = 30.0
+DEFAULT_WATCH_MAX_INTERVAL = 300.0
+
+# Fields of the thread and comment output shapes, in output order
+THREAD_FIELDS = ("file", "range", "line", "unresolved", "updated", "opened_during",
+                 "replied_in", "resolved_in", "latest", "context", "comments")
+COMMENT_FIELDS = ("id", "in_reply_to", "patch_set", "author", "message",
+                  "updated", "unresolved")
+# Rough bytes per token of JSON output, for --size-report estimates
+BYTES_PER_TOKEN = 4
 
 
 def parse_gerrit_timestamp(value: str | None) -> datetime:
@@ -41,11 +90,142 @@ def parse_gerrit_timestamp(value: str | None) -> datetime:
         return datetime.min
 
 
+_TIMESTAMP_RE = re.compile(r"(\d{4})-(\d\d)-(\d\d) (\d\d):(\d\d):(\d\d)$")
+
+
+def timestamp_key(value: str | None) -> int:
+    """Convert a Gerrit timestamp to an integer sort key.
+
+    Keys order exactly like parse_gerrit_timestamp() results, with 0 for
+    missing or invalid timestamps (datetime.min). The common fixed-width
+    format is converted without strptime().
+    """
+    if not value:
+        return 0
+    head, dot, frac = value.strip().partition(".")
+    match = _TIMESTAMP_RE.match(head)
+    if match is None or (dot and not frac.isdigit()):
+        ts = parse_gerrit_timestamp(value)
+        return int(ts.strftime("%Y%m%d%H%M%S%f")) if ts != datetime.min else 0
+    fields = match.groups()
+    try:
+        datetime(*map(int, fields))
+    except ValueError:
+        return 0
+    return int("".join(fields) + (frac + "000000")[:6])
+
+
+def _walk_root(start: str, parent: str, known: Container[str],
+               parent_of: Callable[[str], str | None],
+               roots: dict[str, str], cycle_pred: dict[str, str]) -> str:
+    """Walk from a reply up to its thread root, memoizing every step.
+
+    Every comment on the walked path gets its root stored in ``roots``, so
+    each comment is walked at most once across all calls.
+
+    Args:
+        start: Id of the reply to resolve.
+        parent: The reply's in_reply_to, a known comment id.
+        known: Ids of all comments of the change.
+        parent_of: Returns the in_reply_to of a known comment.
+        roots: Memoized {comment_id: root_id}, updated in place.
+        cycle_pred: {cycle member: member replying to it}, updated in place.
+
+    Returns:
+        Root id of ``start``.
+    """
+    path = [start]
+    on_path = {start: 0}
+    cur = parent
+    while True:
+        if cur in cycle_pred:
+            # Chain runs into a known cycle: stop before the entry point
+            root = cycle_pred[cur]
+            break
+        if cur in roots:
+            root = roots[cur]
+            break
+        if cur in on_path:
+            # Reply cycle: members are their own roots
+            cycle = path[on_path[cur]:]
+            for i, member in enumerate(cycle):
+                roots[member] = member
+                cycle_pred[member] = cycle[i - 1]
+            path = path[:on_path[cur]]
+            root = cycle_pred[cur]
+            break
+        on_path[cur] = len(path)
+        path.append(cur)
+        nxt = parent_of(cur)
+        if not nxt:
+            root = cur
+            break
+        if nxt not in known:
+            # Orphan reply - parent might be in different patchset
+            root = nxt
+            break
+        cur = nxt
+
+    for cid in path:
+        roots[cid] = root
+    return roots[start]
+
+
+def _thread_root(cid: str, parent: str | None, known: Container[str],
+                 parent_of: Callable[[str], str | None],
+                 roots: dict[str, str], cycle_pred: dict[str, str]) -> str:
+    """Return the thread root of one comment, memoized in ``roots``.
+
+    The single place deciding a root; see resolve_thread_roots() for the
+    semantics. Arguments are those of _walk_root(), with ``parent`` the
+    comment's in_reply_to (None for a thread root).
+    """
+    root = roots.get(cid)
+    if root is not None:
+        return root
+    if not parent:
+        root = cid
+    elif parent not in known:
+        # Orphan reply - parent might be in different patchset
+        # Still use in_reply_to as root to group related comments
+        root = parent
+    elif parent in roots and parent not in cycle_pred:
+        root = roots[parent]
+    else:
+        return _walk_root(cid, parent, known, parent_of, roots, cycle_pred)
+    roots[cid] = root
+    return root
+
+
+def resolve_thread_roots(parents: dict[str, str | None]) -> dict[str, str]:
+    """Resolve the thread root of every comment in linear time.
+
+    Semantics match a naive walk up the ``in_reply_to`` chain:
+    a comment without ``in_reply_to`` is its own root; a reply whose parent
+    is unknown (e.g. on another patchset) uses the parent id as root; inside
+    a reply cycle every member is its own root, and a reply chain leading
+    into a cycle stops at the cycle member just before the entry point.
+
+    Args:
+        parents: Dict of {comment_id: in_reply_to or None} for all comments.
+
+    Returns:
+        Dict of {comment_id: root_id}.
+    """
+    roots: dict[str, str] = {}
+    cycle_pred: dict[str, str] = {}
+    for cid, parent in parents.items():
+        _thread_root(cid, parent, parents, parents.__getitem__, roots, cycle_pred)
+    return roots
+
+
 def build_threads_by_reply_chain(raw_comments: dict, by_id: dict[str, dict]) -> dict[str, list[dict]]:
     """Group comments into threads using in_reply_to chain.
 
     This correctly handles cross-patchset replies by following the reply chain
-    rather than grouping by location.
+    rather than grouping by location. Each comment is resolved once with its
+    root memoized (see _thread_root()), so deep reply chains cost linear
+    rather than quadratic time.
 
     Args:
         raw_comments: Dict of {file_path: [comment, ...]} from Gerrit API.
@@ -55,6 +235,11 @@ def build_threads_by_reply_chain(raw_comments: dict, by_id: dict[str, dict]) ->
         Dict of {root_comment_id: [comments in thread]}.
     """
     threads_by_root: dict[str, list[dict]] = defaultdict(list)
+    roots: dict[str, str] = {}
+    cycle_pred: dict[str, str] = {}
+
+    def parent_of(cid: str) -> str | None:
+        return by_id[cid].get("in_reply_to")
 
     for path, items in raw_comments.items():
         for c in items:
@@ -65,65 +250,636 @@ def build_threads_by_reply_chain(raw_comments: dict, by_id: dict[str, dict]) ->
             # Store file path in comment for later use
             c["_file_path"] = path
 
-            # Walk up the reply chain to find root
-            root = cid
-            seen: set[str] = set()
-            cur = c
-            while True:
-                in_reply_to = cur.get("in_reply_to")
-                if not in_reply_to:
-                    break
-                if in_reply_to in seen:
-                    break
-                seen.add(in_reply_to)
-                parent = by_id.get(in_reply_to)
-                if not parent:
-                    # Orphan reply - parent might be in different patchset
-                    # Still use in_reply_to as root to group related comments
-                    root = in_reply_to
-                    break
-                root = in_reply_to
-                cur = parent
-
+            root = _thread_root(cid, c.get("in_reply_to"), by_id, parent_of,
+                                roots, cycle_pred)
             threads_by_root[root].append(c)
 
     return threads_by_root
 
 
-def fetch_comments(base_url: str, change_ref: str, revision: str | None = None,
-                   unresolved_only: bool = True) -> dict:
-    """Fetch comments from Gerrit API.
+class Comment:
+    """Compact internal form of one published comment.
+
+    Holds only the fields that reach the output. Author names and file paths
+    are interned, so comments from the same bot or file share one string,
+    and the timestamp is parsed once into an integer sort key.
+    """
+
+    __slots__ = ("id", "in_reply_to", "patch_set", "author", "message",
+                 "updated", "unresolved", "path", "line", "range", "side", "key")
+
+    def __init__(self, raw: dict, path: str):
+        author_info = raw.get("author") or {}
+        self.id = raw.get("id")
+        self.in_reply_to = raw.get("in_reply_to")
+        self.patch_set = raw.get("patch_set")
+        self.author = sys.intern(
+            author_info.get("display_name") or author_info.get("name") or "Unknown"
+        )
+        self.message = (raw.get("message") or "").strip()
+        self.updated = raw.get("updated")
+        self.unresolved = bool(raw.get("unresolved"))
+        self.path = path
+        self.line = raw.get("line")
+        self.range = raw.get("range")
+        # Only set for comments on the base ('PARENT') side
+        self.side = sys.intern(raw["side"]) if raw.get("side") else None
+        self.key = timestamp_key(self.updated)
+
+    def to_dict(self) -> dict:
+        """Serialize to the comment shape of the JSON output."""
+        return {
+            "id": self.id,
+            "in_reply_to": self.in_reply_to,
+            "patch_set": self.patch_set,
+            "author": self.author,
+            "message": self.message,
+            "updated": self.updated,
+            "unresolved": self.unresolved,
+        }
+
+
+class Thread:
+    """A reply chain of comments, oldest first."""
+
+    __slots__ = ("root", "comments", "history", "latest", "context")
+
+    def __init__(self, root: Comment, comments: list[Comment]):
+        self.root = root
+        self.comments = comments
+        # Patch set annotations, set by annotate_patchset_history()
+        self.history: dict | None = None
+        # Position in the latest patch set, set by remap_threads()
+        self.latest: dict | None = None
+        # Surrounding source lines, set by attach_context()
+        self.context: dict | None = None
+
+    @property
+    def last(self) -> Comment:
+        return self.comments[-1]
+
+    @property
+    def unresolved(self) -> bool:
+        return self.comments[-1].unresolved
+
+    def to_dict(self, comment: Callable[[Comment], dict] | None = None) -> dict:
+        """Serialize to the thread shape of the JSON output.
+
+        Args:
+            comment: Serializer for each comment (default: Comment.to_dict()).
+        """
+        last = self.comments[-1]
+        data = {
+            "file": self.root.path,
+            "range": self.root.range,
+            "line": self.root.line,
+            "unresolved": last.unresolved,
+            "updated": last.updated,
+        }
+        if self.history is not None:
+            data.update(self.history)
+        if self.latest is not None:
+            data["latest"] = self.latest
+        if self.context is not None:
+            data["context"] = self.context
+        data["comments"] = [(comment or Comment.to_dict)(c) for c in self.comments]
+        return data
+
+
+def parse_fields(spec: str) -> tuple[frozenset[str], frozenset[str]]:
+    """Parse a comma-separated --fields list.
+
+    Comment fields are written 'comments.<field>'. A bare 'comments' selects
+    every comment field, and any comment field implies 'comments'.
+
+    Returns:
+        Tuple of (thread fields, comment fields).
+
+    Raises:
+        ValueError: If a field is unknown or none is given.
+    """
+    thread_fields: set[str] = set()
+    comment_fields: set[str] = set()
+    for name in (f.strip() for f in spec.split(",")):
+        if not name:
+            continue
+        prefix, dot, field = name.partition(".")
+        if dot and prefix == "comments" and field in COMMENT_FIELDS:
+            comment_fields.add(field)
+            thread_fields.add("comments")
+        elif not dot and name in THREAD_FIELDS:
+            thread_fields.add(name)
+        else:
+            raise ValueError(f"unknown field {name!r}")
+    if not thread_fields:
+        raise ValueError("no fields given")
+    if "comments" in thread_fields and not comment_fields:
+        comment_fields.update(COMMENT_FIELDS)
+    return frozenset(thread_fields), frozenset(comment_fields)
+
+
+class Projection:
+    """Output shaping of threads for --fields and --max-message-chars.
+
+    Use default() as the ``default`` hook of json.dump() in place of
+    json_default(), so threads are still serialized one at a time.
+    """
+
+    __slots__ = ("thread_fields", "comment_fields", "max_message_chars")
+
+    def __init__(self, fields: str | None = None,
+                 max_message_chars: int | None = None):
+        """Create a projection.
+
+        Args:
+            fields: Comma-separated fields to keep, see parse_fields();
+                None keeps all.
+            max_message_chars: Cut longer messages to this many characters
+                followed by '…'; None keeps them whole.
+
+        Raises:
+            ValueError: If ``fields`` is invalid.
+        """
+        self.thread_fields: frozenset[str] | None = None
+        self.comment_fields: frozenset[str] | None = None
+        if fields is not None:
+            self.thread_fields, self.comment_fields = parse_fields(fields)
+        self.max_message_chars = max_message_chars
+
+    def comment(self, comment: Comment) -> dict:
+        """Serialize a comment with only the selected fields."""
+        data = comment.to_dict()
+        if self.comment_fields is not None:
+            data = {k: v for k, v in data.items() if k in self.comment_fields}
+        limit = self.max_message_chars
+        if limit is not None and len(data.get("message") or "") > limit:
+            data["message"] = data["message"][:limit].rstrip() + "…"
+        return data
+
+    def thread(self, thread: Thread) -> dict:
+        """Serialize a thread with only the selected fields."""
+        fields = self.thread_fields
+        if fields is not None and "comments" not in fields:
+            # Skip serializing comments that would be dropped anyway
+            return {k: v for k, v in thread.to_dict(lambda c: {}).items()
+                    if k in fields}
+        data = thread.to_dict(self.comment)
+        if fields is not None:
+            data = {k: v for k, v in data.items() if k in fields}
+        return data
+
+    def default(self, obj):
+        """JSON encoder hook like json_default(), applying the projection."""
+        if isinstance(obj, Thread):
+            return self.thread(obj)
+        if isinstance(obj, Comment):
+            return self.comment(obj)
+        return json_default(obj)
+
+
+def _drain_files(raw: dict[str, list[dict]]) -> Iterator[tuple[str, dict]]:
+    """Yield (path, comment) pairs, popping files so they are freed early."""
+    for path in list(raw):
+        for item in raw.pop(path):
+            yield path, item
+
+
+def collect_threads(raw: dict[str, list[dict]] | Iterable[tuple[str, dict]],
+                    unresolved_only: bool = True,
+                    since: str | None = None,
+                    observe: Callable[[Thread], None] | None = None,
+                    ) -> tuple[list[Thread], str | None]:
+    """Build sorted threads from a Gerrit comments response.
+
+    Args:
+        raw: Dict of {file_path: [comment, ...]} from Gerrit API, which is
+            consumed (emptied) to release the decoded response early, or an
+            iterable of (file_path, comment) pairs such as the output of
+            json_stream.iter_keyed_items().
+        unresolved_only: If True, only return unresolved threads.
+        since: Optional Gerrit timestamp; only threads with a comment updated
+            after it are returned.
+        observe: Optional callback called with every thread, before the
+            ``since`` and ``unresolved_only`` filters.
+
+    Returns:
+        Tuple of (threads, newest first; watermark), where the watermark is
+        the newest comment timestamp (or ``since`` if newer).
+    """
+    if isinstance(raw, dict):
+        raw = _drain_files(raw)
+
+    by_id: dict[str, Comment] = {}
+    ordered: list[Comment] = []
+    # Build records as comments arrive, nothing else of the response is kept
+    last_path = interned = None
+    for path, item in raw:
+        if path is not last_path:
+            last_path, interned = path, sys.intern(path)
+        c = Comment(item, interned)
+        if c.id:
+            by_id[c.id] = c
+            ordered.append(c)
+
+    # Group comments into threads by reply chain
+    roots: dict[str, str] = {}
+    cycle_pred: dict[str, str] = {}
+    groups: dict[str, list[Comment]] = defaultdict(list)
+
+    def parent_of(cid: str) -> str | None:
+        return by_id[cid].in_reply_to
+
+    for c in ordered:
+        root = _thread_root(c.id, c.in_reply_to, by_id, parent_of, roots, cycle_pred)
+        groups[root].append(c)
+
+    since_key = timestamp_key(since) if since else None
+    watermark = since
+    watermark_key = since_key or 0
+
+    threads: list[Thread] = []
+    for root_id, items in groups.items():
+        # Sort comments in thread by updated time (chronological)
+        items.sort(key=lambda c: c.key)
+        last = items[-1]
+
+        # The last comment is the newest, so it decides the watermark
+        if last.key > watermark_key:
+            watermark_key, watermark = last.key, last.updated
+
+        skip = ((since_key is not None and last.key <= since_key)
+                or (unresolved_only and not last.unresolved))
+        if skip and observe is None:
+            continue
+
+        # Use root comment for location metadata
+        thread = Thread(by_id.get(root_id) or items[0], items)
+        if observe is not None:
+            observe(thread)
+        if not skip:
+            threads.append(thread)
+
+    # Sort threads by latest comment time (newest first)
+    threads.sort(key=lambda t: t.comments[-1].key, reverse=True)
+    return threads, watermark
+
+
+def annotate_patchset_history(threads: Iterable[Thread], revisions: dict,
+                              latest_patchset: int | None = None) -> list[dict]:
+    """Annotate threads with the patch sets they evolved in.
+
+    A comment is attributed to the patch set that was current when it was
+    posted, derived from the revisions' creation times, and never to one
+    older than the patch set it is attached to. So a reply added to a PS1
+    thread after PS3 was uploaded counts as activity in PS3.
+
+    Each thread gets a ``history`` of 'opened_during', 'replied_in' (sorted
+    list) and 'resolved_in' (None while unresolved), all attributed that
+    way. 'opened_during' is named apart because it can differ from the
+    root comment's own 'patch_set': a new thread on PS1 opened after PS3
+    was uploaded was opened during PS3.
+
+    Args:
+        threads: All threads of the change, resolved ones included.
+        revisions: The change's 'revisions' map, as returned with the
+            ALL_REVISIONS option.
+        latest_patchset: Latest patch set number, if known.
+
+    Returns:
+        One delta per patch set, oldest first: the number of threads
+        'opened', 'replied' to, 'resolved' and 'reopened' while it was
+        current, and the 'unresolved' count once it was superseded.
+    """
+    starts = sorted(
+        (timestamp_key(rev.get("created")), rev["_number"])
+        for rev in revisions.values()
+        if isinstance(rev.get("_number"), int) and rev.get("created")
+    )
+    start_keys = [key for key, _ in starts]
+    latest = max([latest_patchset or 0] + [number for _, number in starts])
+
+    def patchset_of(c: Comment) -> int:
+        i = bisect.bisect_right(start_keys, c.key) - 1
+        current = starts[i][1] if i >= 0 else 0
+        return max(current, c.patch_set or 0)
+
+    counts: dict[int, dict[str, int]] = defaultdict(
+        lambda: dict.fromkeys(("opened", "replied", "resolved", "reopened", "unresolved"), 0)
+    )
+    for thread in threads:
+        root = thread.comments[0]
+        opened_during = patchset_of(root)
+        counts[opened_during]["opened"] += 1
+        resolved_in = None if root.unresolved else opened_during
+        replied_in: set[int] = set()
+        # State at the end of each patch set the thread was active in
+        states = {opened_during: root.unresolved}
+        state = root.unresolved
+        for c in thread.comments[1:]:
+            number = patchset_of(c)
+            replied_in.add(number)
+            if c.unresolved != state:
+                state = c.unresolved
+                if state:
+                    counts[number]["reopened"] += 1
+                    resolved_in = None
+                else:
+                    counts[number]["resolved"] += 1
+                    resolved_in = number
+            states[number] = state
+        for number in replied_in:
+            counts[number]["replied"] += 1
+
+        # Record changes of the unresolved count, summed up below
+        previous = False
+        for number in sorted(states):
+            if states[number] != previous:
+                previous = states[number]
+                counts[number]["unresolved"] += 1 if previous else -1
+
+        thread.history = {
+            "opened_during": opened_during,
+            "replied_in": sorted(replied_in),
+            "resolved_in": resolved_in,
+        }
+
+    deltas = []
+    unresolved = 0
+    for number in range(1, max(latest, max(counts, default=0)) + 1):
+        delta = counts[number]
+        unresolved += delta["unresolved"]
+        deltas.append({"patch_set": number, **delta, "unresolved": unresolved})
+    return deltas
+
+
+def _thread_lines(comment: Comment) -> tuple[int, int] | None:
+    """Return the first and last line a comment is anchored to, if any."""
+    start = (comment.range or {}).get("start_line")
+    if start:
+        return start, max(start, comment.range.get("end_line") or start)
+    if comment.line:
+        return comment.line, comment.line
+    return None
+
+
+def attach_context(client: GerritClient, change_ref: str, threads: list[Thread],
+                   revisions: dict, context: int,
+                   cache: ResponseCache | None = None) -> int:
+    """Attach the source lines around each thread's position as its 'context'.
+
+    Each file is fetched once per revision, however many threads it has,
+    and the files are fetched in parallel. Contents of a revision never
+    change, so they are cached as immutable entries. Threads on the base
+    ('PARENT') side, file-level threads and threads whose file cannot be
+    fetched are left without context.
+
+    Args:
+        client: Gerrit client.
+        change_ref: Change number or Change-Id.
+        threads: Threads to annotate.
+        revisions: Revisions of the change as {sha: RevisionInfo}.
+        context: Lines shown before the first and after the last line.
+        cache: Optional response cache for file contents.
+
+    Returns:
+        Number of distinct files needed.
+    """
+    sha_of = {rev.get("_number"): sha for sha, rev in revisions.items()}
+    by_file: dict[tuple[str, str], list[Thread]] = defaultdict(list)
+    for thread in threads:
+        root = thread.root
+        sha = sha_of.get(root.patch_set)
+        # Patch set level comments have no line; /COMMIT_MSG has content
+        if sha and root.side is None and _thread_lines(root):
+            by_file[sha, root.path].append(thread)
+
+    def annotate(sha: str, path: str, members: list[Thread]) -> None:
+        try:
+            text = get_file_content(client, change_ref, sha, path, cache)
+        except GerritError:
+            return
+        # Gerrit numbers lines by '\n' only
+        lines = text.split("\n")
+        if text.endswith("\n"):
+            lines.pop()
+        for thread in members:
+            start, end = _thread_lines(thread.root)
+            first = max(1, start - context)
+            last = min(len(lines), end + context)
+            thread.context = {"start_line": first, "lines": lines[first - 1:last]}
+
+    # Only the windows are kept, each file's text is dropped after use
+    run_parallel([
+        lambda key=key, members=members: annotate(*key, members)
+        for key, members in by_file.items()
+    ], get_pool_size(client))
+    return len(by_file)
+
+
+def _latest_position(root: Comment, patch_set: int, path: str | None,
+                     lines: LineMap | None = None) -> dict:
+    """Return a thread's position in the latest patch set.
+
+    Args:
+        root: The thread's first comment.
+        patch_set: Latest patch set number.
+        path: The file's path in the latest patch set; None if deleted.
+        lines: Line map from the thread's patch set, or None if the file
+            is unchanged.
+    """
+    position = {"patch_set": patch_set, "file": path, "line": None, "exact": path is not None}
+    if path is None:
+        return position
+
+    def move(line: int) -> int:
+        if lines is None:
+            return line
+        new, exact = map_line(lines, line)
+        if not exact:
+            position["exact"] = False
+        return new
+
+    if root.line:
+        position["line"] = move(root.line)
+    if root.range and root.range.get("start_line"):
+        moved = dict(root.range)
+        moved["start_line"] = move(root.range["start_line"])
+        moved["end_line"] = max(moved["start_line"],
+                                move(root.range.get("end_line") or root.range["start_line"]))
+        position["range"] = moved
+    return position
+
+
+def remap_threads(client: GerritClient, change_ref: str, threads: list[Thread],
+                  revisions: dict, latest_patchset: int,
+                  cache: ResponseCache | None = None) -> int:
+    """Set each thread's position in the latest patch set as its 'latest'.
+
+    Changed files are found with one file list per older patch set; only
+    those are diffed, once per (file, older patch set) however many threads
+    they have, all in parallel. Diffs between patch sets never change, so
+    they are cached as immutable entries. A thread's position is 'exact'
+    unless its lines were changed, when it points at the replacement (or
+    where the lines were deleted); 'file' follows renames and is None for
+    deleted files. Threads on the base side, patch set level threads and
+    threads whose diff cannot be fetched get no position.
+
+    Args:
+        client: Gerrit client.
+        change_ref: Change number or Change-Id.
+        threads: Threads to annotate.
+        revisions: Revisions of the change as {sha: RevisionInfo}.
+        latest_patchset: Latest patch set number.
+        cache: Optional response cache for file lists and diffs.
+
+    Returns:
+        Number of diffs needed.
+    """
+    sha_of = {rev.get("_number"): sha for sha, rev in revisions.items()}
+    latest_sha = sha_of.get(latest_patchset)
+    if latest_sha is None:
+        return 0
+
+    by_base: dict[int, list[Thread]] = defaultdict(list)
+    for thread in threads:
+        root = thread.root
+        if root.side is not None or root.path == PATCHSET_LEVEL or not root.patch_set:
+            continue
+        if root.patch_set == latest_patchset:
+            thread.latest = _latest_position(root, latest_patchset, root.path)
+        elif root.patch_set in sha_of:
+            by_base[root.patch_set].append(thread)
+
+    def files_since(base: int) -> dict | None:
+        try:
+            return get_revision_files(client, change_ref, latest_sha, cache, base=base)
+        except GerritError:
+            return None
+
+    bases = list(by_base)
+    # Threads on changed files, by (path in the latest patch set, base)
+    to_diff: dict[tuple[str, int], list[Thread]] = defaultdict(list)
+    for base, files in zip(bases, run_parallel([
+        lambda base=base: files_since(base) for base in bases
+    ], get_pool_size(client))):
+        if files is None:
+            continue
+        renamed = {info["old_path"]: path for path, info in files.items()
+                   if info.get("status") == "R" and info.get("old_path")}
+        for thread in by_base[base]:
+            path = renamed.get(thread.root.path, thread.root.path)
+            info = files.get(path)
+            if info is None:
+                # Not modified since the thread's patch set
+                thread.latest = _latest_position(thread.root, latest_patchset, path)
+            elif info.get("status") == "D":
+                thread.latest = _latest_position(thread.root, latest_patchset, None)
+            else:
+                to_diff[path, base].append(thread)
+
+    def remap(path: str, base: int, members: list[Thread]) -> None:
+        try:
+            lines = line_map(get_file_diff(client, change_ref, latest_sha, path,
+                                           base, cache))
+        except GerritError:
+            return
+        for thread in members:
+            thread.latest = _latest_position(thread.root, latest_patchset, path, lines)
+
+    run_parallel([
+        lambda key=key, members=members: remap(*key, members)
+        for key, members in to_diff.items()
+    ], get_pool_size(client))
+    return len(to_diff)
+
+
+def fetch_threads(base_url: str, change_ref: str, revision: str | None = None,
+                  unresolved_only: bool = True,
+                  client: GerritClient | None = None,
+                  cache: ResponseCache | None = None,
+                  since: str | None = None,
+                  history: bool = False,
+                  context: int | None = None,
+                  remap: bool = False,
+                  file_cache: ResponseCache | None = None) -> dict:
+    """Fetch comment threads from Gerrit API as compact Thread records.
+
+    Same as fetch_comments(), but threads are returned as Thread objects;
+    serialize them with json_default() or Thread.to_dict().
 
     Args:
         base_url: Gerrit server base URL.
         change_ref: Change number or Change-Id.
         revision: Optional revision (SHA, patch set number, or 'current').
         unresolved_only: If True, only return unresolved threads.
+        client: Optional client to use instead of the shared one for base_url.
+        cache: Optional response cache; cached reads are revalidated by ETag.
+        since: Optional Gerrit timestamp; only threads with a comment updated
+            after it are returned.
+        history: If True, annotate threads with annotate_patchset_history()
+            and add its per-patch set deltas as 'patchsets'.
+        context: If set, attach this many lines of source around each
+            thread with attach_context().
+        remap: If True, add each thread's position in the latest patch set
+            with remap_threads().
+        file_cache: Cache for the file contents of ``context`` and the
+            diffs of ``remap``; defaults to ``cache``.
 
     Returns:
-        Dict with 'threads' list and 'latest_patchset' number.
+        Dict with 'threads' list, the change 'number', 'latest_patchset'
+        number and 'watermark', plus 'patchsets' with ``history``.
     """
-    _, username, password = get_config()
-    client = GerritClient(
-        base_url=base_url,
-        username=username,
-        password=password,
-    )
+    from requests import HTTPError
+
+    if client is None:
+        client = get_client(base_url)
+
+    endpoint = f"/changes/{quote(change_ref, safe='~')}"
+    if revision:
+        comments_endpoint = f"{endpoint}/revisions/{quote(revision, safe='')}/comments"
+    else:
+        comments_endpoint = f"{endpoint}/comments"
 
+    # Every thread is annotated, including those filtered from the output
+    all_threads: list[Thread] = []
+    observe = all_threads.append if history else None
+
+    def collect():
+        # Parse the comments as they download, one comment at a time; the
+        # span includes the download, its 'http' span has the read time
+        with gerrit_trace.span("collect_threads") as fields:
+            chunks = cached_stream(client, comments_endpoint, cache)
+            threads, watermark = collect_threads(iter_keyed_items(chunks),
+                                                 unresolved_only, since, observe)
+            fields["threads"] = len(threads)
+        return threads, watermark
+
+    # Creation times of all patch sets date the comments for the history,
+    # and their SHAs locate the files for the context and remapping
+    option = ("ALL_REVISIONS" if history or remap or context is not None
+              else "CURRENT_REVISION")
     try:
-        change = client.changes.get(change_ref)
-        # Get latest patchset number via direct API call with CURRENT_REVISION
-        change_data = client.get(f"/changes/{change_ref}?o=CURRENT_REVISION")
+        # Change detail and comments are independent, fetch them in one round trip
+        change_data, (threads, watermark) = run_parallel([
+            lambda: cached_get(client, f"{endpoint}?o={option}", cache),
+            collect,
+        ], get_pool_size(client))
         current_rev_sha = change_data.get("current_revision")
         revisions = change_data.get("revisions", {})
         if current_rev_sha:
             latest_patchset = revisions.get(current_rev_sha, {}).get("_number")
         else:
             latest_patchset = None
-        if revision:
-            raw = change.get_revision(revision).comments.list()
-        else:
-            raw = change.list_comments()
+        # Their file requests fail like the change's own: as a GerritError
+        if remap and threads and latest_patchset:
+            with gerrit_trace.span("remap", threads=len(threads)) as fields:
+                fields["diffs"] = remap_threads(client, change_ref, threads, revisions,
+                                                latest_patchset, file_cache or cache)
+        if context is not None and threads:
+            with gerrit_trace.span("context", threads=len(threads)) as fields:
+                fields["files"] = attach_context(client, change_ref, threads,
+                                                 revisions, context,
+                                                 file_cache or cache)
     except HTTPError as e:
         status = e.response.status_code if e.response is not None else 0
         if status == 401:
@@ -131,86 +887,565 @@ def fetch_comments(base_url: str, change_ref: str, revision: str | None = None,
         if status == 404:
             raise GerritError("Change not found (404)")
         raise GerritError(f"HTTP error: {e}")
+    except GerritError:
+        raise
     except Exception as e:
         raise GerritError(str(e))
 
-    # Build index of all comments by id
-    by_id: dict[str, dict] = {}
-    for path, items in raw.items():
-        for c in items:
-            cid = c.get("id")
-            if cid:
-                by_id[cid] = c
-                c["_file_path"] = path
+    data = {
+        "threads": threads,
+        "number": change_data.get("_number"),
+        "latest_patchset": latest_patchset,
+        "watermark": watermark,
+    }
+    if history:
+        with gerrit_trace.span("history", threads=len(all_threads)):
+            data["patchsets"] = annotate_patchset_history(all_threads, revisions,
+                                                          latest_patchset)
+    return data
 
-    # Group comments into threads by reply chain
-    threads_by_root = build_threads_by_reply_chain(raw, by_id)
 
-    threads: list[dict] = []
-    for root_id, t_items in threads_by_root.items():
-        # Sort comments in thread by updated time (chronological)
-        t_items_sorted = sorted(
-            t_items,
-            key=lambda x: parse_gerrit_timestamp(x.get("updated")),
-        )
-        last = t_items_sorted[-1] if t_items_sorted else None
-        thread_unresolved = bool(last.get("unresolved")) if last else False
+def fetch_comments(base_url: str, change_ref: str, revision: str | None = None,
+                   unresolved_only: bool = True,
+                   client: GerritClient | None = None,
+                   cache: ResponseCache | None = None,
+                   since: str | None = None,
+                   history: bool = False,
+                   context: int | None = None,
+                   remap: bool = False,
+                   file_cache: ResponseCache | None = None) -> dict:
+    """Fetch comments from Gerrit API.
+
+    Args:
+        base_url: Gerrit server base URL.
+        change_ref: Change number or Change-Id.
+        revision: Optional revision (SHA, patch set number, or 'current').
+        unresolved_only: If True, only return unresolved threads.
+        client: Optional client to use instead of the shared one for base_url.
+        cache: Optional response cache; cached reads are revalidated by ETag.
+        since: Optional Gerrit timestamp; only threads with a comment updated
+            after it are returned.
+        history: If True, add patch set history; see fetch_threads().
+        context: If set, attach source lines around threads; see
+            fetch_threads().
+        remap: If True, add positions in the latest patch set; see
+            fetch_threads().
+        file_cache: Cache for the file contents of ``context`` and the
+            diffs of ``remap``.
+
+    Returns:
+        Dict with 'threads' list, 'latest_patchset' number and 'watermark',
+        the newest comment timestamp of the change (or ``since`` if newer).
+    """
+    data = fetch_threads(base_url, change_ref, revision, unresolved_only,
+                         client=client, cache=cache, since=since,
+                         history=history, context=context, remap=remap,
+                         file_cache=file_cache)
+    data["threads"] = [t.to_dict() for t in data["threads"]]
+    return data
+
+
+def json_default(obj):
+    """JSON encoder hook serializing Thread and Comment records.
+
+    Passing it as ``default`` to json.dump() converts each thread only when
+    the encoder reaches it, so the output dicts never all exist at once.
+    """
+    if isinstance(obj, (Thread, Comment)):
+        return obj.to_dict()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def get_change_result(change: str, revision: str | None = None,
+                      unresolved_only: bool = True,
+                      pool_size: int | None = None,
+                      **fetch_kwargs) -> tuple[dict, bool]:
+    """Fetch threads for one change and format the output record.
+
+    Errors are captured in the returned record instead of being raised so
+    that one failing change does not abort a batch.
 
-        if unresolved_only and not thread_unresolved:
+    Args:
+        change: Change URL, number, or Change-Id.
+        revision: Optional revision (SHA, patch set number, or 'current').
+        unresolved_only: If True, only return unresolved threads.
+        pool_size: Connection pool size of the shared client.
+        **fetch_kwargs: Extra arguments for fetch_threads() (cache, since,
+            history).
+
+    Returns:
+        Tuple of (result dict, success flag). Threads are Thread records;
+        serialize with json_default().
+    """
+    with gerrit_trace.span("change", change=change) as fields:
+        try:
+            base_url, change_ref = resolve_change(change)
+            client = get_client(base_url, pool_size=pool_size)
+            data = fetch_threads(base_url, change_ref, revision, unresolved_only,
+                                 client=client, **fetch_kwargs)
+        except GerritError as e:
+            fields["error"] = type(e).__name__
+            return {
+                "change": change,
+                "revision": revision,
+                "error": {"type": type(e).__name__, "message": str(e)},
+            }, False
+        fields["threads"] = len(data["threads"])
+
+    result = {
+        "change": change_ref,
+        "number": data["number"],
+        "latest_patchset": data["latest_patchset"],
+        "unresolved_only": unresolved_only,
+    }
+    if fetch_kwargs.get("since"):
+        result["since"] = fetch_kwargs["since"]
+    result["watermark"] = data["watermark"]
+    result["thread_count"] = len(data["threads"])
+    if "patchsets" in data:
+        result["patchsets"] = data["patchsets"]
+    result["threads"] = data["threads"]
+    return result, True
+
+
+def iter_change_results(changes: list[str], revision: str | None = None,
+                        unresolved_only: bool = True,
+                        jobs: int = DEFAULT_JOBS,
+                        watermarks: dict[str, str] | None = None,
+                        **fetch_kwargs) -> Iterator[tuple[int, dict, bool]]:
+    """Fetch threads for many changes concurrently, yielding as they finish.
+
+    Args:
+        changes: Change URLs, numbers, or Change-Ids.
+        revision: Optional revision applied to every change.
+        unresolved_only: If True, only return unresolved threads.
+        jobs: Maximum number of changes fetched at the same time.
+        watermarks: Optional {change: timestamp} used as ``since`` for
+            changes without an explicit ``since``.
+        **fetch_kwargs: Extra arguments for fetch_threads() (cache, since,
+            history).
+
+    Yields:
+        Tuples of (index in ``changes``, result dict, success flag), in
+        completion order.
+    """
+    def fetch_one(change: str, pool_size: int | None = None) -> tuple[dict, bool]:
+        kwargs = fetch_kwargs
+        if watermarks and not fetch_kwargs.get("since") and watermarks.get(change):
+            kwargs = {**fetch_kwargs, "since": watermarks[change]}
+        return get_change_result(change, revision, unresolved_only, pool_size, **kwargs)
+
+    if len(changes) <= 1 or jobs <= 1:
+        for index, change in enumerate(changes):
+            yield (index, *fetch_one(change))
+        return
+
+    # Size the shared connection pool so every worker keeps its connection
+    pool_size = get_batch_pool_size(jobs)
+    with ThreadPoolExecutor(max_workers=min(jobs, len(changes))) as pool:
+        futures = {
+            pool.submit(fetch_one, change, pool_size): index
+            for index, change in enumerate(changes)
+        }
+        for future in as_completed(futures):
+            yield (futures[future], *future.result())
+
+
+def get_change_results(changes: list[str], revision: str | None = None,
+                       unresolved_only: bool = True,
+                       jobs: int = DEFAULT_JOBS,
+                       watermarks: dict[str, str] | None = None,
+                       **fetch_kwargs) -> list[tuple[dict, bool]]:
+    """Fetch threads for many changes concurrently.
+
+    Takes the same arguments as iter_change_results().
+
+    Returns:
+        List of (result dict, success flag), in the order of ``changes``.
+    """
+    results: list[tuple[dict, bool]] = [({}, False)] * len(changes)
+    for index, result, ok in iter_change_results(
+        changes, revision, unresolved_only, jobs, watermarks, **fetch_kwargs
+    ):
+        results[index] = (result, ok)
+    return results
+
+
+def iter_query_changes(client: GerritClient, query: str,
+                       page_size: int = DEFAULT_PAGE_SIZE) -> Iterator[dict]:
+    """Page through a Gerrit change search, yielding ChangeInfo entities.
+
+    Pages are requested as they are consumed, with ``start`` and ``n``.
+    A change that moves to a later page while paging is yielded once.
+
+    Args:
+        client: Gerrit client.
+        query: Gerrit search, e.g. 'is:open reviewer:self'.
+        page_size: Changes requested per page.
+
+    Raises:
+        GerritError: When the search fails, e.g. on invalid syntax.
+    """
+    from requests import HTTPError
+
+    seen: set[int] = set()
+    start = 0
+    while True:
+        endpoint = f"/changes/?q={quote(query, safe='')}&n={page_size}&start={start}"
+        try:
+            with gerrit_trace.span("query_page", start=start) as fields:
+                page = client.get(endpoint)
+                fields["changes"] = len(page)
+        except HTTPError as e:
+            raise GerritError(f"HTTP error: {e}")
+        except Exception as e:
+            raise GerritError(f"Query failed: {e}")
+        for change in page:
+            if change["_number"] not in seen:
+                seen.add(change["_number"])
+                yield change
+        if not page or not page[-1].get("_more_changes"):
+            return
+        start += len(page)
+
+
+def has_comments(change: dict, unresolved_only: bool = True) -> bool:
+    """Return whether a ChangeInfo may have threads worth fetching.
+
+    Uses the comment counts of search results; changes without counts
+    (older indexes) are assumed to have comments.
+    """
+    key = "unresolved_comment_count" if unresolved_only else "total_comment_count"
+    count = change.get(key)
+    return count is None or count > 0
+
+
+def iter_query_results(query: str, revision: str | None = None,
+                       unresolved_only: bool = True,
+                       jobs: int = DEFAULT_JOBS,
+                       watermarks: dict[str, str] | None = None,
+                       page_size: int = DEFAULT_PAGE_SIZE,
+                       on_skip: Callable[[dict], None] | None = None,
+                       **fetch_kwargs) -> Iterator[tuple[dict, bool]]:
+    """Fetch threads for every change matching a search, yielding as they finish.
+
+    Changes without (unresolved) comments, and changes not updated since
+    their watermark, are skipped without fetching their comments. The
+    others are fetched while later pages are read, with at most
+    ``2 * jobs`` changes in flight, so a search matching any number of
+    changes runs in bounded memory.
+
+    Args:
+        query: Gerrit search, e.g. 'is:open reviewer:self'.
+        revision: Optional revision applied to every change.
+        unresolved_only: If True, only return unresolved threads.
+        jobs: Maximum number of changes fetched at the same time.
+        watermarks: Optional {change number: timestamp} used as ``since``.
+        page_size: Changes requested per search page.
+        on_skip: Called with each skipped ChangeInfo.
+        **fetch_kwargs: Extra arguments for fetch_threads() (cache, since,
+            history).
+
+    Yields:
+        Tuples of (result dict, success flag), in completion order; change
+        results are keyed by change number.
+
+    Raises:
+        GerritError: When the search fails; results fetched so far have
+            been yielded.
+    """
+    base_url, _, _ = get_config()
+    # Size the shared connection pool so every worker keeps its connection
+    pool_size = get_batch_pool_size(jobs)
+    client = get_client(base_url, pool_size=pool_size)
+
+    def fetch_one(change: str) -> tuple[dict, bool]:
+        kwargs = fetch_kwargs
+        if watermarks and not fetch_kwargs.get("since") and watermarks.get(change):
+            kwargs = {**fetch_kwargs, "since": watermarks[change]}
+        return get_change_result(change, revision, unresolved_only, pool_size, **kwargs)
+
+    def unchanged(info: dict) -> bool:
+        # Nothing can be newer than the watermark if the change is not
+        mark = watermarks.get(str(info["_number"])) if watermarks else None
+        if not mark or fetch_kwargs.get("since") or not info.get("updated"):
+            return False
+        return timestamp_key(info["updated"]) <= timestamp_key(mark)
+
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        pending = set()
+        error = None
+        try:
+            for info in iter_query_changes(client, query, page_size):
+                # Write the finished changes while the search goes on
+                done, pending = wait(pending, timeout=0)
+                for future in done:
+                    yield future.result()
+                if not has_comments(info, unresolved_only) or unchanged(info):
+                    if on_skip is not None:
+                        on_skip(info)
+                    continue
+                if len(pending) >= 2 * jobs:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+                pending.add(pool.submit(fetch_one, str(info["_number"])))
+        except GerritError as e:
+            # Still report the changes fetched before the search failed
+            error = e
+        for future in as_completed(pending):
+            yield future.result()
+    if error is not None:
+        raise error
+
+
+def write_ndjson(result: dict, out: TextIO,
+                 default: Callable[[object], object] = json_default) -> None:
+    """Write one change result as NDJSON records.
+
+    A successful result becomes a 'change' header record followed by one
+    'thread' record per thread; a failure becomes a single 'error' record.
+    Each thread is serialized on its own, so memory stays bounded by the
+    largest thread rather than the whole change.
+
+    Args:
+        result: Change result, with threads as Thread records or dicts.
+        out: Output stream.
+        default: Serializer of Thread records, e.g. Projection.default().
+    """
+    dumps = functools.partial(json.dumps, ensure_ascii=False, separators=(",", ":"))
+    if "error" in result:
+        out.write(dumps({"type": "error", **result}))
+        out.write("\n")
+        return
+
+    header = {"type": "change"}
+    header.update((k, v) for k, v in result.items() if k != "threads")
+    out.write(dumps(header))
+    out.write("\n")
+    change = result["change"]
+    for thread in result["threads"]:
+        record = {"type": "thread", "change": change}
+        record.update(default(thread) if isinstance(thread, Thread) else thread)
+        out.write(dumps(record))
+        out.write("\n")
+
+
+def watch_changes(changes: list[str], emit: Callable[[dict], None],
+                  revision: str | None = None, unresolved_only: bool = True,
+                  jobs: int = DEFAULT_JOBS,
+                  interval: float = DEFAULT_WATCH_INTERVAL,
+                  max_interval: float = DEFAULT_WATCH_MAX_INTERVAL,
+                  watermarks: dict[str, str] | None = None,
+                  max_polls: int | None = None,
+                  on_poll: Callable[[dict[str, str]], None] | None = None,
+                  sleep: Callable[[float], None] = time.sleep,
+                  clock: Callable[[], float] = time.monotonic,
+                  **fetch_kwargs) -> None:
+    """Poll changes and emit an event for every new or updated thread.
+
+    Each change has its own polling interval: it starts at ``interval``,
+    doubles up to ``max_interval`` while nothing changes and drops back to
+    ``interval`` as soon as new activity shows up. Every poll only asks for
+    threads newer than the change's watermark.
+
+    With ``unresolved_only``, a thread resolved by new activity is reported
+    once as a 'resolved' event, so it does not just silently drop out;
+    later activity on it is reported as 'updated'. Threads already
+    resolved before the first poll of a change without a watermark are not
+    reported.
+
+    Args:
+        changes: Change URLs, numbers, or Change-Ids.
+        emit: Called with each event dict ('thread' or 'error').
+        revision: Optional revision applied to every change.
+        unresolved_only: If True, only report unresolved threads.
+        jobs: Maximum number of changes fetched at the same time.
+        interval: Shortest polling interval in seconds.
+        max_interval: Longest polling interval in seconds.
+        watermarks: Optional {change: timestamp} to start from; updated in
+            place after every poll. Without one, the first poll reports all
+            current threads.
+        max_polls: Stop after this many polling rounds (default: forever).
+        on_poll: Called with the watermarks after every polling round.
+        sleep: Sleep function, replaceable for tests.
+        clock: Monotonic clock, replaceable for tests.
+        **fetch_kwargs: Extra arguments for fetch_comments() (e.g. cache).
+    """
+    if watermarks is None:
+        watermarks = {}
+    since = fetch_kwargs.pop("since", None)
+    if since:
+        for change in changes:
+            watermarks[change] = since
+
+    intervals = {change: interval for change in changes}
+    due = {change: clock() for change in changes}
+    # (last update, unresolved) of every reported thread, by root comment id
+    seen: dict[str, dict[str, tuple[str | None, bool]]] = {
+        change: {} for change in changes}
+    errors: dict[str, str] = {}
+    # Changes with a baseline: a watermark to start from, or a first poll
+    known = {change for change in changes if watermarks.get(change)}
+    polls = 0
+
+    while max_polls is None or polls < max_polls:
+        now = clock()
+        ready = [change for change in changes if due[change] <= now]
+        if not ready:
+            sleep(max(0.0, min(due.values()) - now))
             continue
 
-        # Use root comment for location metadata
-        root_comment = by_id.get(root_id) or (
-            t_items_sorted[0] if t_items_sorted else {}
-        )
-        file_path = root_comment.get("_file_path")
-        thread_range = root_comment.get("range")
-        thread_line = root_comment.get("line")
-
-        comments_out = []
-        for c in t_items_sorted:
-            author_info = c.get("author", {})
-            author_name = (
-                author_info.get("display_name")
-                or author_info.get("name")
-                or "Unknown"
-            )
-            comments_out.append(
-                {
-                    "id": c.get("id"),
-                    "in_reply_to": c.get("in_reply_to"),
-                    "patch_set": c.get("patch_set"),
-                    "author": author_name,
-                    "message": (c.get("message") or "").strip(),
-                    "updated": c.get("updated"),
-                    "unresolved": bool(c.get("unresolved")),
-                }
-            )
+        # Resolved threads are fetched too, to tell resolutions apart from
+        # threads without news
+        results = get_change_results(ready, revision, False, jobs,
+                                     watermarks=watermarks, **fetch_kwargs)
+        for change, (result, ok) in zip(ready, results):
+            active = False
+            if not ok:
+                message = result["error"]["message"]
+                if errors.get(change) != message:
+                    errors[change] = message
+                    emit({"type": "error", **result})
+            else:
+                errors.pop(change, None)
+                for thread in result["threads"]:
+                    key = thread.root.id
+                    previous = seen[change].get(key)
+                    if previous is not None and previous[0] == thread.last.updated:
+                        continue
+                    event = "updated" if previous is not None else "new"
+                    if unresolved_only and not thread.unresolved:
+                        if previous is None and change not in known:
+                            continue
+                        if previous is None or previous[1]:
+                            event = "resolved"
+                    seen[change][key] = (thread.last.updated, thread.unresolved)
+                    active = True
+                    emit({
+                        "type": "thread",
+                        "event": event,
+                        "change": result["change"],
+                        "latest_patchset": result["latest_patchset"],
+                        "thread": thread,
+                    })
+                if result["watermark"]:
+                    watermarks[change] = result["watermark"]
+                known.add(change)
 
-        threads.append(
-            {
-                "file": file_path,
-                "range": thread_range,
-                "line": thread_line,
-                "unresolved": thread_unresolved,
-                "updated": last.get("updated") if last else None,
-                "comments": comments_out,
-            }
-        )
+            if active:
+                intervals[change] = interval
+            else:
+                intervals[change] = min(intervals[change] * 2, max_interval)
+            due[change] = clock() + intervals[change]
 
-    # Sort threads by latest comment time (newest first)
-    threads.sort(key=lambda t: parse_gerrit_timestamp(t.get("updated")), reverse=True)
-    return {"threads": threads, "latest_patchset": latest_patchset}
+        polls += 1
+        if on_poll is not None:
+            on_poll(watermarks)
+
+
+def _read_changes_file(path: str) -> list[str]:
+    """Read change references, one per line, from a file or '-' for stdin.
+
+    Blank lines and lines starting with '#' are ignored.
+    """
+    if path == "-":
+        lines = sys.stdin.read().splitlines()
+    else:
+        with open(path, "r", encoding="utf-8") as f:
+            lines = f.read().splitlines()
+    return [
+        line.strip() for line in lines
+        if line.strip() and not line.strip().startswith("#")
+    ]
+
+
+def _parse_since(value: str) -> str:
+    """Validate a --since timestamp, accepting Gerrit and ISO formats."""
+    since = value.strip().replace("T", " ").rstrip("Z")
+    if parse_gerrit_timestamp(since) == datetime.min:
+        raise argparse.ArgumentTypeError(f"invalid timestamp: {value}")
+    return since
+
+
+def _load_watermarks(path: str) -> dict[str, str]:
+    """Load the {change: watermark} state file, empty if it does not exist."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return {}
+    if not isinstance(data, dict):
+        raise ValueError("state file must contain a JSON object")
+    return {str(k): str(v) for k, v in data.items() if v}
+
+
+def _save_watermarks(path: str, watermarks: dict[str, str]) -> None:
+    """Atomically write the {change: watermark} state file.
+
+    Each write goes through its own temporary file, so concurrent runs on
+    the same state file never write into each other's.
+    """
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)),
+                               prefix=f".{os.path.basename(path)}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(watermarks, f, ensure_ascii=False, indent=2, sort_keys=True)
+            f.write("\n")
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def _update_state(path: str, watermarks: dict[str, str],
+                  new_watermarks: dict[str, str]) -> None:
+    """Merge the watermarks of successful fetches into the --state file."""
+    watermarks.update((c, w) for c, w in new_watermarks.items() if w)
+    try:
+        _save_watermarks(path, watermarks)
+    except OSError as e:
+        print(f"warning: cannot write --state: {e}", file=sys.stderr)
 
 
 def main(argv: list[str] | None = None) -> int:
     parser = argparse.ArgumentParser(
-        description="Fetch Gerrit review comment threads as JSON"
+        # Fixed, as gerrit_daemon.py runs main() under its own argv[0]
+        prog="get_comments.py",
+        description="Fetch Gerrit review comment threads as JSON",
     )
     parser.add_argument(
         "--change",
-        required=True,
-        help="Change URL, number, or Change-Id",
+        action="append",
+        dest="changes",
+        default=[],
+        help="Change URL, number, or Change-Id (repeat for batch mode)",
+    )
+    parser.add_argument(
+        "--changes-file",
+        dest="changes_file",
+        help="File with one change per line, or '-' for stdin (batch mode)",
+    )
+    parser.add_argument(
+        "--query",
+        help="Gerrit search, e.g. 'is:open reviewer:self'; threads of every "
+             "matching change with comments are streamed as they are fetched",
+    )
+    parser.add_argument(
+        "--page-size",
+        dest="page_size",
+        type=int,
+        default=DEFAULT_PAGE_SIZE,
+        help=f"Changes requested per --query page (default: {DEFAULT_PAGE_SIZE})",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=DEFAULT_JOBS,
+        help=f"Changes fetched concurrently in batch mode (default: {DEFAULT_JOBS})",
     )
     parser.add_argument(
         "--revision",
@@ -218,41 +1453,462 @@ def main(argv: list[str] | None = None) -> int:
     )
     parser.add_argument("--all", action="store_true", dest="show_all",
                         help="Show all comments (default: only unresolved)")
+    parser.add_argument(
+        "--history",
+        action="store_true",
+        help="Annotate threads with the patch sets they were opened, replied "
+             "to and resolved in, and add per-patch set deltas",
+    )
+    parser.add_argument(
+        "--remap",
+        action="store_true",
+        help="Add each thread's position in the latest patch set, from one "
+             "cached diff per changed file and older patch set",
+    )
+    parser.add_argument(
+        "--context",
+        type=int,
+        metavar="N",
+        help="Attach N lines of source before and after each thread's lines, "
+             "fetched once per file and patch set and cached on disk",
+    )
+    parser.add_argument(
+        "--cache",
+        action="store_true",
+        help="Cache responses on disk and revalidate them with ETags",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        dest="cache_dir",
+        help="Cache directory (implies --cache; default: $GERRIT_CACHE_DIR "
+             "or ~/.cache/gerritcomment)",
+    )
+    parser.add_argument(
+        "--since",
+        type=_parse_since,
+        help="Only threads with a comment updated after this timestamp "
+             "(e.g. '2026-01-13 11:57:15')",
+    )
+    parser.add_argument(
+        "--state",
+        dest="state_file",
+        help="JSON file with per-change watermarks; read as --since and "
+             "updated after each successful fetch",
+    )
+    parser.add_argument(
+        "--format",
+        choices=["json", "ndjson"],
+        default="json",
+        help="Output format: one JSON document (default), or a header record "
+             "per change followed by one compact line per thread",
+    )
+    parser.add_argument(
+        "--fields",
+        help="Comma-separated thread fields to output, comment fields as "
+             "comments.<field>, e.g. 'file,line,comments.author,comments.message' "
+             f"(thread: {', '.join(THREAD_FIELDS)}; comment: {', '.join(COMMENT_FIELDS)})",
+    )
+    parser.add_argument(
+        "--max-message-chars",
+        dest="max_message_chars",
+        type=int,
+        metavar="N",
+        help="Cut comment messages longer than N characters, marked with '…'",
+    )
+    parser.add_argument(
+        "--compact",
+        action="store_true",
+        help="Write JSON on a single line without indentation",
+    )
+    parser.add_argument(
+        "--size-report",
+        dest="size_report",
+        action="store_true",
+        help="Print the output size in bytes and estimated tokens to stderr",
+    )
+    parser.add_argument(
+        "--index",
+        nargs="?",
+        const="",
+        metavar="DB",
+        help="Sync all threads (resolved or not) with activity since the last "
+             "sync into the SQLite comment index searched by search_comments.py, "
+             "and print a summary instead of the threads (default DB: "
+             f"${INDEX_ENV} or comments.sqlite in the cache directory)",
+    )
+    parser.add_argument(
+        "--trace",
+        nargs="?",
+        const="-",
+        default=os.environ.get(gerrit_trace.TRACE_ENV) or None,
+        metavar="FILE",
+        help="Write timing spans for HTTP calls and processing stages as JSON "
+             f"lines to FILE, or to stderr without one (default: ${gerrit_trace.TRACE_ENV})",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="Keep polling and print one NDJSON event per new or updated thread",
+    )
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=DEFAULT_WATCH_INTERVAL,
+        help=f"Shortest --watch polling interval in seconds "
+             f"(default: {DEFAULT_WATCH_INTERVAL:g})",
+    )
+    parser.add_argument(
+        "--max-interval",
+        dest="max_interval",
+        type=float,
+        default=DEFAULT_WATCH_MAX_INTERVAL,
+        help=f"Longest --watch polling interval while idle "
+             f"(default: {DEFAULT_WATCH_MAX_INTERVAL:g})",
+    )
+    parser.add_argument(
+        "--max-polls",
+        dest="max_polls",
+        type=int,
+        help="Stop --watch after this many polling rounds",
+    )
     args = parser.parse_args(argv)
+    try:
+        tracer = gerrit_trace.open_tracer(args.trace)
+    except OSError as e:
+        parser.error(f"cannot write --trace: {e}")
+    out = _CountingWriter(sys.stdout) if args.size_report else sys.stdout
+    with gerrit_trace.tracing(tracer, "get_comments"):
+        try:
+            return _run(parser, args, out)
+        finally:
+            if isinstance(out, _CountingWriter):
+                print(json.dumps({"type": "size_report", **out.report()}),
+                      file=sys.stderr)
+
+
+class _CountingWriter:
+    """Text stream wrapper counting the output, for --size-report."""
+
+    def __init__(self, out: TextIO):
+        self.out = out
+        self.chars = self.bytes = self.lines = 0
+
+    def write(self, text: str) -> int:
+        self.chars += len(text)
+        self.bytes += len(text.encode("utf-8"))
+        self.lines += text.count("\n")
+        return self.out.write(text)
+
+    def flush(self) -> None:
+        self.out.flush()
+
+    def report(self) -> dict:
+        return {
+            "bytes": self.bytes,
+            "chars": self.chars,
+            "lines": self.lines,
+            "tokens_estimate": -(-self.bytes // BYTES_PER_TOKEN),
+        }
+
+
+def _run(parser: argparse.ArgumentParser, args: argparse.Namespace,
+         out: TextIO) -> int:
+    changes = [c.strip() for c in args.changes if c.strip()]
+    if args.changes_file:
+        try:
+            changes.extend(_read_changes_file(args.changes_file))
+        except OSError as e:
+            parser.error(f"cannot read --changes-file: {e}")
+    if args.query is not None:
+        if changes or args.changes_file:
+            parser.error("--query cannot be combined with --change or --changes-file")
+        if not args.query.strip():
+            parser.error("--query must not be empty")
+        if args.watch:
+            parser.error("--watch needs a fixed set of changes and cannot be "
+                         "combined with --query")
+    elif not changes:
+        parser.error("at least one --change, --changes-file or --query is required")
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    if args.context is not None and args.context < 0:
+        parser.error("--context must not be negative")
+    if args.page_size < 1:
+        parser.error("--page-size must be at least 1")
+    if args.max_message_chars is not None and args.max_message_chars < 1:
+        parser.error("--max-message-chars must be at least 1")
+    projection = None
+    if args.fields is not None or args.max_message_chars is not None:
+        try:
+            projection = Projection(args.fields, args.max_message_chars)
+        except ValueError as e:
+            parser.error(f"--fields: {e}")
+    if args.interval <= 0 or args.max_interval < args.interval:
+        parser.error("--interval must be positive and at most --max-interval")
+    if args.index is not None:
+        conflicting = [option for option, value in (
+            ("--revision", args.revision), ("--since", args.since),
+            ("--state", args.state_file), ("--history", args.history),
+            ("--context", args.context is not None), ("--remap", args.remap),
+            ("--watch", args.watch), ("--fields", args.fields is not None),
+            ("--max-message-chars", args.max_message_chars is not None),
+        ) if value]
+        if conflicting:
+            parser.error(f"--index syncs from its own watermarks and cannot be "
+                         f"combined with {', '.join(conflicting)}")
+    if args.history and args.revision:
+        parser.error("--history covers all patch sets and cannot be combined "
+                     "with --revision")
 
-    change = args.change.strip()
     revision = args.revision.strip() if args.revision else None
     unresolved_only = not args.show_all
+    batch = len(changes) > 1 or args.changes_file is not None
+
+    cache = None
+    if args.cache or args.cache_dir:
+        try:
+            cache = ResponseCache(args.cache_dir)
+        except GerritError as e:
+            parser.error(str(e))
+
+    watermarks = None
+    if args.state_file:
+        try:
+            watermarks = _load_watermarks(args.state_file)
+        except (OSError, ValueError) as e:
+            parser.error(f"cannot read --state: {e}")
+
+    if args.index is not None:
+        try:
+            index = CommentIndex(args.index or None)
+        except GerritError as e:
+            parser.error(str(e))
+        with index:
+            return _run_index(args, changes, index, cache, out)
+
+    fetch_kwargs = {"cache": cache, "since": args.since, "history": args.history}
+    if args.context is not None:
+        fetch_kwargs["context"] = args.context
+    if args.remap:
+        fetch_kwargs["remap"] = True
+    if (args.context is not None or args.remap) and cache is None:
+        # File contents and diffs never change, so they are cached even
+        # without --cache
+        try:
+            fetch_kwargs["file_cache"] = ResponseCache(args.cache_dir)
+        except GerritError as e:
+            print(f"warning: {e}; fetching files without cache", file=sys.stderr)
+
+    default = projection.default if projection is not None else json_default
+    # Keyword arguments of json.dump() for the document formats
+    dump_kwargs = {"ensure_ascii": False, "default": default}
+    dump_kwargs.update({"separators": (",", ":")} if args.compact else {"indent": 2})
+
+    if args.query is not None:
+        return _run_query(args, revision, unresolved_only, watermarks,
+                          fetch_kwargs, out, dump_kwargs)
+
+    if args.watch:
+        separators = (",", ":") if args.compact else None
+
+        def emit(event: dict) -> None:
+            out.write(json.dumps(event, ensure_ascii=False, separators=separators,
+                                 default=default) + "\n")
+            out.flush()
+
+        def save_state(marks: dict[str, str]) -> None:
+            try:
+                _save_watermarks(args.state_file, marks)
+            except OSError as e:
+                print(f"warning: cannot write --state: {e}", file=sys.stderr)
+
+        try:
+            watch_changes(
+                changes, emit, revision, unresolved_only, args.jobs,
+                interval=args.interval,
+                max_interval=args.max_interval,
+                watermarks=watermarks,
+                max_polls=args.max_polls,
+                on_poll=save_state if args.state_file else None,
+                **fetch_kwargs,
+            )
+        except KeyboardInterrupt:
+            pass
+        return 0
+
+    new_watermarks: dict[str, str] = {}
+    fetch_args = (changes, revision, unresolved_only, args.jobs, watermarks)
+
+    if args.format == "ndjson":
+        # Stream each change as soon as it is fetched, in completion order
+        failed = 0
+        for index, result, ok in iter_change_results(*fetch_args, **fetch_kwargs):
+            if ok:
+                new_watermarks[changes[index]] = result["watermark"]
+            else:
+                failed += 1
+            write_ndjson(result, out, default)
+            out.flush()
+    else:
+        results = get_change_results(*fetch_args, **fetch_kwargs)
+        for change, (result, ok) in zip(changes, results):
+            if ok:
+                new_watermarks[change] = result["watermark"]
+
+    if watermarks is not None:
+        _update_state(args.state_file, watermarks, new_watermarks)
+
+    if args.format == "ndjson":
+        return 1 if failed else 0
 
+    if batch:
+        failed = sum(1 for _, ok in results if not ok)
+        output = {
+            "count": len(results),
+            "failed": failed,
+            "results": [r for r, _ in results],
+        }
+    else:
+        output, ok = results[0]
+        failed = 0 if ok else 1
+
+    with gerrit_trace.span("output"):
+        json.dump(output, out, **dump_kwargs)
+        out.write("\n")
+    return 1 if failed else 0
+
+
+def _run_query(args: argparse.Namespace, revision: str | None,
+               unresolved_only: bool, watermarks: dict[str, str] | None,
+               fetch_kwargs: dict, out: TextIO, dump_kwargs: dict) -> int:
+    """Stream the results of --query while the search is still being paged.
+
+    The JSON document is written piecewise so that it never has to be held
+    in memory, yet reads as json.dump() with ``dump_kwargs`` would write it;
+    it ends with the counts, and the error if the search failed part way.
+    """
+    skipped = 0
+
+    def skip(info: dict) -> None:
+        nonlocal skipped
+        skipped += 1
+
+    ndjson = args.format == "ndjson"
+    compact = "indent" not in dump_kwargs
+    # Line breaks and indentation at the document and results levels
+    top, item = ("", "") if compact else ("\n  ", "\n    ")
+    colon = ":" if compact else ": "
+    if not ndjson:
+        out.write("{" + top + '"query"' + colon
+                  + json.dumps(args.query, ensure_ascii=False)
+                  + "," + top + '"results"' + colon + "[")
+
+    count = failed = 0
+    error = None
+    new_watermarks: dict[str, str] = {}
+    results = iter_query_results(
+        args.query, revision, unresolved_only, args.jobs, watermarks,
+        page_size=args.page_size, on_skip=skip, **fetch_kwargs,
+    )
     try:
-        # Determine base_url and change_ref
-        if change.startswith(("http://", "https://")):
-            base_url, change_ref = parse_change_url(change)
+        for result, ok in results:
+            if ok:
+                new_watermarks[result["change"]] = result["watermark"]
+            else:
+                failed += 1
+            if ndjson:
+                write_ndjson(result, out, dump_kwargs["default"])
+            else:
+                text = json.dumps(result, **dump_kwargs)
+                out.write(("," if count else "") + item + text.replace("\n", item))
+            count += 1
+            out.flush()
+    except GerritError as e:
+        error = {"type": type(e).__name__, "message": str(e)}
+
+    if watermarks is not None:
+        _update_state(args.state_file, watermarks, new_watermarks)
+
+    summary = {"count": count, "failed": failed, "skipped": skipped}
+    if error is not None:
+        summary["error"] = error
+    if ndjson:
+        out.write(json.dumps({"type": "query", "query": args.query, **summary},
+                             ensure_ascii=False) + "\n")
+    else:
+        out.write(top + "]" if count else "]")
+        for key, value in summary.items():
+            text = json.dumps(value, **dump_kwargs)
+            out.write(f',{top}"{key}"{colon}' + text.replace("\n", top))
+        out.write(("\n" if top else "") + "}\n")
+    return 1 if failed or error is not None else 0
+
+
+def _run_index(args: argparse.Namespace, changes: list[str],
+               index: CommentIndex, cache: ResponseCache | None,
+               out: TextIO) -> int:
+    """Sync the changes of --change, --changes-file or --query into --index.
+
+    Every change is fetched with all threads since its indexed watermark,
+    so the index also learns about threads that were resolved meanwhile.
+    """
+    skipped = 0
+
+    def skip(info: dict) -> None:
+        nonlocal skipped
+        skipped += 1
+
+    error = None
+    records = []
+    try:
+        if args.query is not None:
+            server = get_config()[0]
+            query_results = iter_query_results(
+                args.query, None, False, args.jobs, index.watermarks(server),
+                page_size=args.page_size, on_skip=skip, cache=cache,
+            )
+            results = ((server, result, ok) for result, ok in query_results)
         else:
-            base_url, _, _ = get_config()
-            change_ref = change
-
-        data = fetch_comments(base_url, change_ref, revision, unresolved_only)
-        result = {
-            "change": change_ref,
-            "latest_patchset": data["latest_patchset"],
-            "unresolved_only": unresolved_only,
-            "thread_count": len(data["threads"]),
-            "threads": data["threads"],
-        }
+            # Watermarks are looked up per server by change number; a change
+            # given by its Change-Id has none and is fetched in full
+            servers, watermarks = [], {}
+            for change in changes:
+                try:
+                    server, change_ref = resolve_change(change)
+                except GerritError:
+                    # The fetch reports the error
+                    server = change_ref = None
+                servers.append(server)
+                if server is not None:
+                    number = change_ref.rsplit("~", 1)[-1]
+                    mark = index.watermarks(server).get(number)
+                    if mark:
+                        watermarks[change] = mark
+            results = ((servers[i], result, ok) for i, result, ok in
+                       iter_change_results(changes, None, False, args.jobs,
+                                           watermarks, cache=cache))
+        with gerrit_trace.span("index") as fields:
+            records.extend(sync_results(index, results))
+            fields["changes"] = len(records)
     except GerritError as e:
-        result = {
-            "change": change,
-            "revision": revision,
-            "error": {"type": type(e).__name__, "message": str(e)},
-        }
-        json.dump(result, sys.stdout, ensure_ascii=False, indent=2)
-        print()
-        return 1
+        error = {"type": type(e).__name__, "message": str(e)}
 
-    json.dump(result, sys.stdout, ensure_ascii=False, indent=2)
-    print()
-    return 0
+    failed = sum(1 for r in records if "error" in r)
+    output = {
+        "index": index.path,
+        "count": len(records),
+        "failed": failed,
+        "threads": sum(r.get("threads", 0) for r in records),
+    }
+    if args.query is not None:
+        output["skipped"] = skipped
+    if error is not None:
+        output["error"] = error
+    output["results"] = records
+    json.dump(output, out, ensure_ascii=False,
+              **({"separators": (",", ":")} if args.compact else {"indent": 2}))
+    out.write("\n")
+    return 1 if failed or error is not None else 0
 
 
 if __name__ == "__main__":
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""Incremental parsing of Gerrit JSON responses.
+
+Gerrit answers many list endpoints (e.g. comments) with an object mapping
+keys to arrays. This module walks such a response chunk by chunk and yields
+one array element at a time, so memory is bounded by the largest element
+instead of the whole response.
+"""
+from __future__ import annotations
+
+import json
+from typing import Any, Iterable, Iterator
+
+MAGIC_JSON_PREFIX = ")]}'"
+
+# Drop consumed text from the buffer once this many characters are behind us
+_COMPACT_AT = 1 << 16
+
+_decoder = json.JSONDecoder()
+
+
+class _Reader:
+    """Text buffer over an iterator of chunks."""
+
+    def __init__(self, chunks: Iterable[str]):
+        self._chunks = iter(chunks)
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self) -> bool:
+        """Append the next non-empty chunk, return False at end of input."""
+        if self.eof:
+            return False
+        if self.pos >= _COMPACT_AT:
+            self.buf = self.buf[self.pos:]
+            self.pos = 0
+        for chunk in self._chunks:
+            if chunk:
+                self.buf += chunk
+                return True
+        self.eof = True
+        return False
+
+    def peek(self) -> str:
+        """Return the next non-whitespace character without consuming it."""
+        while True:
+            buf, pos = self.buf, self.pos
+            while pos < len(buf) and buf[pos] in " \t\r\n":
+                pos += 1
+            self.pos = pos
+            if pos < len(buf):
+                return buf[pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, chars: str) -> str:
+        """Consume the next non-whitespace character, one of ``chars``."""
+        ch = self.peek()
+        if not ch or ch not in chars:
+            found = repr(ch) if ch else "end of input"
+            raise ValueError(f"Invalid JSON: expected one of {chars!r}, got {found}")
+        self.pos += 1
+        return ch
+
+    def value(self) -> Any:
+        """Decode the next complete JSON value."""
+        self.peek()
+        while True:
+            try:
+                obj, end = _decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                # Most likely a value split across chunks: read more
+                if not self._fill():
+                    raise
+                continue
+            # A number at the end of the buffer may continue in the next chunk
+            if end == len(self.buf) and not self.eof and self._fill():
+                continue
+            self.pos = end
+            return obj
+
+    def skip_prefix(self) -> None:
+        """Skip Gerrit's XSSI protection prefix if present."""
+        while len(self.buf) - self.pos < len(MAGIC_JSON_PREFIX) and self._fill():
+            pass
+        if self.buf.startswith(MAGIC_JSON_PREFIX, self.pos):
+            self.pos += len(MAGIC_JSON_PREFIX)
+
+
+def iter_keyed_items(chunks: Iterable[str]) -> Iterator[tuple[str, Any]]:
+    """Yield (key, element) pairs from a JSON object of arrays, incrementally.
+
+    ``{"a.c": [x, y], "b.c": [z]}`` yields ("a.c", x), ("a.c", y), ("b.c", z).
+    A leading ``)]}'`` prefix is skipped.
+
+    Args:
+        chunks: The response text, split at arbitrary points.
+
+    Yields:
+        Tuples of (object key, decoded array element).
+
+    Raises:
+        ValueError: When the input is not an object of arrays.
+    """
+    reader = _Reader(chunks)
+    reader.skip_prefix()
+    reader.expect("{")
+    if reader.peek() == "}":
+        reader.pos += 1
+    else:
+        while True:
+            key = reader.value()
+            if not isinstance(key, str):
+                raise ValueError("Invalid JSON: object key must be a string")
+            reader.expect(":")
+            reader.expect("[")
+            if reader.peek() == "]":
+                reader.pos += 1
+            else:
+                while True:
+                    yield key, reader.value()
+                    if reader.expect(",]") == "]":
+                        break
+            if reader.expect(",}") == "}":
+                break
+    if reader.peek():
+        raise ValueError("Invalid JSON: trailing data after object")
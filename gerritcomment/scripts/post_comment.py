@@ -5,14 +5,61 @@ Self-contained, no external dependencies except python-gerrit-api.
 """
 from __future__ import annotations
 
+import sys
+
+if __name__ == "__main__":
+    # Hand the call to a running gerrit_daemon.py before the heavy imports
+    from gerrit_daemon import forward_to_daemon
+    forward_to_daemon("post_comment")
+
 import argparse
 import json
-import sys
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING, Iterable, Iterator, TextIO
+from urllib.parse import quote
+
+import gerrit_trace
+from gerrit_cache import ResponseCache
+from gerrit_files import (
+    MAGIC_PATHS,
+    PATCHSET_LEVEL,
+    count_lines,
+    get_file_content,
+    get_revision_files,
+    resolve_revision,
+)
+from gerrit_utils import (
+    DEFAULT_RETRIES,
+    RETRY_STATUSES,
+    GerritError,
+    RetryPolicy,
+    TokenBucket,
+    TransientError,
+    ValidationError,
+    get_batch_pool_size,
+    get_client,
+    get_pool_size,
+    get_write_limiter,
+    resolve_change,
+    run_parallel,
+)
 
-from gerrit import GerritClient
-from requests import HTTPError
+if TYPE_CHECKING:
+    from gerrit import GerritClient
 
-from gerrit_utils import GerritError, parse_change_url, get_config
+DEFAULT_JOBS = 8
+
+# Reviews over these limits are split and posted in chunks
+DEFAULT_CHUNK_BYTES = 512 * 1024
+DEFAULT_CHUNK_COMMENTS = 200
+DEFAULT_CHUNK_JOBS = 4
+
+# Tagged comments and messages up to this many seconds older than the first
+# attempt still count as the retried review, to allow for clock skew
+DEDUP_CLOCK_SKEW = 120.0
 
 
 def build_review_input(
@@ -49,6 +96,69 @@ def build_review_input(
     return result
 
 
+def _count_comments(review_input: dict) -> int:
+    """Return the number of inline comments in a ReviewInput."""
+    return sum(len(items) for items in (review_input.get("comments") or {}).values())
+
+
+def _json_size(value) -> int:
+    """Return the size of value as sent in a request body, in bytes."""
+    return len(json.dumps(value))
+
+
+def split_review_input(
+    review_input: dict,
+    max_bytes: int = DEFAULT_CHUNK_BYTES,
+    max_comments: int = DEFAULT_CHUNK_COMMENTS,
+) -> list[dict]:
+    """Split a large ReviewInput into size-bounded chunks.
+
+    The first chunk carries everything but the inline comments (message,
+    labels, tag, ...) plus the first comments. Later chunks carry only
+    comments, the tag and ``notify: NONE``, so reviewers get one
+    notification for the whole review. Comment order is preserved and a
+    comment larger than ``max_bytes`` gets a chunk of its own.
+
+    Args:
+        review_input: ReviewInput entity dictionary.
+        max_bytes: Maximum JSON size of a chunk.
+        max_comments: Maximum number of inline comments in a chunk.
+
+    Returns:
+        List of ReviewInput dictionaries; just ``[review_input]`` if it
+        is within both limits.
+    """
+    comments = review_input.get("comments") or {}
+    if _count_comments(review_input) <= max_comments and _json_size(review_input) <= max_bytes:
+        return [review_input]
+
+    head = {k: v for k, v in review_input.items() if k != "comments"}
+    tail: dict = {"notify": "NONE"}
+    if "tag" in review_input:
+        tail["tag"] = review_input["tag"]
+
+    groups: list[dict[str, list[dict]]] = []
+    current: dict[str, list[dict]] = {}
+    count = 0
+    size = _json_size(head)
+    for path, items in comments.items():
+        # The path is counted per comment, which only overestimates
+        path_size = _json_size(path) + 4
+        for comment in items:
+            item_size = _json_size(comment) + path_size
+            if count and (count >= max_comments or size + item_size > max_bytes):
+                groups.append(current)
+                current, count, size = {}, 0, _json_size(tail)
+            current.setdefault(path, []).append(comment)
+            count += 1
+            size += item_size
+    groups.append(current)
+
+    chunks = [{**head, "comments": groups[0]}] if groups[0] else [head]
+    chunks.extend({**tail, "comments": group} for group in groups[1:])
+    return chunks
+
+
 def build_comment_input(
     message: str,
     line: int | None = None,
@@ -93,59 +203,437 @@ def build_comment_input(
     return result
 
 
+def _check_comment(comment: dict, lines: int | None) -> list[str]:
+    """Return the problems of one CommentInput on a file of ``lines`` lines.
+
+    ``lines`` is None when line numbers cannot be checked.
+    """
+    problems = []
+    line = comment.get("line")
+    if line is not None and (not isinstance(line, int) or isinstance(line, bool) or line < 1):
+        problems.append(f"invalid line: {line!r}")
+        line = None
+    elif line is not None and lines is not None and line > lines:
+        problems.append(f"line {line} is past the end of the file ({lines} lines)")
+
+    range_ = comment.get("range")
+    if range_ is not None:
+        keys = ("start_line", "start_character", "end_line", "end_character")
+        values = [range_.get(k) if isinstance(range_, dict) else None for k in keys]
+        if not all(isinstance(v, int) and not isinstance(v, bool) and v >= 0 for v in values):
+            problems.append(f"invalid range: {range_!r}")
+        else:
+            start_line, start_char, end_line, end_char = values
+            if start_line < 1 or (start_line, start_char) > (end_line, end_char):
+                problems.append(f"invalid range: {range_!r}")
+            elif lines is not None and end_line > lines:
+                problems.append(f"range ends past the end of the file ({lines} lines)")
+            if line is not None and line != end_line:
+                problems.append(f"line {line} differs from the range end line {end_line}")
+    return problems
+
+
+def find_comment_problems(comments: dict[str, list[dict]], files: dict[str, dict],
+                          line_counts: dict[str, int]) -> list[dict]:
+    """Check inline comments against the files of a revision.
+
+    Args:
+        comments: Inline comments as {file_path: [CommentInput, ...]}.
+        files: Files of the revision, as returned by get_revision_files().
+        line_counts: Line counts of the commented files, by path. Files
+            without an entry only get their paths and ranges checked.
+
+    Returns:
+        One {'path', 'index', 'line', 'problem'} record per problem, in
+        input order; empty if every comment is valid.
+    """
+    problems = []
+    for path, items in comments.items():
+        if path not in files and path not in MAGIC_PATHS:
+            problem = "file is not modified in this revision"
+            problems.extend({"path": path, "index": i, "line": c.get("line"),
+                             "problem": problem} for i, c in enumerate(items))
+            continue
+        for index, comment in enumerate(items):
+            if path == PATCHSET_LEVEL:
+                found = []
+                if "line" in comment or "range" in comment:
+                    found.append("patch set level comments cannot have a line or range")
+            elif comment.get("side") == "PARENT":
+                # Line numbers refer to the parent commit, only ranges are checked
+                found = _check_comment(comment, None)
+            else:
+                found = _check_comment(comment, line_counts.get(path))
+            problems.extend({"path": path, "index": index, "line": comment.get("line"),
+                             "problem": problem} for problem in found)
+    return problems
+
+
+def validate_review(client: GerritClient, change_ref: str, revision: str | None,
+                    review_input: dict, cache: ResponseCache | None = None) -> str:
+    """Check the inline comments of a review before it is posted.
+
+    Resolves the revision, then fetches its file list and the content of
+    the files that get line comments, in parallel; all of them are cached
+    by revision SHA, so repeated checks against a revision are free.
+
+    Args:
+        client: Gerrit client.
+        change_ref: Change number or Change-Id.
+        revision: Target revision (SHA, patch set number, or 'current').
+        review_input: ReviewInput entity dictionary.
+        cache: Optional response cache.
+
+    Returns:
+        The revision SHA the review was checked against; post to it, so a
+        patch set uploaded meanwhile cannot invalidate the check.
+
+    Raises:
+        ValidationError: With every problem found.
+        GerritError: When the revision cannot be read.
+    """
+    sha, _ = resolve_revision(client, change_ref, revision, cache)
+    comments = review_input.get("comments") or {}
+    if not comments:
+        return sha
+    if not isinstance(comments, dict) or not all(
+        isinstance(items, list) and all(isinstance(c, dict) for c in items)
+        for items in comments.values()
+    ):
+        raise ValidationError("Invalid review", [{"problem": "'comments' must map paths "
+                                                             "to lists of CommentInput"}])
+
+    files = get_revision_files(client, change_ref, sha, cache)
+    # Only files with line-based REVISION comments need their content
+    paths = [
+        path for path, items in comments.items()
+        if path in files and path != PATCHSET_LEVEL
+        and any(("line" in c or "range" in c) and c.get("side") != "PARENT" for c in items)
+    ]
+
+    # Deleted files have no lines; the others are counted in parallel
+    counts = {path: 0 for path in paths if files[path].get("status") == "D"}
+    fetch = [path for path in paths if path not in counts]
+    counts.update(zip(fetch, run_parallel([
+        lambda path=path: count_lines(get_file_content(client, change_ref, sha, path, cache))
+        for path in fetch
+    ], get_pool_size(client))))
+
+    problems = find_comment_problems(comments, files, counts)
+    if problems:
+        raise ValidationError(f"{len(problems)} invalid comment(s)", problems)
+    return sha
+
+
+def _gerrit_time(seconds: float) -> str:
+    """Format a Unix time like Gerrit timestamps, for string comparison."""
+    return datetime.fromtimestamp(seconds, tz=timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _retry_after(response) -> float | None:
+    """Return the Retry-After delay in seconds, if given as a number."""
+    try:
+        return max(0.0, float(response.headers.get("Retry-After", "")))
+    except ValueError:
+        return None
+
+
+def _send_review(client: GerritClient, endpoint: str, review_input: dict) -> dict:
+    """POST a ReviewInput once, classifying failures.
+
+    Raises:
+        TransientError: When the request may succeed if retried.
+        GerritError: When the request failed for good.
+    """
+    from gerrit.utils.common import decode_response
+    from requests import ConnectionError as RequestsConnectionError
+    from requests import ConnectTimeout, Timeout
+
+    try:
+        response = client.requester.post(
+            client.get_endpoint_url(endpoint),
+            json=review_input,
+            headers=client.default_headers,
+            raise_for_status=False,
+        )
+    except ConnectTimeout as e:
+        raise TransientError(f"Connection timed out: {e}")
+    except (Timeout, RequestsConnectionError) as e:
+        # The request may have reached the server before the failure
+        raise TransientError(f"Request failed: {e}", ambiguous=True)
+
+    status = response.status_code
+    if status < 400:
+        result = decode_response(response)
+        return result if result else {}
+    if status in RETRY_STATUSES:
+        raise TransientError(
+            f"Server unavailable ({status})",
+            status=status,
+            # Gateway errors may hide a review the server did apply
+            ambiguous=status in (502, 504),
+            retry_after=_retry_after(response),
+        )
+    if status == 401:
+        raise GerritError("Authentication failed (401)")
+    if status == 404:
+        raise GerritError("Change not found (404)")
+    if status == 409:
+        raise GerritError("Cannot post review to change edit (409)")
+    if status == 403:
+        raise GerritError("Permission denied (403)")
+    detail = response.text.strip()
+    raise GerritError(f"HTTP error ({status}): {detail}" if detail else f"HTTP error ({status})")
+
+
+def _vote_texts(labels: dict) -> list[str]:
+    """Return the votes as Gerrit writes them into the change message."""
+    texts = []
+    for label, value in labels.items():
+        try:
+            value = int(value)
+        except (TypeError, ValueError):
+            continue
+        # 'Verified+1', 'Code-Review-2'; a removed vote is '-Verified'
+        texts.append(f"{label}{value:+d}" if value else f"-{label}")
+    return texts
+
+
+def find_posted_review(client: GerritClient, change_ref: str,
+                       review_input: dict, since: float) -> dict | None:
+    """Check whether a tagged review was already published.
+
+    Used after an ambiguous failure, to avoid posting a review twice. A
+    review with inline comments matches when each of its comments is
+    published with the review's tag at the same path, line and message.
+    Other reviews match a change message with the tag that contains the
+    review message and every vote (e.g. 'Code-Review+1'). A review with
+    neither message nor votes never matches. Only items dated after
+    ``since`` count.
+
+    Args:
+        client: Gerrit client.
+        change_ref: Change number or Change-Id.
+        review_input: ReviewInput entity that may have been posted.
+        since: Unix time of the first attempt.
+
+    Returns:
+        A response stand-in if the review was found, None otherwise
+        (including for untagged reviews, which cannot be matched).
+
+    Raises:
+        GerritError: When the check itself fails.
+    """
+    tag = review_input.get("tag")
+    if not tag:
+        return None
+    after = _gerrit_time(since - DEDUP_CLOCK_SKEW)
+    endpoint = f"/changes/{quote(change_ref, safe='~')}"
+
+    try:
+        comments = review_input.get("comments")
+        if comments:
+            published = client.get(f"{endpoint}/comments")
+            seen = {
+                (path, c.get("line"), (c.get("message") or "").strip())
+                for path, items in published.items()
+                for c in items
+                if c.get("tag") == tag and (c.get("updated") or "") >= after
+            }
+            for path, items in comments.items():
+                for c in items:
+                    # Range comments are published on their last line
+                    line = c.get("line") or (c.get("range") or {}).get("end_line")
+                    if (path, line, (c.get("message") or "").strip()) not in seen:
+                        return None
+            return {"deduplicated": True}
+
+        # An empty needle would match any message with the tag
+        needles = [text for text in (
+            [(review_input.get("message") or "").strip()]
+            + _vote_texts(review_input.get("labels") or {})
+        ) if text]
+        if not needles:
+            return None
+        for m in client.get(f"{endpoint}/messages"):
+            text = m.get("message") or ""
+            if (m.get("tag") == tag and (m.get("date") or "") >= after
+                    and all(needle in text for needle in needles)):
+                return {"deduplicated": True}
+        return None
+    except Exception as e:
+        raise GerritError(f"Review may have been posted, cannot verify: {e}")
+
+
 def post_review(
     base_url: str,
     change_ref: str,
     revision: str | None,
     review_input: dict,
+    client: GerritClient | None = None,
+    retry: RetryPolicy | None = None,
+    limiter: TokenBucket | None = None,
 ) -> dict:
     """Post a review to Gerrit.
 
+    Throttling and transient server errors (429, 502, 503, 504) and network
+    errors are retried with jittered exponential backoff. When a failure
+    leaves it unclear whether the review was applied, a tagged review is
+    looked up with find_posted_review() before it is retried; an untagged
+    one is not retried.
+
     Args:
         base_url: Gerrit server base URL.
         change_ref: Change number or Change-Id.
         revision: Target revision (SHA, patch set number, or 'current'). Defaults to 'current'.
         review_input: ReviewInput entity dictionary.
+        client: Optional client to use instead of the shared one for base_url.
+        retry: Retry policy; defaults to RetryPolicy().
+        limiter: Optional rate limiter, acquired before every attempt.
 
     Returns:
-        API response result.
+        API response result; {"deduplicated": true} if a retried review
+        turned out to be posted already.
 
     Raises:
         GerritError: When API call fails.
     """
-    _, username, password = get_config()
-    client = GerritClient(
-        base_url=base_url,
-        username=username,
-        password=password,
-    )
+    if client is None:
+        client = get_client(base_url)
+    if retry is None:
+        retry = RetryPolicy()
 
     target_revision = revision or "current"
+    endpoint = (f"/changes/{quote(change_ref, safe='~')}"
+                f"/revisions/{quote(target_revision, safe='')}/review")
+    started = time.time()
+
+    on_ambiguous = None
+    if review_input.get("tag"):
+        def on_ambiguous():
+            return find_posted_review(client, change_ref, review_input, started)
 
     try:
-        change = client.changes.get(change_ref)
-        rev = change.get_revision(target_revision)
-        result = rev.set_review(review_input)
-        return result if result else {}
-    except HTTPError as e:
-        status = e.response.status_code if e.response is not None else 0
-        if status == 401:
-            raise GerritError("Authentication failed (401)")
-        if status == 404:
-            raise GerritError("Change not found (404)")
-        if status == 409:
-            raise GerritError("Cannot post review to change edit (409)")
-        if status == 403:
-            raise GerritError("Permission denied (403)")
-        raise GerritError(f"HTTP error: {e}")
+        with gerrit_trace.span("post_review", change=change_ref,
+                               comments=_count_comments(review_input)):
+            return retry.call(
+                lambda: _send_review(client, endpoint, review_input),
+                limiter=limiter,
+                on_ambiguous=on_ambiguous,
+            )
+    except GerritError:
+        raise
     except Exception as e:
         raise GerritError(str(e))
 
 
+class PartialReviewError(GerritError):
+    """Some chunks of a chunked review could not be posted.
+
+    Attributes:
+        chunks: Per-chunk status records, see post_review_chunked().
+    """
+
+    def __init__(self, message: str, chunks: list[dict]):
+        super().__init__(message)
+        self.chunks = chunks
+
+
+def post_review_chunked(
+    base_url: str,
+    change_ref: str,
+    revision: str | None,
+    review_input: dict,
+    client: GerritClient | None = None,
+    max_bytes: int = DEFAULT_CHUNK_BYTES,
+    max_comments: int = DEFAULT_CHUNK_COMMENTS,
+    jobs: int = DEFAULT_CHUNK_JOBS,
+    preflight: bool = False,
+    cache: ResponseCache | None = None,
+    **post_kwargs,
+) -> tuple[dict, list[dict] | None]:
+    """Post a review, split with split_review_input() if it is large.
+
+    The first chunk, with the message and labels, is posted first so it
+    leads the change log and a rejected vote stops the rest. The remaining
+    chunks only add comments and are posted in parallel.
+
+    Args:
+        base_url: Gerrit server base URL.
+        change_ref: Change number or Change-Id.
+        revision: Target revision (SHA, patch set number, or 'current').
+        review_input: ReviewInput entity dictionary.
+        client: Optional client to use instead of the shared one for base_url.
+        max_bytes: Maximum JSON size of a chunk.
+        max_comments: Maximum number of inline comments in a chunk.
+        jobs: Maximum number of chunks posted at the same time.
+        preflight: If True, check the comments with validate_review() first
+            and post to the revision SHA they were checked against.
+        cache: Optional response cache for the preflight check.
+        **post_kwargs: Extra arguments for post_review() (retry, limiter).
+
+    Returns:
+        Tuple of (API response of the first chunk, per-chunk status list or
+        None if the review was posted in one piece). A status has 'chunk'
+        (1-based), 'comments' (count) and 'success' or 'error'.
+
+    Raises:
+        GerritError: When an unchunked review fails.
+        ValidationError: When the preflight check finds problems; nothing
+            is posted.
+        PartialReviewError: When any chunk fails; later chunks are not
+            posted if the first one fails.
+    """
+    if client is None:
+        client = get_client(base_url)
+    if preflight:
+        with gerrit_trace.span("validate", change=change_ref):
+            revision = validate_review(client, change_ref, revision, review_input,
+                                       cache)
+
+    chunks = split_review_input(review_input, max_bytes, max_comments)
+    if len(chunks) == 1:
+        return post_review(base_url, change_ref, revision, review_input,
+                           client=client, **post_kwargs), None
+
+    def status(index: int, error: Exception | None = None) -> dict:
+        result = {"chunk": index + 1, "comments": _count_comments(chunks[index])}
+        if error is None:
+            result["success"] = True
+        else:
+            result["error"] = {"type": type(error).__name__, "message": str(error)}
+        return result
+
+    def post(index: int) -> dict:
+        try:
+            response = post_review(base_url, change_ref, revision, chunks[index],
+                                   client=client, **post_kwargs)
+        except GerritError as e:
+            return status(index, e)
+        return {**status(index), "response": response}
+
+    statuses = [post(0)]
+    if "error" in statuses[0]:
+        skipped = GerritError("Not posted: the first chunk failed")
+        statuses.extend(status(i, skipped) for i in range(1, len(chunks)))
+    else:
+        with ThreadPoolExecutor(max_workers=max(1, min(jobs, len(chunks) - 1))) as pool:
+            statuses.extend(pool.map(post, range(1, len(chunks))))
+
+    response = statuses[0].pop("response", {})
+    for record in statuses:
+        record.pop("response", None)
+    failed = sum(1 for record in statuses if "error" in record)
+    if failed:
+        raise PartialReviewError(f"{failed} of {len(statuses)} chunks failed", statuses)
+    return response, statuses
+
+
 def format_success_output(
     change_ref: str,
     revision: str | None,
     api_response: dict,
+    chunks: list[dict] | None = None,
 ) -> dict:
     """Format successful operation output.
 
@@ -153,16 +641,20 @@ def format_success_output(
         change_ref: Change number or Change-Id.
         revision: Target revision used.
         api_response: Response from Gerrit API.
+        chunks: Per-chunk status of a chunked review, if any.
 
     Returns:
         Formatted output dictionary.
     """
-    return {
+    result = {
         "change": change_ref,
         "revision": revision or "current",
         "success": True,
         "response": api_response,
     }
+    if chunks is not None:
+        result["chunks"] = chunks
+    return result
 
 
 def format_error_output(
@@ -180,7 +672,7 @@ def format_error_output(
     Returns:
         Formatted error output dictionary.
     """
-    return {
+    result = {
         "change": change_ref,
         "revision": revision,
         "error": {
@@ -188,20 +680,195 @@ def format_error_output(
             "message": str(error),
         },
     }
+    chunks = getattr(error, "chunks", None)
+    if chunks is not None:
+        result["chunks"] = chunks
+    problems = getattr(error, "problems", None)
+    if problems is not None:
+        result["problems"] = problems
+    return result
+
+
+def parse_manifest_record(text: str) -> tuple[str, str | None, dict]:
+    """Parse one manifest line.
+
+    Args:
+        text: JSON object with 'change', optional 'revision' and 'review'
+            (a ReviewInput entity).
+
+    Returns:
+        Tuple of (change, revision, review_input).
+
+    Raises:
+        GerritError: When the line is not a valid record.
+    """
+    try:
+        record = json.loads(text)
+    except json.JSONDecodeError as e:
+        raise GerritError(f"Invalid JSON: {e}")
+    if not isinstance(record, dict):
+        raise GerritError("Manifest record must be a JSON object")
+
+    change = record.get("change")
+    if isinstance(change, int):
+        change = str(change)
+    if not isinstance(change, str) or not change.strip():
+        raise GerritError("Manifest record needs a 'change'")
+
+    revision = record.get("revision")
+    if revision is not None:
+        revision = str(revision).strip() or None
+
+    review_input = record.get("review")
+    if not isinstance(review_input, dict):
+        raise GerritError("Manifest record needs a 'review' object")
+
+    return change.strip(), revision, review_input
+
+
+def post_manifest_record(line: int, text: str,
+                         pool_size: int | None = None,
+                         **post_kwargs) -> tuple[dict, bool]:
+    """Post one manifest record and format its result.
+
+    Errors are captured in the returned record instead of being raised so
+    that one failing record does not abort the manifest.
+
+    Args:
+        line: Line number of the record in the manifest (1-based).
+        text: The manifest line.
+        pool_size: Connection pool size of the shared client.
+        **post_kwargs: Extra arguments for post_review_chunked() (retry,
+            limiter, max_bytes, max_comments, preflight, cache).
+
+    Returns:
+        Tuple of (output dict with 'line', success flag).
+    """
+    change = revision = None
+    try:
+        change, revision, review_input = parse_manifest_record(text)
+        base_url, change_ref = resolve_change(change)
+        client = get_client(base_url, pool_size=pool_size)
+        api_response, chunks = post_review_chunked(
+            base_url, change_ref, revision, review_input, client=client, **post_kwargs
+        )
+    except GerritError as e:
+        return {"line": line, **format_error_output(change, revision, e)}, False
+    output = format_success_output(change_ref, revision, api_response, chunks)
+    return {"line": line, **output}, True
+
+
+def iter_manifest_results(lines: Iterable[str], jobs: int = DEFAULT_JOBS,
+                          **post_kwargs) -> Iterator[tuple[dict, bool]]:
+    """Post manifest records concurrently, yielding results as they finish.
+
+    Lines are read lazily and at most ``2 * jobs`` records are in flight, so
+    a manifest of any size, including one piped on stdin, is posted in
+    bounded memory. Blank lines are skipped.
+
+    Args:
+        lines: Manifest lines, one JSON record each.
+        jobs: Maximum number of reviews posted at the same time.
+        **post_kwargs: Extra arguments for post_review_chunked().
+
+    Yields:
+        Tuples of (output dict, success flag), in completion order.
+    """
+    records = ((n, text) for n, text in enumerate(lines, 1) if text.strip())
+    if jobs <= 1:
+        for line, text in records:
+            yield post_manifest_record(line, text, **post_kwargs)
+        return
+
+    # Size the shared connection pool so every worker keeps its connection
+    pool_size = get_batch_pool_size(jobs)
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        pending = set()
+        for line, text in records:
+            if len(pending) >= 2 * jobs:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+            pending.add(pool.submit(post_manifest_record, line, text, pool_size,
+                                    **post_kwargs))
+        for future in as_completed(pending):
+            yield future.result()
 
 
 def main(argv: list[str] | None = None) -> int:
     """Main entry point."""
     parser = argparse.ArgumentParser(
-        description="Post comments to Gerrit review changes"
+        # Fixed, as gerrit_daemon.py runs main() under its own argv[0]
+        prog="post_comment.py",
+        description="Post comments to Gerrit review changes",
     )
 
     # Basic parameters
-    parser.add_argument(
+    target_group = parser.add_mutually_exclusive_group(required=True)
+    target_group.add_argument(
         "--change",
-        required=True,
         help="Change URL, number, or Change-Id",
     )
+    target_group.add_argument(
+        "--manifest",
+        help="JSONL file of {change, revision, review} records to post, "
+             "or '-' for stdin (bulk mode)",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=DEFAULT_JOBS,
+        help=f"Reviews posted concurrently in bulk mode (default: {DEFAULT_JOBS})",
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        help="Maximum reviews posted per second, across all jobs "
+             "(default: $GERRIT_WRITE_RATE, or unlimited)",
+    )
+    parser.add_argument(
+        "--chunk-comments",
+        dest="chunk_comments",
+        type=int,
+        default=DEFAULT_CHUNK_COMMENTS,
+        help=f"Split reviews with more inline comments than this into chunks "
+             f"(default: {DEFAULT_CHUNK_COMMENTS})",
+    )
+    parser.add_argument(
+        "--chunk-bytes",
+        dest="chunk_bytes",
+        type=int,
+        default=DEFAULT_CHUNK_BYTES,
+        help=f"Split reviews larger than this many bytes of JSON into chunks "
+             f"(default: {DEFAULT_CHUNK_BYTES})",
+    )
+    parser.add_argument(
+        "--preflight",
+        action="store_true",
+        help="Check inline comment paths, lines and ranges against the "
+             "revision before posting, and report every problem at once",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        dest="cache_dir",
+        help="Cache directory for --preflight file data (default: "
+             "$GERRIT_CACHE_DIR or ~/.cache/gerritcomment)",
+    )
+    parser.add_argument(
+        "--retries",
+        type=int,
+        default=DEFAULT_RETRIES,
+        help=f"Retries on throttling and transient errors (default: {DEFAULT_RETRIES})",
+    )
+    parser.add_argument(
+        "--trace",
+        nargs="?",
+        const="-",
+        default=os.environ.get(gerrit_trace.TRACE_ENV) or None,
+        metavar="FILE",
+        help="Write timing spans for HTTP calls, retries and processing stages "
+             f"as JSON lines to FILE, or to stderr without one (default: ${gerrit_trace.TRACE_ENV})",
+    )
     parser.add_argument(
         "--revision",
         help="Revision (SHA, patch set number, or 'current')",
@@ -266,17 +933,63 @@ def main(argv: list[str] | None = None) -> int:
     )
 
     args = parser.parse_args(argv)
+    try:
+        tracer = gerrit_trace.open_tracer(args.trace)
+    except OSError as e:
+        parser.error(f"cannot write --trace: {e}")
+    with gerrit_trace.tracing(tracer, "post_comment"):
+        return _run(parser, args)
+
+
+def _run(parser: argparse.ArgumentParser, args: argparse.Namespace) -> int:
+    if args.retries < 0:
+        parser.error("--retries must not be negative")
+    if args.rate is not None and args.rate <= 0:
+        parser.error("--rate must be positive")
+    if args.chunk_comments < 1 or args.chunk_bytes < 1:
+        parser.error("--chunk-comments and --chunk-bytes must be positive")
+    try:
+        limiter = get_write_limiter(args.rate)
+    except GerritError as e:
+        parser.error(str(e))
+    post_kwargs = {
+        "retry": RetryPolicy(args.retries),
+        "limiter": limiter,
+        "max_bytes": args.chunk_bytes,
+        "max_comments": args.chunk_comments,
+    }
+    if args.preflight:
+        post_kwargs["preflight"] = True
+        try:
+            post_kwargs["cache"] = ResponseCache(args.cache_dir)
+        except GerritError as e:
+            print(f"warning: {e}; checking without cache", file=sys.stderr)
+
+    if args.manifest:
+        if args.jobs < 1:
+            parser.error("--jobs must be at least 1")
+        try:
+            manifest = _open_manifest(args.manifest)
+        except OSError as e:
+            parser.error(f"cannot read --manifest: {e}")
+        failed = 0
+        try:
+            # One compact line per record, as soon as it is posted
+            for result, ok in iter_manifest_results(manifest, args.jobs, **post_kwargs):
+                failed += not ok
+                print(json.dumps(result, ensure_ascii=False, separators=(",", ":")),
+                      flush=True)
+        finally:
+            if manifest is not sys.stdin:
+                manifest.close()
+        return 1 if failed else 0
 
     change = args.change.strip()
     revision = args.revision.strip() if args.revision else None
 
     try:
         # Determine base_url and change_ref
-        if change.startswith(("http://", "https://")):
-            base_url, change_ref = parse_change_url(change)
-        else:
-            base_url, _, _ = get_config()
-            change_ref = change
+        base_url, change_ref = resolve_change(change)
 
         # Parse JSON arguments
         labels = None
@@ -332,8 +1045,10 @@ def main(argv: list[str] | None = None) -> int:
         )
 
         # Post review
-        api_response = post_review(base_url, change_ref, revision, review_input)
-        result = format_success_output(change_ref, revision, api_response)
+        api_response, chunks = post_review_chunked(
+            base_url, change_ref, revision, review_input, **post_kwargs
+        )
+        result = format_success_output(change_ref, revision, api_response, chunks)
 
     except json.JSONDecodeError as e:
         result = format_error_output(change, revision, GerritError(f"Invalid JSON: {e}"))
@@ -367,5 +1082,12 @@ def _load_comments_json(value: str) -> dict:
     return json.loads(value)
 
 
+def _open_manifest(path: str) -> TextIO:
+    """Open a manifest file, or stdin for '-'."""
+    if path == "-":
+        return sys.stdin
+    return open(path, "r", encoding="utf-8")
+
+
 if __name__ == "__main__":
     sys.exit(main())
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""Search the local comment index built by get_comments.py --index.
+
+Runs offline: no server is contacted.
+"""
+from __future__ import annotations
+
+import sys
+
+if __name__ == "__main__":
+    # Hand the call to a running gerrit_daemon.py before the other imports
+    from gerrit_daemon import forward_to_daemon
+    forward_to_daemon("search_comments")
+
+import argparse
+import json
+
+from comment_index import DEFAULT_SEARCH_LIMIT, INDEX_ENV, CommentIndex
+from gerrit_utils import GerritError
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        # Fixed, as gerrit_daemon.py runs main() under its own argv[0]
+        prog="search_comments.py",
+        description="Search review comment threads in the local index",
+    )
+    parser.add_argument(
+        "--text",
+        help="Words a comment of the thread contains, in SQLite FTS5 syntax "
+             "(e.g. 'null pointer', '\"exact phrase\"', 'leak OR overflow')",
+    )
+    parser.add_argument("--file", help="Glob matched against the file, e.g. 'src/*.c'")
+    parser.add_argument("--author", help="Name of a thread participant (any case)")
+    parser.add_argument("--change", help="Only threads of this change number")
+    state = parser.add_mutually_exclusive_group()
+    state.add_argument("--unresolved", action="store_const", const=True,
+                       dest="unresolved", help="Only unresolved threads")
+    state.add_argument("--resolved", action="store_const", const=False,
+                       dest="unresolved", help="Only resolved threads")
+    parser.add_argument(
+        "--limit",
+        type=int,
+        default=DEFAULT_SEARCH_LIMIT,
+        help=f"Maximum threads, newest activity first; 0 for all "
+             f"(default: {DEFAULT_SEARCH_LIMIT})",
+    )
+    parser.add_argument(
+        "--index",
+        metavar="DB",
+        help=f"Index file (default: ${INDEX_ENV} or comments.sqlite in the "
+             "cache directory)",
+    )
+    parser.add_argument(
+        "--format",
+        choices=["json", "ndjson"],
+        default="json",
+        help="Output format: one JSON document (default), or one compact "
+             "line per thread",
+    )
+    args = parser.parse_args(argv)
+    if args.limit < 0:
+        parser.error("--limit must not be negative")
+
+    try:
+        with CommentIndex(args.index) as index:
+            threads = index.search(
+                text=args.text,
+                file=args.file,
+                author=args.author,
+                unresolved=args.unresolved,
+                change=args.change,
+                limit=args.limit or None,
+            )
+    except GerritError as e:
+        json.dump({"error": {"type": type(e).__name__, "message": str(e)}},
+                  sys.stdout, ensure_ascii=False, indent=2)
+        print()
+        return 1
+
+    if args.format == "ndjson":
+        for thread in threads:
+            sys.stdout.write(json.dumps({"type": "thread", **thread},
+                                        ensure_ascii=False, separators=(",", ":")))
+            sys.stdout.write("\n")
+        return 0
+    json.dump({"count": len(threads), "threads": threads}, sys.stdout,
+              ensure_ascii=False, indent=2)
+    print()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""Tests for bench_comments.py and regression gates for the hot path.
+
+The gate runs each microbenchmark at one size against the stored
+baselines, with a generous threshold as the test suite shares the machine
+with other work; `python3 bench_comments.py --check` is the strict check.
+
+Run with: pytest test_bench_comments.py -v
+"""
+from __future__ import annotations
+
+import json
+
+import pytest
+
+import bench_comments
+from bench_comments import (
+    MICRO_BENCHMARKS,
+    check_baseline,
+    load_baseline,
+    make_change_urls,
+    make_timestamps,
+    run_micro,
+    save_baseline,
+)
+from get_comments import parse_gerrit_timestamp
+from gerrit_utils import parse_change_url
+
+# Size and allowed slowdown of the test suite's regression gate
+GATE_SIZE = 10_000
+GATE_THRESHOLD = 3.0
+
+
+# =============================================================================
+# Unit Tests for the generated inputs
+# =============================================================================
+
+def test_generated_inputs_are_valid():
+    """Generated timestamps and URLs should parse, the same every time."""
+    timestamps = make_timestamps(100)
+    assert timestamps == make_timestamps(100)
+    assert all(parse_gerrit_timestamp(ts).year == 2026 for ts in timestamps)
+    urls = make_change_urls(100)
+    assert all(parse_change_url(url)[1].isdigit() for url in urls)
+
+
+# =============================================================================
+# Unit Tests for check_baseline() and save_baseline()
+# =============================================================================
+
+def test_check_baseline_flags_regressions():
+    """Only results slower than threshold times their baseline should fail."""
+    baseline = {"units": {"a": {"10": 1.0}, "b": {"10": 2.0}}}
+    results = [
+        {"name": "a", "size": 10, "units": 1.4},
+        {"name": "b", "size": 10, "units": 3.2},
+        {"name": "a", "size": 20, "units": 9.0},
+    ]
+    regressions = check_baseline(results, baseline, threshold=1.5)
+    assert regressions == [results[1]]
+    assert [(r["baseline"], r["ratio"]) for r in results] == [
+        (1.0, 1.4), (2.0, 1.6), (None, None)]
+
+
+def test_save_baseline_merges(tmp_path):
+    """Saving should keep the baselines of sizes that were not rerun."""
+    path = str(tmp_path / "baseline.json")
+    assert load_baseline(path) == {"units": {}}
+    save_baseline(path, [{"name": "a", "size": 100, "units": 2.0},
+                         {"name": "a", "size": 10, "units": 0.5}])
+    save_baseline(path, [{"name": "a", "size": 100, "units": 3.0}])
+    with open(path) as f:
+        assert json.load(f)["units"] == {"a": {"10": 0.5, "100": 3.0}}
+
+
+def test_main_check_exit_code(tmp_path, monkeypatch, capsys):
+    """--check should exit 1 and name the function that regressed."""
+    path = str(tmp_path / "baseline.json")
+    save_baseline(path, [{"name": "timestamp_key", "size": 1000, "units": 1e-6}])
+    monkeypatch.setattr(bench_comments, "bench_call", lambda func, repeat: 1.0)
+    assert bench_comments.main(["--check", "--baseline", path, "--size", "1000",
+                                "--only", "timestamp_key"]) == 1
+    summary = json.loads(capsys.readouterr().out.splitlines()[-1])
+    assert summary["check"] == "fail"
+    assert summary["regressions"] == ["timestamp_key@1000"]
+
+
+# =============================================================================
+# Regression gates
+# =============================================================================
+
+@pytest.mark.parametrize("name", sorted(MICRO_BENCHMARKS))
+def test_no_regression_against_baseline(name):
+    """Each hot path function should stay within its stored baseline."""
+    baseline = load_baseline(bench_comments.BASELINE_PATH)
+    assert str(GATE_SIZE) in baseline["units"][name]
+    results = run_micro([GATE_SIZE], repeat=3, names=[name])
+    regressions = check_baseline(results, baseline, GATE_THRESHOLD)
+    assert not regressions, f"{name} regressed: {results[0]}"
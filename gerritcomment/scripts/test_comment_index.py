@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""Tests for comment_index.py.
+
+Run with: pytest test_comment_index.py -v
+"""
+from __future__ import annotations
+
+import json
+
+import pytest
+
+import get_comments
+from comment_index import CommentIndex, sync_results
+from fake_gerrit import FakeGerrit
+from gerrit_utils import GerritError
+from test_fake_gerrit import COMMENTS
+
+SERVER = "https://gerrit.example.com"
+
+
+def _thread(root: str, file: str, author: str, message: str, updated: str,
+            unresolved: bool = True, replies: list[dict] | None = None) -> dict:
+    comments = [{"id": root, "in_reply_to": None, "patch_set": 1,
+                 "author": author, "message": message, "updated": updated,
+                 "unresolved": unresolved}]
+    comments.extend(replies or [])
+    last = comments[-1]
+    return {"file": file, "range": None, "line": 10,
+            "unresolved": last["unresolved"], "updated": last["updated"],
+            "comments": comments}
+
+
+def _result(change: str, threads: list[dict], watermark: str) -> dict:
+    return {"change": change, "latest_patchset": 1, "watermark": watermark,
+            "thread_count": len(threads), "threads": threads}
+
+
+@pytest.fixture
+def index():
+    with CommentIndex(":memory:") as idx:
+        idx.sync(SERVER, _result("1", [
+            _thread("a", "src/main.c", "Alice", "Possible null pointer dereference",
+                    "2026-01-01 10:00:00.000000000"),
+            _thread("b", "src/util.c", "Bob", "Typo in comment",
+                    "2026-01-02 10:00:00.000000000", unresolved=False),
+        ], "2026-01-02 10:00:00.000000000"))
+        idx.sync(SERVER, _result("2", [
+            _thread("c", "docs/README.md", "Carol", "Use 50% less words",
+                    "2026-01-03 10:00:00.000000000", replies=[
+                        {"id": "d", "in_reply_to": "c", "patch_set": 2,
+                         "author": "Alice", "message": "Done",
+                         "updated": "2026-01-04 10:00:00.000000000",
+                         "unresolved": False}]),
+        ], "2026-01-04 10:00:00.000000000"))
+        yield idx
+
+
+# =============================================================================
+# Unit Tests for search()
+# =============================================================================
+
+def test_search_newest_first(index):
+    """Without filters, every thread should come back newest first."""
+    threads = index.search()
+    assert [t["comments"][0]["id"] for t in threads] == ["c", "b", "a"]
+    assert threads[0]["change"] == "2"
+    assert [c["id"] for c in threads[0]["comments"]] == ["c", "d"]
+
+
+def test_search_filters(index):
+    """Text, file, author and state filters should combine."""
+    def roots(**kwargs):
+        return [t["comments"][0]["id"] for t in index.search(**kwargs)]
+
+    assert roots(text="pointer") == ["a"]
+    assert roots(text="null OR typo") == ["b", "a"]
+    assert roots(file="src/*") == ["b", "a"]
+    # Any participant matches, in any case
+    assert roots(author="alice") == ["c", "a"]
+    assert roots(unresolved=True) == ["a"]
+    assert roots(unresolved=False, author="Alice") == ["c"]
+    assert roots(change="1", limit=1) == ["b"]
+
+
+def test_search_invalid_syntax(index):
+    """A malformed FTS query should be reported, not crash."""
+    with pytest.raises(GerritError, match="Invalid search"):
+        index.search(text='"unbalanced')
+
+
+def test_search_without_fts5(index, monkeypatch):
+    """Without FTS5, text should be matched as a literal substring."""
+    monkeypatch.setattr(index, "fts", False)
+    assert [t["change"] for t in index.search(text="50%")] == ["2"]
+    assert index.search(text="5_%") == []
+
+
+# =============================================================================
+# Unit Tests for sync()
+# =============================================================================
+
+def test_sync_replaces_updated_threads(index):
+    """A re-synced thread should replace its stored copy, not duplicate it."""
+    index.sync(SERVER, _result("1", [
+        _thread("a", "src/main.c", "Alice", "Possible null pointer dereference",
+                "2026-01-01 10:00:00.000000000", replies=[
+                    {"id": "e", "in_reply_to": "a", "patch_set": 2,
+                     "author": "Dave", "message": "Fixed",
+                     "updated": "2026-01-05 10:00:00.000000000",
+                     "unresolved": False}]),
+    ], "2026-01-05 10:00:00.000000000"))
+    assert index.stats() == {"changes": 2, "threads": 3, "comments": 5}
+    thread = index.search(text="fixed")[0]
+    assert not thread["unresolved"]
+    assert [c["id"] for c in thread["comments"]] == ["a", "e"]
+    # The replaced comments are gone from the text index too
+    assert len(index.search(text="pointer")) == 1
+    assert index.watermarks(SERVER + "/") == {
+        "1": "2026-01-05 10:00:00.000000000",
+        "2": "2026-01-04 10:00:00.000000000",
+    }
+
+
+def test_sync_keeps_newer_watermark(index):
+    """An empty sync should never move a watermark back."""
+    index.sync(SERVER, _result("2", [], None))
+    assert index.watermarks(SERVER)["2"] == "2026-01-04 10:00:00.000000000"
+    assert index.watermarks("https://other.example.com") == {}
+
+
+def test_sync_results_passes_failures_through(index):
+    """Failed fetches should be reported and leave the index alone."""
+    failure = {"change": "3", "revision": None,
+               "error": {"type": "GerritError", "message": "404"}}
+    records = list(sync_results(index, [
+        (SERVER, failure, False),
+        (SERVER, _result("3", [], "2026-01-06 10:00:00.000000000"), True),
+    ]))
+    assert records == [failure, {"change": "3", "threads": 0,
+                                 "watermark": "2026-01-06 10:00:00.000000000"}]
+
+
+def test_index_unwritable(tmp_path):
+    """An index that cannot be created should raise GerritError."""
+    (tmp_path / "file").write_text("")
+    with pytest.raises(GerritError, match="Cannot open comment index"):
+        CommentIndex(str(tmp_path / "file" / "comments.sqlite"))
+
+
+# =============================================================================
+# Integration Tests
+# =============================================================================
+
+def test_get_comments_index_sync_is_incremental(gerrit_env, monkeypatch,
+                                                tmp_path, capsys):
+    """--index should store all threads, then fetch only newer activity."""
+    db = str(tmp_path / "comments.sqlite")
+    with FakeGerrit() as server:
+        server.add_change(123, COMMENTS, patchsets=2)
+        server.add_change(124)
+        monkeypatch.setenv("GERRIT_BASE_URL", server.url)
+
+        assert get_comments.main(["--query", "is:open", "--index", db]) == 0
+        out = json.loads(capsys.readouterr().out)
+        assert (out["count"], out["threads"], out["skipped"]) == (1, 2, 1)
+
+        # Unchanged since the last sync: the search alone is enough
+        server.reset_requests()
+        assert get_comments.main(["--query", "is:open", "--index", db]) == 0
+        assert json.loads(capsys.readouterr().out)["skipped"] == 2
+        assert server.request_count() == 1
+
+        server.add_change(123, {**COMMENTS, "src/new.c": [
+            {"id": "c9", "line": 1, "message": "Leak", "unresolved": True,
+             "updated": "2026-02-01 10:00:00.000000000"}]}, patchsets=2)
+        assert get_comments.main(["--change", "123", "--index", db]) == 0
+        out = json.loads(capsys.readouterr().out)
+        assert out["results"] == [{"change": "123", "threads": 1,
+                                   "watermark": "2026-02-01 10:00:00.000000000"}]
+
+    with CommentIndex(db) as index:
+        assert index.stats() == {"changes": 1, "threads": 3, "comments": 4}
+        assert [t["file"] for t in index.search(unresolved=True)] == [
+            "src/new.c", "src/util.c"]
+
+
+def test_get_comments_index_keys_changes_by_number(gerrit_env, monkeypatch,
+                                                  tmp_path, capsys):
+    """A change indexed by number and by Change-Id should be stored once."""
+    db = str(tmp_path / "comments.sqlite")
+    with FakeGerrit() as server:
+        change_id = server.add_change(123, COMMENTS, patchsets=2)["change_id"]
+        monkeypatch.setenv("GERRIT_BASE_URL", server.url)
+
+        for change in ("123", change_id, "project~123"):
+            assert get_comments.main(["--change", change, "--index", db]) == 0
+            assert json.loads(capsys.readouterr().out)["failed"] == 0
+
+    with CommentIndex(db) as index:
+        assert index.stats() == {"changes": 1, "threads": 2, "comments": 3}
+        assert list(index.watermarks(server.url)) == ["123"]
+        assert len(index.search(text="typo")) == 1
+
+
+def test_get_comments_index_usage_errors(gerrit_env, tmp_path):
+    """--index should refuse options that bypass its watermarks."""
+    with pytest.raises(SystemExit) as exc:
+        get_comments.main(["--change", "1", "--index", str(tmp_path / "db"),
+                           "--revision", "2"])
+    assert exc.value.code == 2
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""End-to-end tests of the scripts against fake_gerrit.py over HTTP.
+
+Run with: pytest test_fake_gerrit.py -v
+"""
+from __future__ import annotations
+
+import json
+
+import pytest
+
+from fake_gerrit import FakeGerrit
+from gerrit_cache import ResponseCache
+from gerrit_utils import GerritError, RetryPolicy, get_client
+from get_comments import fetch_comments
+from post_comment import post_review, post_review_chunked
+
+NO_WAIT = RetryPolicy(retries=3, sleep=lambda seconds: None)
+
+COMMENTS = {
+    "src/main.c": [
+        {"id": "c1", "line": 10, "message": "Fix this", "unresolved": True,
+         "updated": "2026-01-02 10:00:00.000000000", "patch_set": 1},
+        {"id": "c2", "line": 10, "in_reply_to": "c1", "message": "Done",
+         "unresolved": False, "updated": "2026-01-02 11:00:00.000000000",
+         "patch_set": 2},
+    ],
+    "src/util.c": [
+        {"id": "c3", "line": 3, "message": "Typo", "unresolved": True,
+         "updated": "2026-01-02 12:00:00.000000000", "patch_set": 2},
+    ],
+}
+
+
+@pytest.fixture
+def server(gerrit_env):
+    with FakeGerrit() as fake:
+        fake.add_change(123, COMMENTS, patchsets=2)
+        yield fake
+
+
+@pytest.fixture
+def client(server):
+    return get_client(server.url)
+
+
+# =============================================================================
+# Fetching
+# =============================================================================
+
+def test_fetch_comments_over_http(server, client):
+    """fetch_comments() should rebuild threads in two requests."""
+    result = fetch_comments(server.url, "123", unresolved_only=False, client=client)
+    assert result["latest_patchset"] == 2
+    assert [t["file"] for t in result["threads"]] == ["src/util.c", "src/main.c"]
+    assert [c["id"] for c in result["threads"][1]["comments"]] == ["c1", "c2"]
+    assert server.request_count() == 2
+
+
+def test_fetch_missing_change(server, client):
+    """An unknown change should fail with the usual 404 error."""
+    with pytest.raises(GerritError, match="404"):
+        fetch_comments(server.url, "999", client=client)
+
+
+def test_cached_fetch_revalidates(server, client, tmp_path):
+    """A cached re-fetch should get 304s and the same result."""
+    cache = ResponseCache(str(tmp_path))
+    first = fetch_comments(server.url, "123", client=client, cache=cache)
+    assert fetch_comments(server.url, "123", client=client, cache=cache) == first
+    assert server.request_count() == 4
+
+
+# =============================================================================
+# Posting
+# =============================================================================
+
+def test_post_review_round_trip(server, client):
+    """Posted comments should come back from the comments endpoint."""
+    review = {"message": "Review", "tag": "autogenerated:test",
+              "comments": {"src/util.c": [{"line": 4, "message": "New",
+                                           "unresolved": True}]}}
+    assert post_review(server.url, "123", None, review, client=client) == {}
+    result = fetch_comments(server.url, "123", client=client)
+    new = [t for t in result["threads"] if t["line"] == 4]
+    assert new[0]["comments"][0]["message"] == "New"
+    assert new[0]["comments"][0]["patch_set"] == 2
+
+
+def test_post_review_retries_injected_errors(server, client):
+    """Throttling should be retried until the review goes through."""
+    server.fail("/review$", status=429, count=2, retry_after=0)
+    post_review(server.url, "123", "1", {"message": "ok"}, client=client, retry=NO_WAIT)
+    assert server.request_count("POST") == 3
+    assert len(server.changes[123]["messages"]) == 1
+
+
+def test_post_review_lost_response_not_duplicated(server, client):
+    """A review applied before its connection dropped is posted once."""
+    server.fail("/review$", status=0, apply=True)
+    review = {"tag": "autogenerated:test",
+              "comments": {"src/main.c": [{"line": 1, "message": "Once"}]}}
+    result = post_review(server.url, "123", None, review, client=client, retry=NO_WAIT)
+    assert result == {"deduplicated": True}
+    assert server.request_count("POST") == 1
+    assert len(server.changes[123]["comments"]["src/main.c"]) == 3
+
+
+def test_post_chunked_with_preflight(server, client, tmp_path):
+    """A chunked, pre-flighted review should post every comment once."""
+    review = {"message": "Many",
+              "comments": {"src/util.c": [{"line": i % 12 + 1, "message": f"#{i}"}
+                                          for i in range(25)]}}
+    _, chunks = post_review_chunked(server.url, "123", None, review, client=client,
+                                    max_comments=10, preflight=True,
+                                    cache=ResponseCache(str(tmp_path)))
+    assert [c["comments"] for c in chunks] == [10, 10, 5]
+    assert len(server.changes[123]["comments"]["src/util.c"]) == 26
+    assert len(server.changes[123]["messages"]) == 3
+
+
+# =============================================================================
+# Record and replay
+# =============================================================================
+
+def test_record_and_replay(gerrit_env, tmp_path):
+    """A recorded session should replay the same results offline."""
+    recording = str(tmp_path / "session.jsonl")
+    with FakeGerrit(record=recording) as live:
+        live.add_change(123, COMMENTS, patchsets=2)
+        expected = fetch_comments(live.url, "123", unresolved_only=False,
+                                  client=get_client(live.url))
+
+    with open(recording) as f:
+        assert len([json.loads(line) for line in f]) == 2
+    with FakeGerrit(replay=recording) as replayed:
+        result = fetch_comments(replayed.url, "123", unresolved_only=False,
+                                client=get_client(replayed.url))
+    assert result == expected
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""Tests for gerrit_cache.py.
+
+Run with: pytest test_gerrit_cache.py -v
+"""
+from __future__ import annotations
+
+import json
+import os
+import time
+
+from gerrit_cache import ResponseCache, cached_get, cached_stream, strip_json_prefix
+
+
+# =============================================================================
+# Unit Tests for ResponseCache
+# =============================================================================
+
+def test_cache_roundtrip(tmp_path):
+    """Stored entries should load with their ETag."""
+    cache = ResponseCache(str(tmp_path))
+    key = cache.key("https://gerrit.example.com", "/changes/1/comments")
+    cache.store(key, '{"a": 1}', etag='"v1"')
+    entry = cache.load(key)
+    assert entry.body == '{"a": 1}'
+    assert entry.etag == '"v1"'
+    assert entry.immutable is False
+
+
+def test_cache_key_depends_on_server_and_endpoint():
+    """Keys should differ per server and per endpoint."""
+    a = ResponseCache.key("https://a.example.com", "/changes/1/comments")
+    b = ResponseCache.key("https://b.example.com", "/changes/1/comments")
+    c = ResponseCache.key("https://a.example.com", "/changes/2/comments")
+    assert len({a, b, c}) == 3
+
+
+def test_cache_expires_old_entries(tmp_path):
+    """Entries older than max_age should not be served."""
+    cache = ResponseCache(str(tmp_path), max_age=60)
+    key = cache.key("https://gerrit.example.com", "/x")
+    cache.store(key, "{}", etag='"v1"')
+    cache.max_age = -1
+    assert cache.load(key) is None
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    """Eviction should drop the oldest entries until under max_bytes."""
+    cache = ResponseCache(str(tmp_path), max_bytes=10_000)
+    keys = [cache.key("https://gerrit.example.com", f"/{i}") for i in range(4)]
+    for i, key in enumerate(keys):
+        cache.store(key, "x" * 4000, etag=f'"{i}"')
+        path = cache._path(key)
+        os.utime(path, (time.time() - 100 + i, time.time() - 100 + i))
+    cache.evict()
+    assert cache.load(keys[0]) is None
+    assert cache.load(keys[1]) is None
+    assert cache.load(keys[3]) is not None
+
+
+def test_strip_json_prefix():
+    """The XSSI prefix should be removed."""
+    assert strip_json_prefix(")]}'\n{}") == "\n{}"
+    assert strip_json_prefix("{}") == "{}"
+
+
+# =============================================================================
+# Unit Tests for cached_get()
+# =============================================================================
+
+def test_cached_get_revalidates(stub_client, tmp_path):
+    """A second read should send If-None-Match and use the cached body."""
+    client = stub_client({"/a/changes/1/comments": {"f.c": []}})
+    cache = ResponseCache(str(tmp_path))
+    assert cached_get(client, "/changes/1/comments", cache) == {"f.c": []}
+    assert cached_get(client, "/changes/1/comments", cache) == {"f.c": []}
+    assert client.adapter.not_modified == 1
+
+
+def test_cached_get_immutable_skips_request(stub_client, tmp_path):
+    """Immutable entries should be served without a request."""
+    client = stub_client({"/a/changes/1/revisions/abc/files": {"f.c": {}}})
+    cache = ResponseCache(str(tmp_path))
+    endpoint = "/changes/1/revisions/abc/files"
+    cached_get(client, endpoint, cache, immutable=True)
+    assert cached_get(client, endpoint, cache, immutable=True) == {"f.c": {}}
+    assert client.request_counter.count == 1
+
+
+def test_cached_stream_tees_into_cache(stub_client, tmp_path):
+    """A streamed body should be cached whole and replayed on 304."""
+    raw = {"src/ü.c": [{"id": "c1", "message": "naïve"}]}
+    client = stub_client({"/a/changes/1/comments": raw})
+    cache = ResponseCache(str(tmp_path))
+    # One byte per chunk splits the prefix and multi-byte characters
+    first = "".join(cached_stream(client, "/changes/1/comments", cache, chunk_size=1))
+    second = "".join(cached_stream(client, "/changes/1/comments", cache, chunk_size=3))
+    assert json.loads(first) == json.loads(second) == raw
+    assert client.adapter.not_modified == 1
+
+
+def test_cached_stream_partial_read_not_cached(stub_client, tmp_path):
+    """Abandoning a stream should not leave a partial cache entry."""
+    client = stub_client({"/a/changes/1/comments": {"f.c": [{"id": "c1"}]}})
+    cache = ResponseCache(str(tmp_path))
+    chunks = cached_stream(client, "/changes/1/comments", cache, chunk_size=4)
+    next(chunks)
+    chunks.close()
+    assert cache.load(cache.key(client.get_endpoint_url(""), "/changes/1/comments")) is None
+    assert not [name for _, _, files in os.walk(tmp_path) for name in files]
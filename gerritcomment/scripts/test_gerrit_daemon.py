@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""Tests for gerrit_daemon.py.
+
+Run with: pytest test_gerrit_daemon.py -v
+"""
+from __future__ import annotations
+
+import io
+import json
+import os
+import shutil
+import socket
+import stat
+import sys
+import tempfile
+import threading
+import time
+
+import pytest
+
+import get_comments
+from gerrit_daemon import GerritDaemon, call_daemon, default_socket_path, env_fingerprint
+from test_get_comments import ROUTES
+
+
+@pytest.fixture
+def socket_path():
+    # Unix socket paths are limited to ~100 bytes, too short for tmp_path
+    directory = tempfile.mkdtemp(prefix="gd-")
+    yield os.path.join(directory, "daemon.sock")
+    shutil.rmtree(directory, ignore_errors=True)
+
+
+@pytest.fixture
+def start_daemon(socket_path):
+    """Return a factory starting a GerritDaemon on socket_path."""
+    servers = []
+    streams = sys.stdout, sys.stderr
+
+    def start(scripts, **kwargs):
+        server = GerritDaemon(socket_path, scripts=scripts, **kwargs)
+        thread = threading.Thread(target=server.serve_forever,
+                                  kwargs={"poll_interval": 0.05}, daemon=True)
+        thread.start()
+        servers.append((server, thread))
+        return server
+
+    yield start
+    for server, thread in servers:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+    sys.stdout, sys.stderr = streams
+
+
+def _call(script, argv, path):
+    out, err = io.StringIO(), io.StringIO()
+    code = call_daemon(script, argv, path, stdout=out, stderr=err)
+    return code, out.getvalue(), err.getvalue()
+
+
+def _echo(argv):
+    print(" ".join(argv))
+    print("to stderr", file=sys.stderr)
+    return 3
+
+
+# =============================================================================
+# Unit Tests for forwarding
+# =============================================================================
+
+def test_forwards_output_and_exit_code(start_daemon, socket_path):
+    """The client should print the call's stdout and stderr and exit code."""
+    start_daemon({"echo": _echo})
+    assert _call("echo", ["a", "b"], socket_path) == (3, "a b\n", "to stderr\n")
+
+
+def test_system_exit_becomes_exit_code(start_daemon, socket_path):
+    """argparse errors (SystemExit) should come back as exit code and text."""
+    def usage(argv):
+        print("usage: x", file=sys.stderr)
+        sys.exit(2)
+
+    start_daemon({"usage": usage})
+    assert _call("usage", [], socket_path) == (2, "", "usage: x\n")
+
+
+def test_unhandled_exception_reported(start_daemon, socket_path):
+    """An exception in main() should fail the call, not the daemon."""
+    def broken(argv):
+        raise RuntimeError("boom")
+
+    start_daemon({"broken": broken, "echo": _echo})
+    code, out, err = _call("broken", [], socket_path)
+    assert code == 1
+    assert "RuntimeError: boom" in err
+    assert _call("echo", ["ok"], socket_path)[0] == 3
+
+
+def test_no_daemon_falls_back(socket_path):
+    """Without a daemon the call should run in-process."""
+    assert call_daemon("echo", [], socket_path) is None
+
+
+def test_stdin_and_environment_fall_back(start_daemon, socket_path, monkeypatch):
+    """Calls reading stdin or from another environment should not be served."""
+    start_daemon({"echo": _echo})
+    assert call_daemon("echo", ["--changes-file", "-"], socket_path) is None
+    assert call_daemon("echo", ["--changes-file=-"], socket_path) is None
+    assert call_daemon("echo", ["--manifest=-"], socket_path) is None
+    # Only a whole '-' value means stdin
+    assert _call("echo", ["--message=a-"], socket_path)[0] == 3
+    monkeypatch.setenv("GERRIT_USER", "someone-else")
+    assert call_daemon("echo", [], socket_path) is None
+
+
+def test_long_running_calls_fall_back(start_daemon, socket_path):
+    """--watch, also abbreviated as argparse allows, should never be forwarded."""
+    start_daemon({"echo": _echo})
+    for argv in (["--watch"], ["--change", "1", "--wat"], ["--watch=x"]):
+        assert call_daemon("echo", argv, socket_path) is None
+    assert _call("echo", ["--whatever"], socket_path)[0] == 3
+
+
+def test_call_stops_when_client_disconnects(start_daemon, socket_path):
+    """A call should end at its next output once the client is gone."""
+    stopped = threading.Event()
+
+    def forever(argv):
+        try:
+            while True:
+                print("tick", flush=True)
+                time.sleep(0.01)
+        finally:
+            stopped.set()
+
+    start_daemon({"forever": forever})
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.connect(socket_path)
+    client.sendall(json.dumps({"script": "forever", "argv": [], "cwd": os.getcwd(),
+                               "env": env_fingerprint()}).encode() + b"\n")
+    assert client.recv(4096)
+    client.close()
+    assert stopped.wait(5)
+
+
+def test_disabled_by_environment(start_daemon, socket_path, monkeypatch):
+    """GERRIT_DAEMON=0 should keep every call in-process."""
+    start_daemon({"echo": _echo})
+    monkeypatch.setenv("GERRIT_DAEMON", "0")
+    assert call_daemon("echo", [], socket_path) is None
+
+
+def test_traced_calls_fall_back(start_daemon, socket_path):
+    """Traced calls should run in-process, where tracing is their own."""
+    start_daemon({"echo": _echo})
+    assert call_daemon("echo", ["--trace"], socket_path) is None
+    assert call_daemon("echo", ["--trace=t.jsonl"], socket_path) is None
+
+
+def test_runs_in_client_directory(start_daemon, socket_path, tmp_path, monkeypatch):
+    """Relative paths should resolve against the client's directory."""
+    def cwd(argv):
+        print(os.getcwd())
+        return 0
+
+    start_daemon({"cwd": cwd})
+    monkeypatch.chdir(tmp_path)
+    assert _call("cwd", [], socket_path)[1] == f"{tmp_path}\n"
+
+
+def test_concurrent_calls_keep_output_apart(start_daemon, socket_path):
+    """Each client should only see its own call's output."""
+    def repeat(argv):
+        for _ in range(200):
+            print(argv[0], flush=True)
+        return 0
+
+    start_daemon({"repeat": repeat})
+    outputs = {}
+
+    def run(word):
+        outputs[word] = _call("repeat", [word], socket_path)[1]
+
+    threads = [threading.Thread(target=run, args=(w,)) for w in ("x", "y", "z")]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert outputs == {w: f"{w}\n" * 200 for w in ("x", "y", "z")}
+
+
+# =============================================================================
+# Unit Tests for the socket
+# =============================================================================
+
+def test_socket_private_and_removed(start_daemon, socket_path):
+    """The socket should be owner-only and removed on close."""
+    server = start_daemon({})
+    assert stat.S_IMODE(os.stat(socket_path).st_mode) == 0o600
+    server.shutdown()
+    server.server_close()
+    assert not os.path.exists(socket_path)
+
+
+def test_stale_socket_replaced(socket_path, start_daemon):
+    """A socket left by a dead daemon should be replaced; a live one kept."""
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(socket_path)
+    stale.close()
+    start_daemon({"echo": _echo})
+    assert _call("echo", ["up"], socket_path)[0] == 3
+    with pytest.raises(RuntimeError, match="already listening"):
+        GerritDaemon(socket_path, scripts={})
+
+
+def test_foreign_socket_not_trusted(start_daemon, socket_path, monkeypatch):
+    """A socket of another user should be neither used nor replaced."""
+    start_daemon({"echo": _echo})
+    monkeypatch.setattr(os, "getuid", lambda: os.stat(socket_path).st_uid + 1)
+    assert call_daemon("echo", [], socket_path) is None
+    with pytest.raises(RuntimeError, match="another user"):
+        GerritDaemon(socket_path, scripts={})
+
+
+def test_non_socket_path_refused(socket_path):
+    """A regular file at the socket path should be left alone."""
+    with open(socket_path, "w") as f:
+        f.write("not a socket")
+    assert call_daemon("echo", [], socket_path) is None
+    with pytest.raises(RuntimeError, match="not a socket"):
+        GerritDaemon(socket_path, scripts={})
+    assert os.path.exists(socket_path)
+
+
+def test_default_socket_dir_private(monkeypatch):
+    """Without a runtime dir, the socket should go to a per-user directory."""
+    # The daemon replaces both streams; restored by monkeypatch
+    monkeypatch.setattr(sys, "stdout", sys.stdout)
+    monkeypatch.setattr(sys, "stderr", sys.stderr)
+    monkeypatch.delenv("GERRIT_DAEMON_SOCKET", raising=False)
+    monkeypatch.delenv("XDG_RUNTIME_DIR", raising=False)
+    path = default_socket_path()
+    assert path == f"/tmp/gerritcomment-{os.getuid()}/daemon.sock"
+    directory = tempfile.mkdtemp(prefix="gd-")
+    try:
+        nested = os.path.join(directory, "private", "daemon.sock")
+        server = GerritDaemon(nested, scripts={})
+        server.server_close()
+        assert stat.S_IMODE(os.stat(os.path.dirname(nested)).st_mode) == 0o700
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def test_idle_timeout(start_daemon, socket_path):
+    """The daemon should only count as idle without calls in flight."""
+    server = start_daemon({}, idle_timeout=0.01)
+    server.begin_call()
+    server._last_call -= 1
+    assert not server.idle()
+    server.end_call()
+    server._last_call -= 1
+    assert server.idle()
+
+
+# =============================================================================
+# Integration Tests
+# =============================================================================
+
+def test_get_comments_output_matches_in_process(start_daemon, socket_path,
+                                                stub_client, capsys):
+    """get_comments.py should print the same JSON through the daemon."""
+    stub_client(ROUTES)
+    argv = ["--change", "123", "--all"]
+    assert get_comments.main(argv) == 0
+    expected = capsys.readouterr().out
+
+    start_daemon({"get_comments": get_comments.main})
+    code, out, _ = _call("get_comments", argv, socket_path)
+    assert code == 0
+    assert out == expected
+    assert json.loads(out)["thread_count"] == 2
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""Tests for gerrit_files.py.
+
+Run with: pytest test_gerrit_files.py -v
+"""
+from __future__ import annotations
+
+import difflib
+
+import pytest
+from hypothesis import given, strategies as st
+
+from fake_gerrit import FakeGerrit, _diff
+from gerrit_files import (
+    count_lines,
+    get_file_content,
+    get_revision_files,
+    line_map,
+    map_line,
+    resolve_revision,
+)
+from gerrit_utils import GerritError, get_client
+
+CHANGE = {
+    "current_revision": "bbb222",
+    "revisions": {"aaa111": {"_number": 1}, "abc333": {"_number": 2},
+                  "bbb222": {"_number": 3}},
+}
+
+
+@pytest.mark.parametrize("revision,expected", [
+    (None, ("bbb222", 3)),
+    ("current", ("bbb222", 3)),
+    ("2", ("abc333", 2)),
+    ("AAA", ("aaa111", 1)),
+])
+def test_resolve_revision(stub_client, revision, expected):
+    """Patch set numbers, SHA prefixes and 'current' should resolve."""
+    client = stub_client({"/a/changes/1": CHANGE})
+    assert resolve_revision(client, "1", revision) == expected
+
+
+@pytest.mark.parametrize("revision", ["a", "9", "fff"])
+def test_resolve_revision_unknown_or_ambiguous(stub_client, revision):
+    """Unknown or ambiguous revisions should raise GerritError."""
+    client = stub_client({"/a/changes/1": CHANGE})
+    with pytest.raises(GerritError, match="Revision not found"):
+        resolve_revision(client, "1", revision)
+
+
+def test_resolve_revision_missing_change(stub_client):
+    """A missing change should raise GerritError."""
+    with pytest.raises(GerritError, match="404"):
+        resolve_revision(stub_client({}), "1")
+
+
+@pytest.mark.parametrize("status", [500, 401, 409])
+def test_request_failures_raise_gerrit_error(gerrit_env, status):
+    """Error statuses other than 404 should raise GerritError with the path."""
+    with FakeGerrit() as server:
+        server.add_change(1, {"src/main.c": [{"id": "c1", "line": 1,
+                                              "message": "x"}]})
+        client = get_client(server.url)
+        sha, _ = resolve_revision(client, "1")
+        server.fail("/files$", status=status, count=None)
+        server.fail("/content$", status=status, count=None)
+        with pytest.raises(GerritError, match=f"/files.*{status}"):
+            get_revision_files(client, "1", sha)
+        with pytest.raises(GerritError, match=f"src%2Fmain.c/content.*{status}"):
+            get_file_content(client, "1", sha, "src/main.c")
+
+
+@pytest.mark.parametrize("text,lines", [
+    ("", 0), ("a", 1), ("a\n", 1), ("a\nb", 2), ("\n\n", 2),
+])
+def test_count_lines(text: str, lines: int):
+    """A trailing line without newline should still count."""
+    assert count_lines(text) == lines
+
+
+# =============================================================================
+# Unit Tests for line_map()
+# =============================================================================
+
+DIFF = {"content": [
+    {"skip": 3},                          # a 1-3 -> b 1-3
+    {"a": ["x"], "b": ["y", "z"]},        # a 4 -> b 4-5, changed
+    {"ab": ["same"]},                     # a 5 -> b 6
+    {"b": ["new"]},                       # inserted b 7
+    {"a": ["gone", "gone"]},              # a 6-7 deleted, before b 8
+    {"a": [" ws"], "b": ["ws"], "common": True},  # a 8 -> b 8
+    {"skip": 2},                          # a 9-10 -> b 9-10
+]}
+
+
+@pytest.mark.parametrize("line,expected", [
+    (1, (1, True)), (3, (3, True)), (4, (4, False)), (5, (6, True)),
+    (6, (8, False)), (7, (8, False)), (8, (8, True)), (10, (10, True)),
+    (12, (12, True)),
+])
+def test_map_line(line: int, expected: tuple[int, bool]):
+    """Common lines should shift exactly; changed lines land nearby."""
+    assert map_line(line_map(DIFF), line) == expected
+
+
+def test_map_line_deleted_at_end():
+    """Lines deleted at the end should map to the new last line."""
+    lines = line_map({"content": [{"skip": 2}, {"a": ["x", "y"]}]})
+    assert map_line(lines, 4) == (2, False)
+    assert map_line(line_map({"content": []}), 7) == (7, True)
+
+
+@given(st.lists(st.sampled_from("abcd"), max_size=12),
+       st.lists(st.sampled_from("abcd"), max_size=12),
+       st.sampled_from(["0", "ALL"]))
+def test_map_line_matches_difflib(old: list[str], new: list[str], context: str):
+    """Lines difflib matches should map exactly; all others stay in range."""
+    lines = line_map(_diff("\n".join(old), "\n".join(new), context))
+    matched = {}
+    matcher = difflib.SequenceMatcher(None, old, new, autojunk=False)
+    for a, b, size in matcher.get_matching_blocks():
+        matched.update((a + i + 1, b + i + 1) for i in range(size))
+    for line in range(1, len(old) + 1):
+        mapped, exact = map_line(lines, line)
+        if line in matched:
+            assert (mapped, exact) == (matched[line], True)
+        else:
+            assert not exact and 1 <= mapped <= max(len(new), 1)
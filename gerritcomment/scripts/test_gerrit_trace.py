@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""Tests for gerrit_trace.py.
+
+Run with: pytest test_gerrit_trace.py -v
+"""
+from __future__ import annotations
+
+import io
+import json
+
+import pytest
+
+import gerrit_trace
+import get_comments
+import post_comment
+from fake_gerrit import FakeGerrit
+from gerrit_trace import Tracer, span, tracing
+from test_fake_gerrit import COMMENTS
+
+
+def _records(text: str) -> list[dict]:
+    return [json.loads(line) for line in text.splitlines()]
+
+
+@pytest.fixture
+def server(gerrit_env, monkeypatch):
+    with FakeGerrit() as fake:
+        fake.add_change(123, COMMENTS, patchsets=2)
+        monkeypatch.setenv("GERRIT_BASE_URL", fake.url)
+        yield fake
+
+
+# =============================================================================
+# Unit Tests for spans
+# =============================================================================
+
+def test_spans_are_noops_when_off():
+    """Without a tracer, spans and events should record nothing."""
+    with span("work", size=1) as fields:
+        fields["done"] = True
+    gerrit_trace.event("retry")
+    assert gerrit_trace._tracer is None
+
+
+def test_spans_written_as_json_lines():
+    """Spans should carry the trace id, duration and their fields."""
+    out = io.StringIO()
+    with tracing(Tracer(out), "test"):
+        with span("work", size=1) as fields:
+            fields["items"] = 2
+        with pytest.raises(ValueError):
+            with span("broken"):
+                raise ValueError("x")
+        gerrit_trace.event("retry", attempt=1)
+    work, broken, retry, run = _records(out.getvalue())
+    assert {r["trace"] for r in (work, broken, retry, run)} == {run["trace"]}
+    assert work["span"] == "work" and work["size"] == 1 and work["items"] == 2
+    assert work["ms"] >= 0
+    assert broken["error"] == "ValueError"
+    assert retry == {**retry, "span": "retry", "attempt": 1}
+    assert "ms" not in retry
+    assert run["span"] == "run" and run["script"] == "test"
+    assert gerrit_trace._tracer is None
+
+
+# =============================================================================
+# Integration Tests
+# =============================================================================
+
+def test_get_comments_trace(server, tmp_path, capsys):
+    """--trace should record HTTP calls and stages, leaving stdout intact."""
+    trace_file = tmp_path / "trace.jsonl"
+    assert get_comments.main(["--change", "123", "--all",
+                              "--trace", str(trace_file)]) == 0
+    assert json.loads(capsys.readouterr().out)["thread_count"] == 2
+
+    records = _records(trace_file.read_text())
+    by_span = {}
+    for record in records:
+        by_span.setdefault(record["span"], []).append(record)
+    http = {r["path"].split("?")[0]: r for r in by_span["http"]}
+    assert set(http) == {"/a/changes/123", "/a/changes/123/comments"}
+    comments = http["/a/changes/123/comments"]
+    assert comments["status"] == 200
+    assert comments["bytes"] > 0
+    assert comments["read_ms"] >= 0
+    assert comments["ms"] >= comments["ttfb_ms"]
+    # A new client has to open its connections
+    assert any("connect_ms" in r for r in http.values())
+    assert by_span["collect_threads"][0]["threads"] == 2
+    assert by_span["change"][0]["threads"] == 2
+    assert by_span["run"][0]["script"] == "get_comments"
+
+
+def test_post_comment_trace_records_retries(server, capsys):
+    """Retried posts should show every attempt and the retry events."""
+    server.fail("/review$", status=503, count=1, retry_after=0)
+    assert post_comment.main(["--change", "123", "--message", "ok",
+                              "--trace"]) == 0
+    captured = capsys.readouterr()
+    assert json.loads(captured.out)["success"] is True
+
+    records = _records(captured.err)
+    posts = [r for r in records if r["span"] == "http" and r["method"] == "POST"]
+    assert [r["status"] for r in posts] == [503, 200]
+    assert [r["status"] for r in records if r["span"] == "retry"] == [503]
+    assert [r["span"] for r in records][-2:] == ["post_review", "run"]
+
+
+def test_trace_from_environment(server, tmp_path, monkeypatch, capsys):
+    """GERRIT_TRACE should enable tracing without the option."""
+    trace_file = tmp_path / "env.jsonl"
+    monkeypatch.setenv(gerrit_trace.TRACE_ENV, str(trace_file))
+    assert get_comments.main(["--change", "123"]) == 0
+    assert _records(trace_file.read_text())[-1]["span"] == "run"
+
+
+def test_unwritable_trace_file(server, tmp_path, capsys):
+    """An unwritable trace file should be a usage error."""
+    with pytest.raises(SystemExit) as exc:
+        get_comments.main(["--change", "123",
+                           "--trace", str(tmp_path / "missing" / "t.jsonl")])
+    assert exc.value.code == 2
+    assert "cannot write --trace" in capsys.readouterr().err
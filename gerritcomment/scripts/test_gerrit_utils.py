@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""Tests for gerrit_utils.py.
+
+Run with: pytest test_gerrit_utils.py -v
+"""
+from __future__ import annotations
+
+import asyncio
+import threading
+
+import pytest
+
+import gerrit_utils
+from gerrit_utils import (
+    GerritError,
+    RetryPolicy,
+    TokenBucket,
+    TransientError,
+    get_async_client,
+    get_batch_pool_size,
+    get_client,
+    get_client_options,
+    get_pool_size,
+    run_parallel,
+)
+
+
+@pytest.fixture(autouse=True)
+def credentials(monkeypatch):
+    monkeypatch.setenv("GERRIT_USER", "user")
+    monkeypatch.setenv("GERRIT_HTTP_PASSWORD", "secret")
+    for name in ("GERRIT_POOL_SIZE", "GERRIT_TIMEOUT", "GERRIT_CONNECT_TIMEOUT"):
+        monkeypatch.delenv(name, raising=False)
+    yield
+    gerrit_utils.close_clients()
+
+
+# =============================================================================
+# Unit Tests for shared clients
+# =============================================================================
+
+def test_missing_config_names_every_variable(monkeypatch):
+    """Config and credentials should report all unset variables alike."""
+    monkeypatch.delenv("GERRIT_BASE_URL", raising=False)
+    monkeypatch.setenv("GERRIT_USER", " ")
+    with pytest.raises(GerritError, match="GERRIT_BASE_URL, GERRIT_USER$"):
+        gerrit_utils.get_config()
+    with pytest.raises(GerritError, match=": GERRIT_USER$"):
+        gerrit_utils.get_credentials()
+    monkeypatch.setenv("GERRIT_USER", "user")
+    assert gerrit_utils.get_credentials() == ("user", "secret")
+
+
+def test_client_shared_per_base_url():
+    """The same base URL should reuse one client and session."""
+    a = get_client("https://gerrit.example.com")
+    b = get_client("https://gerrit.example.com/")
+    c = get_client("https://other.example.com")
+    assert a is b
+    assert a.session is b.session
+    assert c is not a
+
+
+def test_client_pool_size_applied():
+    """The keep-alive pool should hold pool_size connections per host."""
+    client = get_client("https://gerrit.example.com", pool_size=32)
+    adapter = client.session.get_adapter("https://gerrit.example.com")
+    assert adapter._pool_maxsize == 32
+
+
+def test_client_options_from_env(monkeypatch):
+    """Environment variables should override the defaults."""
+    monkeypatch.setenv("GERRIT_POOL_SIZE", "4")
+    monkeypatch.setenv("GERRIT_TIMEOUT", "5")
+    monkeypatch.setenv("GERRIT_CONNECT_TIMEOUT", "1.5")
+    assert get_client_options() == (4, (1.5, 5.0))
+    assert get_client_options(pool_size=8, timeout=2) == (8, (1.5, 2))
+
+
+def test_client_options_invalid_env(monkeypatch):
+    """Invalid numbers should raise GerritError."""
+    monkeypatch.setenv("GERRIT_TIMEOUT", "soon")
+    with pytest.raises(GerritError):
+        get_client_options()
+
+
+def test_client_missing_credentials(monkeypatch):
+    """Missing credentials should raise GerritError."""
+    monkeypatch.delenv("GERRIT_HTTP_PASSWORD")
+    with pytest.raises(GerritError, match="GERRIT_HTTP_PASSWORD"):
+        get_client("https://gerrit.example.com")
+
+
+def test_async_client_uses_shared_client(monkeypatch):
+    """Async calls should run on the shared client."""
+    client = get_client("https://gerrit.example.com")
+    monkeypatch.setattr(client, "get", lambda endpoint, **kwargs: {"endpoint": endpoint})
+
+    async def run():
+        async with get_async_client("https://gerrit.example.com") as aclient:
+            assert aclient.client is client
+            return await asyncio.gather(aclient.get("/a"), aclient.get("/b"))
+
+    assert asyncio.run(run()) == [{"endpoint": "/a"}, {"endpoint": "/b"}]
+
+
+# =============================================================================
+# Unit Tests for parallel calls
+# =============================================================================
+
+def test_run_parallel_uses_requested_workers():
+    """max_workers above the default pool size should all run at once."""
+    workers = gerrit_utils.DEFAULT_POOL_SIZE + 10
+    # Breaks (raises) unless every call is running at the same time
+    barrier = threading.Barrier(workers, timeout=5)
+    assert sorted(run_parallel([barrier.wait] * workers, workers)) == list(range(workers))
+    assert gerrit_utils._parallel_size >= workers
+
+
+def test_run_parallel_while_pool_grows(monkeypatch):
+    """Calls racing a pool resize should never land on the retired pool."""
+    monkeypatch.setattr(gerrit_utils, "_parallel_pool", None)
+    monkeypatch.setattr(gerrit_utils, "_parallel_size", 0)
+    errors = []
+
+    def caller(offset: int) -> None:
+        try:
+            for size in range(offset + 2, offset + 200, 8):
+                run_parallel([lambda: None] * 3, size)
+        except BaseException as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=caller, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    gerrit_utils._parallel_pool.shutdown()
+    assert errors == []
+
+
+def test_batch_pool_size(monkeypatch):
+    """--jobs should raise the configured pool size, never lower it."""
+    assert get_batch_pool_size(32) == 32
+    assert get_batch_pool_size(1) == gerrit_utils.DEFAULT_POOL_SIZE
+    monkeypatch.setenv("GERRIT_POOL_SIZE", "64")
+    assert get_batch_pool_size(32) == 64
+    assert get_pool_size(get_client("https://gerrit.example.com", pool_size=48)) == 48
+    monkeypatch.setenv("GERRIT_POOL_SIZE", "many")
+    assert get_batch_pool_size(32) is None
+
+
+# =============================================================================
+# Unit Tests for write rate limiting and retries
+# =============================================================================
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps: list[float] = []
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def test_token_bucket_limits_rate():
+    """A burst should pass at once, then writes wait for new tokens."""
+    clock = FakeClock()
+    bucket = TokenBucket(rate=2, burst=2, clock=clock, sleep=clock.sleep)
+    for _ in range(4):
+        bucket.acquire()
+    assert clock.sleeps == [0.5, 0.5]
+    clock.now += 10
+    bucket.acquire()
+    bucket.acquire()
+    assert clock.sleeps == [0.5, 0.5]
+
+
+def test_retry_policy_backs_off_with_jitter():
+    """Transient errors should be retried with capped, growing delays."""
+    sleeps: list[float] = []
+    calls = iter([TransientError("busy", 503), TransientError("busy", 429, retry_after=7),
+                  TransientError("busy", 503), "ok"])
+
+    def func():
+        result = next(calls)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    policy = RetryPolicy(retries=3, base_delay=1, max_delay=3, sleep=sleeps.append)
+    assert policy.call(func) == "ok"
+    assert 0 <= sleeps[0] <= 1
+    assert sleeps[1] == 3  # Retry-After, capped at max_delay
+    assert 0 <= sleeps[2] <= 3
+
+
+def test_retry_policy_gives_up():
+    """The last transient error should be raised once retries run out."""
+    def func():
+        raise TransientError("busy", 503)
+
+    with pytest.raises(TransientError):
+        RetryPolicy(retries=2, sleep=lambda s: None).call(func)
+
+
+def test_retry_policy_ambiguous_checked_before_retry():
+    """Ambiguous failures are retried only after the check finds nothing."""
+    attempts = []
+
+    def func():
+        attempts.append(1)
+        raise TransientError("timeout", ambiguous=True)
+
+    policy = RetryPolicy(retries=3, sleep=lambda s: None)
+    with pytest.raises(TransientError):
+        policy.call(func)
+    assert len(attempts) == 1
+    assert policy.call(func, on_ambiguous=lambda: "posted") == "posted"
+    assert len(attempts) == 2
@@ -0,0 +1,818 @@
+#!/usr/bin/env python3
+"""Tests for get_comments.py.
+
+Run with: pytest test_get_comments.py -v
+"""
+from __future__ import annotations
+
+import json
+import threading
+import time
+from datetime import datetime
+
+import pytest
+from hypothesis import given, settings, strategies as st
+
+import get_comments
+from fake_gerrit import FakeGerrit
+from gerrit_cache import ResponseCache
+from gerrit_utils import GerritError, get_client, get_request_count
+from test_fake_gerrit import COMMENTS
+
+
+CHANGE_DATA = {
+    "current_revision": "abc",
+    "revisions": {"abc": {"_number": 3}},
+}
+RAW_COMMENTS = {
+    "src/main.c": [
+        {"id": "c1", "line": 10, "patch_set": 1, "unresolved": True,
+         "author": {"name": "Alice"}, "message": "Fix this",
+         "updated": "2026-01-01 10:00:00.000000000"},
+        {"id": "c2", "in_reply_to": "c1", "patch_set": 2, "unresolved": True,
+         "author": {"name": "Bob"}, "message": "Why?",
+         "updated": "2026-01-02 10:00:00.000000000"},
+    ],
+    "src/util.c": [
+        {"id": "c3", "line": 3, "patch_set": 2, "unresolved": False,
+         "author": {"name": "Alice"}, "message": "Nit",
+         "updated": "2026-01-03 10:00:00.000000000"},
+    ],
+}
+ROUTES = {
+    "/a/changes/123": CHANGE_DATA,
+    "/a/changes/123/comments": RAW_COMMENTS,
+    "/a/changes/123/revisions/2/comments": {"src/util.c": RAW_COMMENTS["src/util.c"]},
+}
+
+
+def _fake_fetch(base_url, change_ref, revision=None, unresolved_only=True,
+                **kwargs):
+    if change_ref == "404":
+        raise GerritError("Change not found (404)")
+    return {
+        "threads": [{"file": f"{change_ref}.c"}],
+        "number": int(change_ref),
+        "latest_patchset": 1,
+        "watermark": kwargs.get("since") or "2026-01-01 00:00:00.000000000",
+    }
+
+
+@pytest.fixture
+def fake_gerrit(gerrit_env, monkeypatch):
+    monkeypatch.setattr(get_comments, "fetch_threads", _fake_fetch)
+
+
+# =============================================================================
+# Unit Tests for batch mode
+# =============================================================================
+
+def test_change_results_keep_input_order(fake_gerrit):
+    """Concurrent fetches should return results in input order."""
+    changes = [str(n) for n in range(20)]
+    results = get_comments.get_change_results(changes, jobs=4)
+    assert [r["change"] for r, _ in results] == changes
+    assert all(ok for _, ok in results)
+
+
+def test_change_results_report_failures_per_change(fake_gerrit):
+    """A failing change should not affect the other results."""
+    results = get_comments.get_change_results(["1", "404", "2"], jobs=3)
+    assert [ok for _, ok in results] == [True, False, True]
+    assert results[1][0]["error"]["message"] == "Change not found (404)"
+
+
+def test_main_single_change_output(fake_gerrit, capsys):
+    """A single --change should keep the single-change output shape."""
+    assert get_comments.main(["--change", "1"]) == 0
+    out = json.loads(capsys.readouterr().out)
+    assert out["change"] == "1"
+    assert out["thread_count"] == 1
+
+
+def test_main_batch_from_file(fake_gerrit, tmp_path, capsys):
+    """Changes file should skip blanks and comments and report failures."""
+    changes_file = tmp_path / "changes.txt"
+    changes_file.write_text("1\n\n# skipped\n404\n")
+    rc = get_comments.main(["--change", "2", "--changes-file", str(changes_file)])
+    out = json.loads(capsys.readouterr().out)
+    assert rc == 1
+    assert out["count"] == 3
+    assert out["failed"] == 1
+    assert [r["change"] for r in out["results"]] == ["2", "1", "404"]
+
+
+def test_main_ndjson_records(stub_client, capsys):
+    """NDJSON output should be a header record followed by thread lines."""
+    stub_client(ROUTES)
+    rc = get_comments.main(["--change", "123", "--change", "999", "--all",
+                            "--format", "ndjson"])
+    lines = capsys.readouterr().out.splitlines()
+    records = [json.loads(line) for line in lines]
+    assert rc == 1
+    by_type = {}
+    for record in records:
+        by_type.setdefault(record["type"], []).append(record)
+    assert by_type["change"][0]["thread_count"] == 2
+    assert "threads" not in by_type["change"][0]
+    assert [t["file"] for t in by_type["thread"]] == ["src/util.c", "src/main.c"]
+    assert all(t["change"] == "123" for t in by_type["thread"])
+    assert by_type["error"][0]["change"] == "999"
+    # Header comes before its threads
+    assert records.index(by_type["change"][0]) < records.index(by_type["thread"][0])
+
+
+# =============================================================================
+# Unit Tests for fetch_comments()
+# =============================================================================
+
+def test_fetch_comments_single_round_trip(stub_client):
+    """Detail and comments should take exactly two parallel requests."""
+    client = stub_client(ROUTES)
+    data = get_comments.fetch_comments("https://gerrit.example.com", "123",
+                                       client=client)
+    assert get_request_count(client) == 2
+    assert data["latest_patchset"] == 3
+    assert len(data["threads"]) == 1
+    thread = data["threads"][0]
+    assert thread["file"] == "src/main.c"
+    assert [c["id"] for c in thread["comments"]] == ["c1", "c2"]
+
+
+def test_fetch_comments_revision(stub_client):
+    """A revision should read the revision comments endpoint."""
+    client = stub_client(ROUTES)
+    data = get_comments.fetch_comments("https://gerrit.example.com", "123",
+                                       revision="2", unresolved_only=False,
+                                       client=client)
+    assert get_request_count(client) == 2
+    assert [t["file"] for t in data["threads"]] == ["src/util.c"]
+
+
+def test_fetch_comments_not_found(stub_client):
+    """A missing change should raise GerritError."""
+    with pytest.raises(GerritError, match="404"):
+        get_comments.fetch_comments("https://gerrit.example.com", "999",
+                                    client=stub_client(ROUTES))
+
+
+def test_fetch_comments_revalidates_cache(stub_client, tmp_path):
+    """Repeated fetches should be served from cache after a 304."""
+    client = stub_client(ROUTES)
+    cache = ResponseCache(str(tmp_path))
+    first = get_comments.fetch_comments("https://gerrit.example.com", "123",
+                                        client=client, cache=cache)
+    second = get_comments.fetch_comments("https://gerrit.example.com", "123",
+                                         client=client, cache=cache)
+    assert second == first
+    assert client.adapter.not_modified == 2
+
+
+def test_fetch_comments_since(stub_client):
+    """Only threads updated after since should be returned."""
+    client = stub_client(ROUTES)
+    data = get_comments.fetch_comments("https://gerrit.example.com", "123",
+                                       unresolved_only=False, client=client,
+                                       since="2026-01-02 10:00:00")
+    assert [t["file"] for t in data["threads"]] == ["src/util.c"]
+    assert data["watermark"] == "2026-01-03 10:00:00.000000000"
+
+
+def test_fetch_comments_watermark_never_regresses(stub_client):
+    """A since newer than every comment should be kept as watermark."""
+    client = stub_client(ROUTES)
+    data = get_comments.fetch_comments("https://gerrit.example.com", "123",
+                                       client=client, since="2027-01-01 00:00:00")
+    assert data["threads"] == []
+    assert data["watermark"] == "2027-01-01 00:00:00"
+
+
+def test_fetch_threads_history(stub_client):
+    """Threads should be dated by the patch set current at each comment."""
+    def comment(cid, reply_to, unresolved, updated):
+        return {"id": cid, "in_reply_to": reply_to, "patch_set": 1, "line": 1,
+                "unresolved": unresolved, "updated": f"2026-01-0{updated}.000000000"}
+
+    client = stub_client({
+        "/a/changes/7": {"current_revision": "r3", "revisions": {
+            "r1": {"_number": 1, "created": "2026-01-01 00:00:00.000000000"},
+            "r2": {"_number": 2, "created": "2026-01-01 12:00:00.000000000"},
+            "r3": {"_number": 3, "created": "2026-01-03 00:00:00.000000000"},
+        }},
+        "/a/changes/7/comments": {
+            "a.c": [comment("c1", None, True, "1 10:00:00"),
+                    comment("c2", "c1", True, "2 10:00:00"),
+                    comment("c4", "c2", False, "4 10:00:00")],
+            "b.c": [comment("c3", None, False, "3 10:00:00")],
+        },
+    })
+    data = get_comments.fetch_comments("https://gerrit.example.com", "7",
+                                       unresolved_only=False, client=client,
+                                       history=True)
+    assert get_request_count(client) == 2
+    history = {t["file"]: (t["opened_during"], t["replied_in"], t["resolved_in"])
+               for t in data["threads"]}
+    # b.c was opened on PS1, but during PS3
+    assert history == {"a.c": (1, [2, 3], 3), "b.c": (3, [], 3)}
+    assert [t["comments"][0]["patch_set"] for t in data["threads"]] == [1, 1]
+    assert [(d["patch_set"], d["opened"], d["replied"], d["resolved"],
+             d["unresolved"]) for d in data["patchsets"]] == [
+        (1, 1, 0, 0, 1),
+        (2, 0, 1, 0, 1),
+        (3, 1, 1, 1, 0),
+    ]
+
+    # Deltas cover resolved threads even when only unresolved ones are shown
+    shown = get_comments.fetch_comments("https://gerrit.example.com", "7",
+                                        client=client, history=True)
+    assert shown["threads"] == []
+    assert shown["patchsets"] == data["patchsets"]
+
+
+def test_main_state_file_roundtrip(stub_client, tmp_path, capsys):
+    """--state should feed the stored watermark back as since."""
+    stub_client(ROUTES)
+    state = tmp_path / "state.json"
+    argv = ["--change", "123", "--all", "--state", str(state)]
+    assert get_comments.main(argv) == 0
+    assert json.loads(capsys.readouterr().out)["thread_count"] == 2
+    assert json.loads(state.read_text()) == {"123": "2026-01-03 10:00:00.000000000"}
+
+    assert get_comments.main(argv) == 0
+    out = json.loads(capsys.readouterr().out)
+    assert out["since"] == "2026-01-03 10:00:00.000000000"
+    assert out["thread_count"] == 0
+
+
+def test_save_watermarks_temp_files(tmp_path, monkeypatch):
+    """State writes should use private temp files and leave none behind."""
+    state = tmp_path / "state.json"
+    get_comments._save_watermarks(str(state), {"1": "2026-01-01 10:00:00"})
+    get_comments._save_watermarks(str(state), {"2": "2026-01-02 10:00:00"})
+    assert json.loads(state.read_text()) == {"2": "2026-01-02 10:00:00"}
+
+    def fail(src, dst):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(get_comments.os, "replace", fail)
+    with pytest.raises(OSError):
+        get_comments._save_watermarks(str(state), {"3": "2026-01-03 10:00:00"})
+    assert [p.name for p in tmp_path.iterdir()] == ["state.json"]
+
+
+# =============================================================================
+# Unit Tests for watch mode
+# =============================================================================
+
+class FakeClock:
+    """Monotonic clock advanced only by sleep()."""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps: list[float] = []
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def test_watch_emits_new_and_updated_threads(stub_client):
+    """Watch should report new threads, then only changed ones."""
+    routes = json.loads(json.dumps(ROUTES))
+    client = stub_client(routes)
+    clock = FakeClock()
+    events: list[dict] = []
+
+    def on_poll(watermarks):
+        if len(events) == 1:
+            routes["/a/changes/123/comments"]["src/main.c"].append(
+                {"id": "c4", "in_reply_to": "c2", "patch_set": 3,
+                 "unresolved": True, "author": {"name": "Alice"},
+                 "message": "Because", "updated": "2026-01-04 10:00:00.000000000"})
+
+    get_comments.watch_changes(["123"], events.append, interval=10,
+                               max_interval=40, max_polls=4, on_poll=on_poll,
+                               sleep=clock.sleep, clock=clock)
+
+    assert [e["event"] for e in events] == ["new", "updated"]
+    assert [c.id for c in events[1]["thread"].comments] == ["c1", "c2", "c4"]
+    # Activity resets the interval, idle polls back off up to max_interval
+    assert clock.sleeps == [10, 10, 20]
+    assert get_request_count(client) == 8
+
+
+def test_watch_emits_resolved_threads(stub_client):
+    """A thread resolved meanwhile should be reported, not just dropped."""
+    routes = json.loads(json.dumps(ROUTES))
+    stub_client(routes)
+    clock = FakeClock()
+    events: list[dict] = []
+
+    # Resolve c1, then comment on it again, still resolved
+    replies = [
+        {"id": "c5", "in_reply_to": "c2", "patch_set": 3, "unresolved": False,
+         "author": {"name": "Alice"}, "message": "Done",
+         "updated": "2026-01-04 10:00:00.000000000"},
+        {"id": "c6", "in_reply_to": "c5", "patch_set": 3, "unresolved": False,
+         "author": {"name": "Bob"}, "message": "Thanks",
+         "updated": "2026-01-05 10:00:00.000000000"},
+    ]
+
+    def on_poll(watermarks):
+        if replies and len(events) == 3 - len(replies):
+            routes["/a/changes/123/comments"]["src/main.c"].append(replies.pop(0))
+
+    get_comments.watch_changes(["123"], events.append, interval=10,
+                               max_interval=40, max_polls=4, on_poll=on_poll,
+                               sleep=clock.sleep, clock=clock)
+
+    # c3 was resolved before watching started and is not reported; activity
+    # on the resolved c1 is an update
+    assert [(e["event"], e["thread"].root.id) for e in events] == [
+        ("new", "c1"), ("resolved", "c1"), ("updated", "c1")]
+    assert not events[1]["thread"].unresolved
+
+
+def test_watch_reports_errors_once(stub_client):
+    """Repeated identical failures should produce a single error event."""
+    stub_client(ROUTES)
+    clock = FakeClock()
+    events: list[dict] = []
+    get_comments.watch_changes(["999"], events.append, interval=1,
+                               max_interval=4, max_polls=3,
+                               sleep=clock.sleep, clock=clock)
+    assert [e["type"] for e in events] == ["error"]
+    assert clock.sleeps == [2, 4]
+
+
+# =============================================================================
+# Unit Tests for code context
+# =============================================================================
+
+CONTEXT_COMMENTS = {
+    "src/main.c": [
+        {"id": "m1", "line": 2, "message": "Near the top", "unresolved": True,
+         "patch_set": 1, "updated": "2026-01-02 10:00:00.000000000"},
+        {"id": "m2", "message": "Range", "unresolved": True, "patch_set": 1,
+         "range": {"start_line": 5, "start_character": 0,
+                   "end_line": 6, "end_character": 3},
+         "updated": "2026-01-02 11:00:00.000000000"},
+        {"id": "m3", "line": 12, "message": "Last line", "unresolved": True,
+         "patch_set": 2, "updated": "2026-01-02 12:00:00.000000000"},
+        {"id": "m4", "line": 4, "side": "PARENT", "message": "Old code",
+         "unresolved": True, "patch_set": 2,
+         "updated": "2026-01-02 13:00:00.000000000"},
+    ],
+    "/PATCHSET_LEVEL": [
+        {"id": "p1", "message": "Overall", "unresolved": True, "patch_set": 2,
+         "updated": "2026-01-02 14:00:00.000000000"},
+    ],
+}
+
+
+@pytest.fixture
+def context_server(gerrit_env):
+    with FakeGerrit() as server:
+        text = "".join(f"line {i}\n" for i in range(1, 13))
+        server.add_change(7, CONTEXT_COMMENTS, patchsets=2, files={"src/main.c": text})
+        yield server
+
+
+def _contexts(result: dict) -> dict[str, dict | None]:
+    return {t["comments"][0]["id"]: t.get("context") for t in result["threads"]}
+
+
+def test_fetch_comments_context(context_server, tmp_path):
+    """Threads should get clipped windows, fetching each file once per patch set."""
+    client = get_client(context_server.url)
+    result = get_comments.fetch_comments(context_server.url, "7", client=client,
+                                         context=2,
+                                         file_cache=ResponseCache(str(tmp_path)))
+    assert _contexts(result) == {
+        "p1": None,
+        "m4": None,
+        "m3": {"start_line": 10, "lines": ["line 10", "line 11", "line 12"]},
+        "m2": {"start_line": 3, "lines": [f"line {i}" for i in range(3, 9)]},
+        "m1": {"start_line": 1, "lines": ["line 1", "line 2", "line 3", "line 4"]},
+    }
+    # Change, comments, and src/main.c in patch sets 1 and 2
+    assert context_server.request_count() == 4
+
+    # Revision contents are immutable: cached files cost no request
+    context_server.reset_requests()
+    again = get_comments.fetch_comments(context_server.url, "7", client=client,
+                                        context=2,
+                                        file_cache=ResponseCache(str(tmp_path)))
+    assert again == result
+    assert context_server.request_count() == 2
+
+
+def test_fetch_comments_context_missing_file(context_server):
+    """A file that cannot be fetched should leave its threads without context."""
+    context_server.changes[7]["files"].clear()
+    result = get_comments.fetch_comments(context_server.url, "7", context=1,
+                                         client=get_client(context_server.url))
+    assert set(_contexts(result).values()) == {None}
+
+
+def test_main_context_server_error(context_server, monkeypatch, capsys):
+    """A server error on file content should only leave out the context."""
+    monkeypatch.setenv("GERRIT_BASE_URL", context_server.url)
+    context_server.fail("/content$", status=500, count=None)
+    assert get_comments.main(["--change", "7", "--context", "2"]) == 0
+    out = json.loads(capsys.readouterr().out)
+    assert out["thread_count"] == 5
+    assert set(_contexts(out).values()) == {None}
+
+
+def test_main_context_uses_file_cache(context_server, monkeypatch, tmp_path, capsys):
+    """--context should cache file contents even without --cache."""
+    monkeypatch.setenv("GERRIT_BASE_URL", context_server.url)
+    monkeypatch.setenv("GERRIT_CACHE_DIR", str(tmp_path))
+    assert get_comments.main(["--change", "7", "--context", "0"]) == 0
+    out = json.loads(capsys.readouterr().out)
+    assert _contexts(out)["m3"] == {"start_line": 12, "lines": ["line 12"]}
+    assert any(tmp_path.iterdir())
+
+    with pytest.raises(SystemExit):
+        get_comments.main(["--change", "7", "--context", "-1"])
+
+
+# =============================================================================
+# Unit Tests for remapping to the latest patch set
+# =============================================================================
+
+def _lines(*lines: str) -> str:
+    return "".join(f"{line}\n" for line in lines)
+
+
+OLD_MAIN = _lines(*(f"line {i}" for i in range(1, 11)))
+NEW_MAIN = _lines("added 1", "added 2", "line 1", "line 2", "line 3", "line 4",
+                  "line 5 changed", *(f"line {i}" for i in range(6, 11)))
+
+
+def _comment(cid: str, patch_set: int, **position) -> dict:
+    return {"id": cid, "patch_set": patch_set, "message": cid, "unresolved": True,
+            "updated": f"2026-01-02 10:00:0{cid[-1]}.000000000", **position}
+
+
+REMAP_COMMENTS = {
+    "main.c": [
+        _comment("t1", 1, line=8),
+        _comment("t2", 1, line=5),
+        _comment("t6", 3, line=1),
+        _comment("t7", 1, range={"start_line": 7, "start_character": 2,
+                                 "end_line": 8, "end_character": 4}),
+    ],
+    "old.c": [_comment("t3", 1, line=2)],
+    "gone.c": [_comment("t4", 1, line=1)],
+    "util.c": [_comment("t5", 2, line=3)],
+    "/PATCHSET_LEVEL": [_comment("t8", 1)],
+}
+
+
+@pytest.fixture
+def remap_server(gerrit_env):
+    with FakeGerrit() as server:
+        util = _lines("a", "b", "c")
+        server.add_change(9, REMAP_COMMENTS, patchsets=3, files={
+            "main.c": OLD_MAIN, "old.c": util, "gone.c": util, "util.c": util,
+        })
+        server.set_files(9, 3, {"main.c": NEW_MAIN, "new.c": util, "util.c": util},
+                         renamed={"new.c": "old.c"})
+        yield server
+
+
+def test_fetch_comments_remap(remap_server, tmp_path):
+    """Threads should get positions in the latest patch set from shared diffs."""
+    client = get_client(remap_server.url)
+
+    def fetch():
+        result = get_comments.fetch_comments(
+            remap_server.url, "9", client=client, remap=True,
+            file_cache=ResponseCache(str(tmp_path)))
+        return {t["comments"][0]["id"]: t.get("latest") for t in result["threads"]}
+
+    def at(line, exact=True, file="main.c"):
+        return {"patch_set": 3, "file": file, "line": line, "exact": exact}
+
+    latest = fetch()
+    assert latest == {
+        "t1": at(10),
+        "t2": at(7, exact=False),
+        "t3": at(2, file="new.c"),
+        "t4": {"patch_set": 3, "file": None, "line": None, "exact": False},
+        "t5": at(3, file="util.c"),
+        "t6": at(1),
+        "t7": {**at(None), "range": {"start_line": 9, "start_character": 2,
+                                     "end_line": 10, "end_character": 4}},
+        "t8": None,
+    }
+    # Change and comments, a file list per older patch set, and one diff
+    # each for main.c and the renamed new.c, shared by their threads
+    assert remap_server.request_count() == 6
+
+    remap_server.reset_requests()
+    assert fetch() == latest
+    assert remap_server.request_count() == 2
+
+
+def test_main_remap(remap_server, monkeypatch, tmp_path, capsys):
+    """--remap should add 'latest' to the threads of the output."""
+    monkeypatch.setenv("GERRIT_BASE_URL", remap_server.url)
+    monkeypatch.setenv("GERRIT_CACHE_DIR", str(tmp_path))
+    assert get_comments.main(["--change", "9", "--remap", "--context", "0"]) == 0
+    threads = json.loads(capsys.readouterr().out)["threads"]
+    by_id = {t["comments"][0]["id"]: t for t in threads}
+    assert by_id["t1"]["latest"]["line"] == 10
+    # Context still shows the lines the thread was written against
+    assert by_id["t1"]["context"]["lines"] == ["line 8"]
+
+
+def test_main_remap_server_error(remap_server, monkeypatch, capsys):
+    """A server error on a diff should only leave its threads without 'latest'."""
+    monkeypatch.setenv("GERRIT_BASE_URL", remap_server.url)
+    remap_server.fail("/diff$", status=503, count=None)
+    assert get_comments.main(["--change", "9", "--remap"]) == 0
+    threads = json.loads(capsys.readouterr().out)["threads"]
+    latest = {t["comments"][0]["id"]: t.get("latest") for t in threads}
+    # main.c and the renamed new.c need diffs, the others do not
+    assert [cid for cid, position in sorted(latest.items()) if position is None] == [
+        "t1", "t2", "t3", "t7", "t8"]
+
+
+# =============================================================================
+# Unit Tests for query mode
+# =============================================================================
+
+RESOLVED = {"src/a.c": [{"id": "r1", "line": 1, "message": "Done",
+                         "unresolved": False,
+                         "updated": "2026-01-02 10:00:00.000000000"}]}
+
+
+@pytest.fixture
+def search_server(gerrit_env, monkeypatch):
+    """Fake Gerrit with changes 1-5; 2 and 4 have no unresolved threads."""
+    with FakeGerrit() as server:
+        for number in range(1, 6):
+            server.add_change(number, RESOLVED if number % 2 == 0 else COMMENTS,
+                              patchsets=2)
+        monkeypatch.setenv("GERRIT_BASE_URL", server.url)
+        yield server
+
+
+def test_query_changes_pages_through_results(search_server):
+    """The search should be read page by page until _more_changes ends."""
+    client = get_client(search_server.url)
+    changes = list(get_comments.iter_query_changes(client, "is:open", page_size=2))
+    assert [c["_number"] for c in changes] == [5, 4, 3, 2, 1]
+    assert search_server.request_count() == 3
+
+
+def test_query_skips_changes_without_unresolved_comments(search_server):
+    """Changes with zero unresolved comments should not be fetched."""
+    skipped = []
+    results = list(get_comments.iter_query_results(
+        "is:open", jobs=2, page_size=2, on_skip=skipped.append))
+    assert sorted(r["change"] for r, _ in results) == ["1", "3", "5"]
+    assert all(ok and r["thread_count"] == 1 for r, ok in results)
+    assert [c["_number"] for c in skipped] == [4, 2]
+    # 3 search pages plus change and comments of each fetched change
+    assert search_server.request_count() == 3 + 2 * 3
+
+
+def test_query_results_written_while_searching(search_server, monkeypatch):
+    """A finished change should be yielded before the search goes on."""
+    client = get_client(search_server.url)
+    infos = list(get_comments.iter_query_changes(client, "is:open"))
+    fetched, consumed = threading.Event(), threading.Event()
+    fetch = get_comments.get_change_result
+
+    def get_change_result(*args, **kwargs):
+        result = fetch(*args, **kwargs)
+        fetched.set()
+        return result
+
+    def slow_search(client, query, page_size):
+        yield infos[0]
+        assert fetched.wait(5)
+        time.sleep(0.1)
+        yield infos[1]
+        # A slow next page: change 5 must already be out
+        assert consumed.wait(5)
+
+    monkeypatch.setattr(get_comments, "get_change_result", get_change_result)
+    monkeypatch.setattr(get_comments, "iter_query_changes", slow_search)
+    results = get_comments.iter_query_results("is:open", jobs=4)
+    assert next(results)[0]["change"] == "5"
+    consumed.set()
+    assert list(results) == []
+
+
+def test_main_query_json_streamed(search_server, capsys):
+    """--query should write one valid document with counts at the end."""
+    assert get_comments.main(["--query", "is:open", "--all", "--page-size", "2"]) == 0
+    out = json.loads(capsys.readouterr().out)
+    assert out["query"] == "is:open"
+    assert (out["count"], out["failed"], out["skipped"]) == (5, 0, 0)
+    assert sorted(r["change"] for r in out["results"]) == ["1", "2", "3", "4", "5"]
+
+
+def test_main_query_ndjson_and_errors(search_server, capsys):
+    """A failing search should end the stream with an error summary."""
+    assert get_comments.main(["--query", "is:open", "--format", "ndjson"]) == 0
+    records = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert [r["type"] for r in records].count("change") == 3
+    assert records[-1] == {"type": "query", "query": "is:open",
+                           "count": 3, "failed": 0, "skipped": 2}
+
+    assert get_comments.main(["--query", "bogus:x"]) == 1
+    out = json.loads(capsys.readouterr().out)
+    assert out["results"] == [] and out["count"] == 0
+    assert "400" in out["error"]["message"]
+
+
+def test_main_query_usage_errors(gerrit_env, capsys):
+    """--query should exclude explicit changes and --watch."""
+    for argv in (["--query", "is:open", "--change", "1"],
+                 ["--query", "is:open", "--watch"],
+                 ["--query", " "]):
+        with pytest.raises(SystemExit) as exc:
+            get_comments.main(argv)
+        assert exc.value.code == 2
+
+
+# =============================================================================
+# Unit Tests for output shaping
+# =============================================================================
+
+def test_parse_fields():
+    """Comment fields should imply 'comments', a bare 'comments' all fields."""
+    assert get_comments.parse_fields("file, line") == ({"file", "line"}, set())
+    assert get_comments.parse_fields("file,comments.message") == (
+        {"file", "comments"}, {"message"})
+    assert get_comments.parse_fields("comments")[1] == set(get_comments.COMMENT_FIELDS)
+    for spec in ("", "bogus", "comments.bogus", "file.line"):
+        with pytest.raises(ValueError):
+            get_comments.parse_fields(spec)
+
+
+def test_main_fields_and_truncation(stub_client, capsys):
+    """--fields and --max-message-chars should shape every thread."""
+    stub_client(ROUTES)
+    assert get_comments.main(["--change", "123", "--all", "--fields",
+                              "file,unresolved,comments.author,comments.message",
+                              "--max-message-chars", "3"]) == 0
+    out = json.loads(capsys.readouterr().out)
+    assert out["threads"] == [
+        {"file": "src/util.c", "unresolved": False,
+         "comments": [{"author": "Alice", "message": "Nit"}]},
+        {"file": "src/main.c", "unresolved": True,
+         "comments": [{"author": "Alice", "message": "Fix…"},
+                      {"author": "Bob", "message": "Why…"}]},
+    ]
+
+    assert get_comments.main(["--change", "123", "--fields", "file,line",
+                              "--format", "ndjson"]) == 0
+    records = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert records[1] == {"type": "thread", "change": "123",
+                          "file": "src/main.c", "line": 10}
+
+
+def test_main_compact_size_report(stub_client, capsys):
+    """--compact should write one line; --size-report should measure it."""
+    stub_client(ROUTES)
+    assert get_comments.main(["--change", "123", "--compact", "--size-report"]) == 0
+    captured = capsys.readouterr()
+    assert captured.out.count("\n") == 1
+    data = json.loads(captured.out)
+    assert captured.out == json.dumps(data, ensure_ascii=False,
+                                      separators=(",", ":")) + "\n"
+    report = json.loads(captured.err)
+    assert report["type"] == "size_report"
+    assert report["bytes"] == len(captured.out.encode("utf-8"))
+    assert report["tokens_estimate"] == -(-report["bytes"] // 4)
+
+
+@pytest.mark.parametrize("compact", [False, True])
+def test_main_query_streamed_like_json_dump(search_server, capsys, compact):
+    """The streamed --query document should match json.dump() byte for byte."""
+    argv = ["--query", "is:open", "--fields", "file,comments.message"]
+    assert get_comments.main(argv + (["--compact"] if compact else [])) == 0
+    out = capsys.readouterr().out
+    layout = {"separators": (",", ":")} if compact else {"indent": 2}
+    assert out == json.dumps(json.loads(out), ensure_ascii=False, **layout) + "\n"
+
+
+def test_main_output_usage_errors(gerrit_env, tmp_path):
+    """Bad --fields or limits, or shaping --index input, should be rejected."""
+    for argv in (["--fields", "bogus"], ["--max-message-chars", "0"],
+                 ["--fields", "file", "--index", str(tmp_path / "db")]):
+        with pytest.raises(SystemExit) as exc:
+            get_comments.main(["--change", "1", *argv])
+        assert exc.value.code == 2
+
+
+# =============================================================================
+# Property Tests for timestamp_key()
+# =============================================================================
+
+timestamp_strategy = st.one_of(
+    st.none(),
+    st.datetimes(min_value=datetime(1970, 1, 1)).map(
+        lambda d: d.strftime("%Y-%m-%d %H:%M:%S.%f") + "000"
+    ),
+    st.datetimes().map(lambda d: d.strftime("%Y-%m-%d %H:%M:%S")),
+    st.text(alphabet="0123456789-: .TZ", max_size=30),
+)
+
+
+@settings(max_examples=300)
+@given(timestamp_strategy, timestamp_strategy)
+def test_timestamp_key_orders_like_parse(a: str | None, b: str | None):
+    """timestamp_key() SHALL order timestamps exactly like
+    parse_gerrit_timestamp(), including invalid values."""
+    ta, tb = get_comments.parse_gerrit_timestamp(a), get_comments.parse_gerrit_timestamp(b)
+    ka, kb = get_comments.timestamp_key(a), get_comments.timestamp_key(b)
+    assert (ka < kb) == (ta < tb)
+    assert (ka == kb) == (ta == tb)
+
+
+# =============================================================================
+# Property Tests for thread reconstruction
+# =============================================================================
+
+def _naive_root(c: dict, by_id: dict[str, dict]) -> str:
+    """Reference root lookup: walk the whole reply chain for one comment."""
+    root = c["id"]
+    seen: set[str] = set()
+    cur = c
+    while True:
+        in_reply_to = cur.get("in_reply_to")
+        if not in_reply_to or in_reply_to in seen:
+            break
+        seen.add(in_reply_to)
+        parent = by_id.get(in_reply_to)
+        root = in_reply_to
+        if not parent:
+            break
+        cur = parent
+    return root
+
+
+# Each comment replies to nothing, to another comment (cycles and self
+# replies included), or to a comment missing from the change
+reply_graph_strategy = st.integers(min_value=1, max_value=30).flatmap(
+    lambda n: st.lists(
+        st.one_of(
+            st.none(),
+            st.integers(min_value=0, max_value=n - 1).map(str),
+            st.sampled_from(["gone1", "gone2"]),
+        ),
+        min_size=n,
+        max_size=n,
+    )
+)
+
+
+@settings(max_examples=300)
+@given(reply_graph_strategy)
+def test_resolve_thread_roots_matches_naive_walk(in_reply_to: list[str | None]):
+    """Memoized root resolution SHALL match walking every reply chain,
+    including orphans and reply cycles."""
+    comments = [{"id": str(i), "in_reply_to": p} for i, p in enumerate(in_reply_to)]
+    by_id = {c["id"]: c for c in comments}
+    roots = get_comments.resolve_thread_roots(
+        {c["id"]: c["in_reply_to"] for c in comments}
+    )
+    expected = {c["id"]: _naive_root(c, by_id) for c in comments}
+    assert roots == expected
+
+    threads = get_comments.build_threads_by_reply_chain({"f.c": comments}, by_id)
+    assert {c["id"]: root for root, items in threads.items() for c in items} == expected
+
+    # collect_threads() is what get_comments.py runs: same grouping
+    groups: dict[str, set[str]] = {}
+    for cid, root in expected.items():
+        groups.setdefault(root, set()).add(cid)
+    collected, _ = get_comments.collect_threads(
+        {"f.c": [dict(c) for c in comments]}, unresolved_only=False)
+    assert sorted(sorted(c.id for c in t.comments) for t in collected) == sorted(
+        sorted(ids) for ids in groups.values())
+
+
+def test_build_threads_deep_chain():
+    """A 50k deep reply chain should resolve to one thread."""
+    n = 50_000
+    comments = [{"id": "0"}] + [
+        {"id": str(i), "in_reply_to": str(i - 1)} for i in range(1, n)
+    ]
+    raw = {"f.c": comments}
+    threads = get_comments.build_threads_by_reply_chain(
+        raw, {c["id"]: c for c in comments}
+    )
+    assert list(threads) == ["0"]
+    assert len(threads["0"]) == n
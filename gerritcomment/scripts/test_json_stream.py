@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""Tests for json_stream.py.
+
+Run with: pytest test_json_stream.py -v
+"""
+from __future__ import annotations
+
+import json
+
+import pytest
+from hypothesis import given, strategies as st
+
+from json_stream import iter_keyed_items
+
+
+def _flatten(data: dict) -> list[tuple[str, object]]:
+    return [(key, item) for key, items in data.items() for item in items]
+
+
+def _split(text: str, cuts: list[int]) -> list[str]:
+    bounds = [0, *sorted(cut % (len(text) + 1) for cut in cuts), len(text)]
+    return [text[a:b] for a, b in zip(bounds, bounds[1:])]
+
+
+# =============================================================================
+# Unit Tests for iter_keyed_items
+# =============================================================================
+
+def test_iter_keyed_items_with_prefix():
+    """The XSSI prefix should be skipped and items yielded per key."""
+    text = ')]}\'\n{"a.c": [{"id": 1}, {"id": 2}], "b.c": [], "c.c": [3]}'
+    assert list(iter_keyed_items([text])) == [
+        ("a.c", {"id": 1}), ("a.c", {"id": 2}), ("c.c", 3),
+    ]
+
+
+def test_iter_keyed_items_number_split_across_chunks():
+    """A number cut at a chunk boundary should not be decoded early."""
+    assert list(iter_keyed_items(['{"a": [12', '34]}'])) == [("a", 1234)]
+
+
+@pytest.mark.parametrize("text", [
+    "",
+    "[]",
+    '{"a": {}}',
+    '{"a": [1 2]}',
+    '{"a": [1]',
+    '{"a": [1]} x',
+])
+def test_iter_keyed_items_rejects_invalid(text):
+    """Malformed input should raise ValueError."""
+    with pytest.raises(ValueError):
+        list(iter_keyed_items([text]))
+
+
+JSON_VALUES = st.recursive(
+    st.none() | st.booleans() | st.integers() | st.text(max_size=5),
+    lambda children: st.lists(children, max_size=3)
+    | st.dictionaries(st.text(max_size=3), children, max_size=3),
+    max_leaves=8,
+)
+
+
+@given(
+    data=st.dictionaries(st.text(max_size=4), st.lists(JSON_VALUES, max_size=4), max_size=4),
+    cuts=st.lists(st.integers(min_value=0), max_size=20),
+    indent=st.sampled_from([None, 2]),
+    prefix=st.booleans(),
+)
+def test_iter_keyed_items_any_chunking(data, cuts, indent, prefix):
+    """Any split of the text should yield the same items as json.loads()."""
+    text = (")]}'\n" if prefix else "") + json.dumps(data, indent=indent)
+    assert list(iter_keyed_items(_split(text, cuts))) == _flatten(data)
@@ -6,16 +6,30 @@ Run with: pytest test_post_comment.py -v
 """
 from __future__ import annotations
 
+import base64
+import json
+import time
+
 import pytest
+import requests
 from hypothesis import given, strategies as st, settings
 
+import post_comment
+from fake_gerrit import FakeGerrit
 from post_comment import (
     build_review_input,
     build_comment_input,
     format_success_output,
     format_error_output,
+    parse_manifest_record,
+    post_review,
+    find_comment_problems,
+    post_review_chunked,
+    split_review_input,
+    validate_review,
 )
-from gerrit_utils import GerritError
+from gerrit_cache import ResponseCache
+from gerrit_utils import GerritError, RetryPolicy, ValidationError, get_request_count
 
 
 # =============================================================================
@@ -428,3 +442,364 @@ def test_batch_comments_partial_structure():
     assert "tag" not in result
     assert "labels" not in result
     assert "comments" in result
+
+
+# =============================================================================
+# Unit Tests for bulk posting
+# =============================================================================
+
+def test_manifest_record_parsed():
+    """A manifest record should yield change, revision and review."""
+    text = '{"change": 123, "revision": 2, "review": {"message": "ok"}}'
+    assert parse_manifest_record(text) == ("123", "2", {"message": "ok"})
+
+
+@pytest.mark.parametrize("text", [
+    "not json",
+    "[]",
+    '{"review": {}}',
+    '{"change": "1"}',
+    '{"change": "1", "review": "LGTM"}',
+])
+def test_manifest_record_invalid(text: str):
+    """Invalid manifest records should raise GerritError."""
+    with pytest.raises(GerritError):
+        parse_manifest_record(text)
+
+
+def test_main_manifest_streams_results(gerrit_env, monkeypatch, tmp_path, capsys):
+    """Each record should get one result line; failures set the exit code."""
+    posted = []
+
+    def fake_post_review(base_url, change_ref, revision, review_input, client=None,
+                         **kwargs):
+        if change_ref == "404":
+            raise GerritError("Change not found (404)")
+        posted.append((change_ref, revision, review_input))
+        return {"labels": review_input.get("labels", {})}
+
+    monkeypatch.setattr(post_comment, "post_review", fake_post_review)
+    manifest = tmp_path / "manifest.jsonl"
+    manifest.write_text(
+        '{"change": "1", "review": {"message": "Build passed"}}\n'
+        "\n"
+        '{"change": "2", "revision": "abc", "review": {"labels": {"Verified": 1}}}\n'
+        '{"change": "404", "review": {}}\n'
+        "{oops\n"
+    )
+    assert post_comment.main(["--manifest", str(manifest), "--jobs", "2"]) == 1
+
+    lines = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    by_line = {r["line"]: r for r in lines}
+    assert sorted(by_line) == [1, 3, 4, 5]
+    assert by_line[1]["success"] is True
+    assert by_line[3] == {"line": 3, "change": "2", "revision": "abc",
+                          "success": True, "response": {"labels": {"Verified": 1}}}
+    assert by_line[4]["error"]["message"] == "Change not found (404)"
+    assert by_line[5]["change"] is None
+    assert sorted(p[0] for p in posted) == ["1", "2"]
+
+
+def test_main_manifest_preflight_server_error(gerrit_env, monkeypatch,
+                                              tmp_path, capsys):
+    """A server error during preflight should fail its record, not the run."""
+    with FakeGerrit() as server:
+        server.add_change(1, {"src/main.c": [{"id": "c1", "line": 1,
+                                              "message": "x"}]})
+        server.add_change(2)
+        server.fail("/content$", status=500, count=None)
+        monkeypatch.setenv("GERRIT_BASE_URL", server.url)
+        manifest = tmp_path / "manifest.jsonl"
+        comments = {"src/main.c": [{"line": 1, "message": "y"}]}
+        manifest.write_text(
+            json.dumps({"change": "1", "review": {"comments": comments}}) + "\n"
+            + json.dumps({"change": "2", "review": {"message": "ok"}}) + "\n"
+        )
+        assert post_comment.main(["--manifest", str(manifest), "--preflight"]) == 1
+
+    by_line = {r["line"]: r for r in map(json.loads,
+                                         capsys.readouterr().out.splitlines())}
+    assert "500" in by_line[1]["error"]["message"]
+    assert by_line[2]["success"] is True
+
+
+# =============================================================================
+# Unit Tests for write retries
+# =============================================================================
+
+REVIEW_PATH = "/a/changes/1/revisions/current/review"
+NO_WAIT = RetryPolicy(retries=3, sleep=lambda s: None)
+
+
+def _responses(*outcomes):
+    """Route answering each request with the next outcome."""
+    outcomes = iter(outcomes)
+
+    def route(request):
+        outcome = next(outcomes)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    return route
+
+
+def test_post_review_retries_throttling(stub_client):
+    """429 and 503 should be retried until the review is accepted."""
+    client = stub_client({REVIEW_PATH: _responses(
+        (429, "slow down"), (503, "busy"), (200, {"labels": {"Verified": 1}}),
+    )})
+    result = post_review("https://gerrit.example.com", "1", None,
+                         {"labels": {"Verified": 1}}, client=client, retry=NO_WAIT)
+    assert result == {"labels": {"Verified": 1}}
+    assert client.adapter.paths.count(REVIEW_PATH) == 3
+
+
+def test_post_review_final_error_not_retried(stub_client):
+    """Errors other than transient ones should fail at once."""
+    client = stub_client({REVIEW_PATH: _responses((409, "edit"))})
+    with pytest.raises(GerritError, match="409"):
+        post_review("https://gerrit.example.com", "1", None, {}, client=client,
+                    retry=NO_WAIT)
+
+
+def test_post_review_timeout_deduplicated(stub_client):
+    """A tagged review applied despite a timeout should not be posted again."""
+    now = post_comment._gerrit_time(time.time())
+    client = stub_client({
+        REVIEW_PATH: _responses(requests.ReadTimeout("read timed out")),
+        "/a/changes/1/messages": [
+            {"tag": "autogenerated:ci", "date": now,
+             "message": "Patch Set 1: Verified+1\n\nBuild passed"},
+        ],
+    })
+    review = {"tag": "autogenerated:ci", "message": "Build passed",
+              "labels": {"Verified": 1}}
+    result = post_review("https://gerrit.example.com", "1", None, review,
+                         client=client, retry=NO_WAIT)
+    assert result == {"deduplicated": True}
+    assert client.adapter.paths.count(REVIEW_PATH) == 1
+
+
+def test_post_review_partial_comment_match_retried(stub_client):
+    """Another review's tagged comments must not mask an unposted one."""
+    now = post_comment._gerrit_time(time.time())
+    client = stub_client({
+        REVIEW_PATH: _responses(requests.ReadTimeout("read timed out"), (200, {})),
+        "/a/changes/1/comments": {"a.c": [
+            {"tag": "autogenerated:lint", "line": 1, "message": "nit", "updated": now},
+        ]},
+    })
+    review = {"tag": "autogenerated:lint", "comments": {
+        "a.c": [{"line": 1, "message": "nit"}, {"line": 2, "message": "nit"}],
+    }}
+    post_review("https://gerrit.example.com", "1", None, review, client=client,
+                retry=NO_WAIT)
+    assert client.adapter.paths.count(REVIEW_PATH) == 2
+
+
+def test_post_review_labels_only_matches_votes(stub_client):
+    """A review without message should only match a message with its votes."""
+    now = post_comment._gerrit_time(time.time())
+    client = stub_client({
+        REVIEW_PATH: _responses(requests.ReadTimeout("read timed out"), (200, {})),
+        "/a/changes/1/messages": [
+            {"tag": "autogenerated:ci", "date": now,
+             "message": "Patch Set 1: Verified-1\n\nBuild failed"},
+        ],
+    })
+    review = {"tag": "autogenerated:ci", "labels": {"Verified": 1}}
+    post_review("https://gerrit.example.com", "1", None, review, client=client,
+                retry=NO_WAIT)
+    assert client.adapter.paths.count(REVIEW_PATH) == 2
+
+    client.adapter.routes["/a/changes/1/messages"].append(
+        {"tag": "autogenerated:ci", "date": now, "message": "Patch Set 1: Verified+1"})
+    client.adapter.routes[REVIEW_PATH] = _responses(requests.ReadTimeout("timed out"))
+    result = post_review("https://gerrit.example.com", "1", None, review,
+                         client=client, retry=NO_WAIT)
+    assert result == {"deduplicated": True}
+
+
+def test_post_review_empty_review_never_matches(stub_client):
+    """A review with no message, votes or comments must not match anything."""
+    now = post_comment._gerrit_time(time.time())
+    client = stub_client({"/a/changes/1/messages": [
+        {"tag": "autogenerated:ci", "date": now, "message": "Patch Set 1: Verified+1"},
+    ]})
+    assert post_comment.find_posted_review(
+        client, "1", {"tag": "autogenerated:ci", "message": "  "}, time.time()) is None
+
+
+def test_post_review_untagged_timeout_not_retried(stub_client):
+    """An untagged review cannot be deduplicated, so it is not retried."""
+    client = stub_client({REVIEW_PATH: _responses(requests.ReadTimeout("timed out"))})
+    with pytest.raises(GerritError, match="timed out"):
+        post_review("https://gerrit.example.com", "1", None, {"message": "hi"},
+                    client=client, retry=NO_WAIT)
+    assert client.adapter.paths.count(REVIEW_PATH) == 1
+
+
+# =============================================================================
+# Property Tests for review chunking
+# =============================================================================
+
+@settings(max_examples=100)
+@given(
+    comments=st.dictionaries(
+        st.text(min_size=1, max_size=10),
+        st.lists(st.fixed_dictionaries({
+            "line": st.integers(min_value=1, max_value=10_000),
+            "message": st.text(max_size=50),
+        }), min_size=1, max_size=20),
+        max_size=5,
+    ),
+    max_comments=st.integers(min_value=1, max_value=10),
+)
+def test_split_review_input_keeps_every_comment(comments: dict, max_comments: int):
+    """Chunks SHALL hold every comment once, in order, within the limits,
+    with the message and labels on the first chunk only."""
+    review = {"message": "Analysis", "tag": "autogenerated:lint",
+              "labels": {"Code-Review": -1}, "comments": comments}
+    chunks = split_review_input(review, max_bytes=2_000, max_comments=max_comments)
+
+    flat = [(p, c) for chunk in chunks for p, items in chunk.get("comments", {}).items()
+            for c in items]
+    assert flat == [(p, c) for p, items in comments.items() for c in items]
+    for chunk in chunks:
+        assert sum(len(v) for v in chunk.get("comments", {}).values()) <= max_comments
+        assert chunk["tag"] == "autogenerated:lint"
+    assert chunks[0]["labels"] == {"Code-Review": -1}
+    for chunk in chunks[1:]:
+        assert "message" not in chunk and "labels" not in chunk
+        assert chunk["notify"] == "NONE"
+
+
+def test_split_review_input_small_review_unchanged():
+    """A review within the limits should not be split."""
+    review = {"message": "LGTM", "comments": {"a.c": [{"line": 1, "message": "x"}]}}
+    assert split_review_input(review) == [review]
+
+
+# =============================================================================
+# Unit Tests for chunked posting
+# =============================================================================
+
+def _lint_review(count: int) -> dict:
+    return {"message": "Analysis", "tag": "autogenerated:lint",
+            "comments": {"a.c": [{"line": i, "message": "nit"} for i in range(1, count + 1)]}}
+
+
+def test_post_review_chunked_reports_each_chunk(stub_client):
+    """Chunks should be posted separately, with a status per chunk."""
+    bodies = []
+
+    def route(request):
+        body = json.loads(request.body)
+        bodies.append(body)
+        if body["comments"]["a.c"][0]["line"] == 3:
+            return 400, "invalid line"
+        return 200, {"chunk": len(bodies)}
+
+    client = stub_client({REVIEW_PATH: route})
+    with pytest.raises(post_comment.PartialReviewError) as excinfo:
+        post_review_chunked("https://gerrit.example.com", "1", None, _lint_review(5),
+                            client=client, max_comments=2, retry=NO_WAIT)
+    assert bodies[0]["message"] == "Analysis"
+    assert [(s["chunk"], s["comments"], "error" in s) for s in excinfo.value.chunks] == [
+        (1, 2, False), (2, 2, True), (3, 1, False),
+    ]
+    output = format_error_output("1", None, excinfo.value)
+    assert output["error"]["message"] == "1 of 3 chunks failed"
+    assert output["chunks"] == excinfo.value.chunks
+
+
+def test_post_review_chunked_stops_when_first_chunk_fails(stub_client):
+    """Comment chunks should not be posted if the message and votes fail."""
+    client = stub_client({REVIEW_PATH: _responses((403, "no permission"))})
+    with pytest.raises(post_comment.PartialReviewError) as excinfo:
+        post_review_chunked("https://gerrit.example.com", "1", None, _lint_review(5),
+                            client=client, max_comments=2, retry=NO_WAIT)
+    assert client.adapter.paths.count(REVIEW_PATH) == 1
+    assert [s["error"]["message"] for s in excinfo.value.chunks][1:] == [
+        "Not posted: the first chunk failed"] * 2
+
+
+def test_post_review_chunked_single_chunk_shape(stub_client):
+    """A small review should keep the unchunked output."""
+    client = stub_client({REVIEW_PATH: _responses((200, {"labels": {}}))})
+    response, chunks = post_review_chunked("https://gerrit.example.com", "1", None,
+                                           _lint_review(2), client=client)
+    assert chunks is None
+    assert format_success_output("1", None, response) == {
+        "change": "1", "revision": "current", "success": True,
+        "response": {"labels": {}},
+    }
+
+
+# =============================================================================
+# Unit Tests for preflight validation
+# =============================================================================
+
+SHA = "a" * 40
+FILES = {"/COMMIT_MSG": {}, "src/main.c": {}, "src/old.c": {"status": "D"}}
+
+
+def test_find_comment_problems_reports_all():
+    """Every bad path, line and range should be reported in one pass."""
+    comments = {
+        "src/main.c": [
+            {"line": 3, "message": "ok"},
+            {"line": 11, "message": "past the end"},
+            {"line": 0, "message": "bad line"},
+            {"range": {"start_line": 5, "start_character": 0,
+                       "end_line": 4, "end_character": 0}, "message": "backwards"},
+            {"line": 11, "side": "PARENT", "message": "parent lines not checked"},
+        ],
+        "src/missing.c": [{"line": 1, "message": "no such file"}],
+        "/PATCHSET_LEVEL": [{"line": 1, "message": "no lines here"}],
+    }
+    problems = find_comment_problems(comments, FILES, {"src/main.c": 10})
+    assert [(p["path"], p["index"]) for p in problems] == [
+        ("src/main.c", 1), ("src/main.c", 2), ("src/main.c", 3),
+        ("src/missing.c", 0), ("/PATCHSET_LEVEL", 0),
+    ]
+    assert "10 lines" in problems[0]["problem"]
+
+
+def test_validate_review_cached_by_sha(stub_client, tmp_path):
+    """Preflight data should be fetched once, then served from cache."""
+    revision = f"/a/changes/1/revisions/{SHA}"
+    client = stub_client({
+        "/a/changes/1": {"current_revision": SHA,
+                         "revisions": {SHA: {"_number": 2}}},
+        f"{revision}/files": FILES,
+        f"{revision}/files/src%2Fmain.c/content": base64.b64encode(b"a\nb\nc\n"),
+    })
+    cache = ResponseCache(str(tmp_path))
+    good = {"comments": {"src/main.c": [{"line": 3, "message": "ok"}]}}
+    bad = {"comments": {"src/main.c": [{"line": 4, "message": "too far"}],
+                        "src/old.c": [{"line": 1, "message": "deleted"}]}}
+
+    assert validate_review(client, "1", "2", good, cache) == SHA
+    assert get_request_count(client) == 3
+    with pytest.raises(ValidationError) as excinfo:
+        validate_review(client, "1", None, bad, cache)
+    # Only the change itself is revalidated, files and content are immutable
+    assert get_request_count(client) == 4
+    assert [p["path"] for p in excinfo.value.problems] == ["src/main.c", "src/old.c"]
+    assert format_error_output("1", None, excinfo.value)["problems"] == excinfo.value.problems
+
+
+def test_preflight_blocks_posting(stub_client):
+    """Nothing should be posted when the preflight check fails."""
+    client = stub_client({
+        "/a/changes/1": {"current_revision": SHA, "revisions": {SHA: {"_number": 1}}},
+        f"/a/changes/1/revisions/{SHA}/files": FILES,
+        REVIEW_PATH: _responses((200, {})),
+    })
+    review = {"comments": {"src/missing.c": [{"line": 1, "message": "x"}]}}
+    with pytest.raises(ValidationError):
+        post_review_chunked("https://gerrit.example.com", "1", None, review,
+                            client=client, preflight=True)
+    assert REVIEW_PATH not in client.adapter.paths
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""Tests for search_comments.py.
+
+Run with: pytest test_search_comments.py -v
+"""
+from __future__ import annotations
+
+import json
+
+import pytest
+
+import search_comments
+from comment_index import CommentIndex
+
+
+@pytest.fixture
+def db(tmp_path):
+    path = str(tmp_path / "comments.sqlite")
+    with CommentIndex(path) as index:
+        index.sync("https://gerrit.example.com", {
+            "change": "7",
+            "latest_patchset": 1,
+            "watermark": "2026-01-01 10:00:00.000000000",
+            "threads": [{
+                "file": "src/main.c", "range": None, "line": 3,
+                "unresolved": True, "updated": "2026-01-01 10:00:00.000000000",
+                "comments": [{"id": "x", "in_reply_to": None, "patch_set": 1,
+                              "author": "Alice", "message": "Check the bounds",
+                              "updated": "2026-01-01 10:00:00.000000000",
+                              "unresolved": True}],
+            }],
+        })
+    return path
+
+
+# =============================================================================
+# Tests for main()
+# =============================================================================
+
+def test_search_json(db, capsys):
+    """Matches should be printed as one JSON document."""
+    assert search_comments.main(["--index", db, "--text", "bounds",
+                                 "--unresolved"]) == 0
+    out = json.loads(capsys.readouterr().out)
+    assert out["count"] == 1
+    assert out["threads"][0]["change"] == "7"
+    assert out["threads"][0]["comments"][0]["author"] == "Alice"
+
+
+def test_search_ndjson_no_match(db, capsys):
+    """ndjson should print one line per thread, none without matches."""
+    assert search_comments.main(["--index", db, "--format", "ndjson"]) == 0
+    lines = capsys.readouterr().out.splitlines()
+    assert [json.loads(line)["type"] for line in lines] == ["thread"]
+    assert search_comments.main(["--index", db, "--resolved",
+                                 "--format", "ndjson"]) == 0
+    assert capsys.readouterr().out == ""
+
+
+def test_search_error(db, capsys):
+    """Invalid search syntax should be an error record and exit code 1."""
+    assert search_comments.main(["--index", db, "--text", "AND"]) == 1
+    assert "Invalid search" in json.loads(capsys.readouterr().out)["error"]["message"]
+
+
+def test_search_index_from_environment(db, monkeypatch, capsys):
+    """$GERRIT_INDEX should select the index."""
+    monkeypatch.setenv("GERRIT_INDEX", db)
+    assert search_comments.main(["--file", "src/*.c"]) == 0
+    assert json.loads(capsys.readouterr().out)["count"] == 1
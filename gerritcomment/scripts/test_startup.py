@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""Startup cost tests for the command line scripts.
+
+Fast-fail paths (--help, bad arguments, missing environment) must not load
+the HTTP stack. Each case runs a fresh interpreter with -X importtime.
+
+Run with: pytest test_startup.py -v
+"""
+from __future__ import annotations
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Top-level packages that are only needed once a request is sent
+HEAVY_MODULES = ("gerrit", "requests", "urllib3", "asyncio")
+
+# Generous budget (microseconds) for importing a script, excluding
+# interpreter startup; HEAVY_MODULES is the strict check, this catches
+# slow imports creeping in from elsewhere
+IMPORT_BUDGET_US = 100_000
+
+
+def _run(args: list[str]) -> tuple[int, dict[str, int]]:
+    """Run a script, returning its exit code and cumulative import times."""
+    env = {k: v for k, v in os.environ.items() if not k.startswith("GERRIT_")}
+    env["GERRIT_DAEMON"] = "0"
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", *args],
+        cwd=SCRIPTS_DIR, env=env, capture_output=True, text=True, timeout=60,
+    )
+    imports = {}
+    for line in proc.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            _, cumulative, name = line.split("|")
+            if cumulative.strip().isdigit():
+                imports[name.strip()] = int(cumulative)
+    return proc.returncode, imports
+
+
+# =============================================================================
+# Tests for fast-fail paths
+# =============================================================================
+
+@pytest.mark.parametrize("args, expected_rc", [
+    (["get_comments.py", "--help"], 0),
+    (["get_comments.py", "--bogus"], 2),
+    (["get_comments.py", "--change", "12345"], 1),
+    (["get_comments.py", "--change", "not a url or change"], 1),
+    (["post_comment.py", "--help"], 0),
+    (["post_comment.py", "--change", "12345", "--line", "3"], 1),
+    (["post_comment.py", "--change", "12345", "--message", "LGTM"], 1),
+    (["search_comments.py", "--help"], 0),
+])
+def test_fast_fail_skips_http_stack(args, expected_rc):
+    """Failing before any request should not import the HTTP stack."""
+    rc, imports = _run(args)
+    assert rc == expected_rc
+    assert not [name for name in HEAVY_MODULES if name in imports]
+
+
+@pytest.mark.parametrize("module", ["get_comments", "post_comment", "search_comments"])
+def test_import_time_budget(module):
+    """Importing a script should stay within the startup budget."""
+    rc, imports = _run(["-c", f"import {module}"])
+    assert rc == 0
+    assert imports[module] < IMPORT_BUDGET_US